@@ -0,0 +1,65 @@
+"""
+Measures how long it takes a fresh Python process to import blingalytics
+modules, and which optional dependencies each import drags in. Start-up time
+matters for command-line tools and forked workers, which pay it every time.
+
+Usage::
+
+    python benchmarks/import_time.py [-n RUNS] [module ...]
+
+By default, it times the modules a typical web process imports.
+"""
+from optparse import OptionParser
+import os
+import subprocess
+import sys
+
+
+PROJECT_PATH = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+DEFAULT_MODULES = [
+    'blingalytics',
+    'blingalytics.helpers',
+    'blingalytics.caches.redis_cache',
+    'blingalytics.sources.django_orm',
+]
+OPTIONAL_MODULES = ['sqlite3', 'redis', 'django', 'multiprocessing']
+
+# Run in a fresh interpreter each time, so nothing is already imported
+TIMER = '''
+import sys, time
+start = time.time()
+import %s
+elapsed = time.time() - start
+print elapsed
+print ' '.join(m for m in %r if sys.modules.get(m) is not None)
+'''
+
+
+def time_import(module):
+    # Returns the import time in seconds and the optional modules it loaded
+    env = dict(os.environ, PYTHONPATH=PROJECT_PATH)
+    output = subprocess.Popen(
+        [sys.executable, '-c', TIMER % (module, OPTIONAL_MODULES)],
+        stdout=subprocess.PIPE, env=env).communicate()[0]
+    lines = output.splitlines()
+    if len(lines) != 2:
+        raise RuntimeError('Could not import %s.' % module)
+    return float(lines[0]), lines[1].split()
+
+def main():
+    parser = OptionParser(usage='%prog [-n RUNS] [module ...]')
+    parser.add_option('-n', '--runs', type='int', default=10,
+        help='number of times to import each module (default: 10)')
+    options, modules = parser.parse_args()
+    for module in modules or DEFAULT_MODULES:
+        times = []
+        for i in range(options.runs):
+            elapsed, loaded = time_import(module)
+            times.append(elapsed)
+        times.sort()
+        print '%-36s best %6.1f ms  median %6.1f ms  loads: %s' % (
+            module, times[0] * 1000, times[len(times) // 2] * 1000,
+            ', '.join(loaded) or 'nothing optional')
+
+if __name__ == '__main__':
+    main()
@@ -11,7 +11,8 @@ retrieving your reports.
     defined your report classes have to be imported before the methods below
     will know they exist. You can import them when your code initializes, or
     right before you call the utility functions, or whatever — just be sure to
-    do it.
+    do it. Or, with lots of reports, use :func:`register_report` to have each
+    module imported the first time one of its reports is asked for.
 """
 
 from collections import defaultdict
@@ -26,10 +27,17 @@ def get_report_by_code_name(code_name):
     """
     if code_name is None:
         return None
-    for report in ReportMeta.report_catalog:
-        if getattr(report, 'code_name', None) == code_name:
-            return report
-    return None
+    return ReportMeta.report_catalog.lookup(code_name)
+
+def register_report(code_name, path):
+    """
+    Registers a report class by its dotted path, such as
+    ``'project.reports.RevenueReport'``, without importing it. The report's
+    module is imported the first time the report is asked for by
+    :func:`get_report_by_code_name`, so that large apps don't have to import
+    every report module when they start up.
+    """
+    ReportMeta.report_catalog.register(code_name, path)
 
 def get_reports_by_category():
     """
@@ -37,6 +45,7 @@ def get_reports_by_category():
     as a dict of category strings to lists of report classes.
     """
     categories = defaultdict(list)
+    ReportMeta.report_catalog.load_registered()
     for report in ReportMeta.report_catalog:
         if hasattr(report, 'category'):
             categories[report.category].append(report)
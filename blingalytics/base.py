@@ -21,14 +21,16 @@ how to pull data; :doc:`/formats` for more on formatting report output; and
 import copy
 import hashlib
 import heapq
+from importlib import import_module
 import itertools
 import re
 
 from blingalytics import sources, widgets
-from blingalytics.caches import cache_connection
+from blingalytics.caches import cache_connection, sort_columns
 
 
 DEFAULT_CACHE_TIME = 60 * 30
+DEFAULT_PROGRESS_INTERVAL = 1000
 
 def get_display_name(class_name):
     """
@@ -51,8 +53,53 @@ def get_code_name(class_name):
     """
     return get_display_name(class_name).replace(' ', '_').lower()
 
+class ReportCatalog(list):
+    """
+    The list of all known report classes, indexed by code name. Report
+    classes can also be registered by their dotted path, so that their
+    module is only imported the first time the report is looked up.
+    """
+    def __init__(self, reports=()):
+        super(ReportCatalog, self).__init__()
+        self._index = {}
+        self._paths = {}
+        for report_cls in reports:
+            self.append(report_cls)
+
+    def append(self, report_cls):
+        super(ReportCatalog, self).append(report_cls)
+        # The first report registered with a code name wins
+        self._index.setdefault(getattr(report_cls, 'code_name', None),
+            report_cls)
+
+    def register(self, code_name, path):
+        """
+        Registers the report class at the given dotted path, such as
+        ``'project.reports.RevenueReport'``, under the code name.
+        """
+        self._paths[code_name] = path
+
+    def lookup(self, code_name):
+        """
+        Returns the report class with the given code name, importing it if
+        it has been registered by path, or ``None`` if not found.
+        """
+        report_cls = self._index.get(code_name)
+        if report_cls is None and code_name in self._paths:
+            module_name, class_name = self._paths[code_name].rsplit('.', 1)
+            report_cls = getattr(import_module(module_name), class_name)
+            self._paths.pop(code_name, None)
+            # Defining the class will normally have added it to the index
+            report_cls = self._index.setdefault(code_name, report_cls)
+        return report_cls
+
+    def load_registered(self):
+        """Imports every report class that has been registered by path."""
+        for code_name in self._paths.keys():
+            self.lookup(code_name)
+
 class ReportMeta(type):
-    report_catalog = []
+    report_catalog = ReportCatalog()
 
     def __new__(cls, name, bases, dct):
         # Ensure the report class has a display name and code name
@@ -108,6 +155,13 @@ class Report(object):
         The number of seconds this report should remain valid in the cache.
         If not specified, defaults to ``1800`` (30 minutes).
 
+    ``progress_interval`` *(optional)*
+        While the report is running, its progress is recorded in the cache
+        after every this many rows, so that it can be reported to the user
+        (see :meth:`report_progress`). If not specified, defaults to
+        ``1000``. Set it to ``0`` or ``None`` to record only when the run
+        starts, finishes or fails.
+
     ``keys``
         If your report has just one key, this should be a two-tuple: the name
         of the key column as a string; and the desired key range class or
@@ -186,11 +240,11 @@ class Report(object):
 
     def __init__(self, cache, merge=False):
         self.cache = cache
+        self._choices_memo = {}
 
         # Grab an instance of each of the source types implied by the columns
         self.columns_dict = dict(self.columns)
-        report_sources = set([c.source for c in self.columns_dict.values()])
-        self._sources = [source(self) for source in report_sources]
+        self._sources = [source(self) for source in self._source_types()]
 
         # Set default format labels
         for name, column in self.columns:
@@ -201,8 +255,12 @@ class Report(object):
         self._init_footer()
         self.keys = sources.normalize_key_ranges(self.keys)
         self.cache_time = getattr(self, 'cache_time', DEFAULT_CACHE_TIME)
+        self.progress_interval = getattr(self, 'progress_interval',
+            DEFAULT_PROGRESS_INTERVAL)
+        self._progress = None
         fallback_sort = (self.columns[0][0], 'desc') if self.columns else None
         self.default_sort = getattr(self, 'default_sort', fallback_sort)
+        self._sort_orders = []
         self.dirty_inputs = {}
         self.clean_inputs = {}
         if not merge:
@@ -211,6 +269,14 @@ class Report(object):
     def __repr__(self):
         return '<Report %s %s>' % self.unique_id
 
+    @classmethod
+    def _source_types(cls):
+        # The source types implied by the columns, worked out once per class
+        if '_report_source_types' not in cls.__dict__:
+            cls._report_source_types = list(set(
+                column.source for name, column in cls.columns))
+        return cls._report_source_types
+
     @property
     def unique_id(self):
         """
@@ -225,8 +291,10 @@ class Report(object):
 
         # Otherwise, determine it automatically from the inputs
         widget_unique_ids = []
-        for name, widget in self.widgets:
-            widget_unique_ids.append(widget.get_unique_id(self.dirty_inputs))
+        with widgets.choices_scope(self._choices_memo):
+            for name, widget in self.widgets:
+                widget_unique_ids.append(
+                    widget.get_unique_id(self.dirty_inputs))
         user_input_string = ":".join(sorted(widget_unique_ids))
 
         user_input_hash = hashlib.sha1(user_input_string).hexdigest()[::2]
@@ -239,15 +307,17 @@ class Report(object):
     @classmethod
     def render_widgets(cls):
         """
-        Returns a list of this report's widgets, rendered to HTML.
+        Returns a list of this report's widgets, rendered to HTML. Each
+        widget's HTML is reused until something it depends on changes.
         """
-        return [widget.render() for name, widget in cls.widgets]
+        return [widget.cached_render() for name, widget in cls.widgets]
 
     def get_widget_choices(self):
         widget_choices = {}
-        for key, fil in self.filters:
-            if fil.widget and hasattr(fil.widget, 'choices'):
-                widget_choices[key] = fil.widget.get_choices()
+        with widgets.choices_scope(self._choices_memo):
+            for key, fil in self.filters:
+                if fil.widget and hasattr(fil.widget, 'choices'):
+                    widget_choices[key] = fil.widget.get_choices()
         return widget_choices
 
     def override_widget_choices(self, **kwargs):
@@ -285,20 +355,21 @@ class Report(object):
         dirty_inputs = self.dirty_inputs.copy()
         clean_inputs = {}
         errors = []
-        for name, fil in self.filters:
-            if fil.widget:
-                name = fil.widget.form_name
-                dirty_input = kwargs.get(name, dirty_inputs.get(name, None))
-                if not dirty_input:
-                    name = fil.widget._name
+        with widgets.choices_scope(self._choices_memo):
+            for name, fil in self.filters:
+                if fil.widget:
+                    name = fil.widget.form_name
                     dirty_input = kwargs.get(name, dirty_inputs.get(name, None))
+                    if not dirty_input:
+                        name = fil.widget._name
+                        dirty_input = kwargs.get(name, dirty_inputs.get(name, None))
 
-                try:
-                    clean_input = fil.widget.clean(dirty_input)
-                    clean_inputs[fil.widget._name] = clean_input
-                except widgets.ValidationError as e:
-                    errors.append(e)
-                dirty_inputs[name] = dirty_input
+                    try:
+                        clean_input = fil.widget.clean(dirty_input)
+                        clean_inputs[fil.widget._name] = clean_input
+                    except widgets.ValidationError as e:
+                        errors.append(e)
+                    dirty_inputs[name] = dirty_input
 
         # Only update the report's user_inputs if they are error-free
         self.user_input_errors = errors
@@ -327,7 +398,22 @@ class Report(object):
             itertools.product(*keys)
         )
 
+    def _set_progress(self, stage, key=None):
+        # Records how far along the report run is, for report_progress
+        self._progress = {
+            'stage': stage,
+            'rows': self._row_count,
+            'key': None if key is None else [
+                value if isinstance(value, basestring) else unicode(value)
+                for value in key
+            ],
+        }
+        self.cache.set_instance_progress(self.unique_id[0], self.unique_id[1],
+            self._progress, self.cache_time)
+
     def _get_rows(self):
+        self._set_progress('started')
+
         # Compile all the sources' get_rows
         source_rows = []
         # Tee key rows to save memory while all sources iterate in tandem
@@ -358,6 +444,9 @@ class Report(object):
                             current_row, self.clean_inputs)
                     self._increment_footer(current_row)
                     yield current_row
+                    if self.progress_interval and \
+                            not self._row_count % self.progress_interval:
+                        self._set_progress('rows', current_key)
                 # Start building the next row
                 current_key = key
                 current_row = empty_row.copy()
@@ -373,6 +462,7 @@ class Report(object):
 
         # Mark that the footer has been fully incremented
         self._footer_increment_complete = True
+        self._set_progress('footer')
 
     def _increment_footer(self, row):
         # Increments the column footers by the given row.
@@ -411,9 +501,18 @@ class Report(object):
         """
         # First reset footer totals, in case the same report is run twice
         self._init_footer()
-        self.cache.create_instance(self.unique_id[0], self.unique_id[1],
-            self._get_rows(), self._get_footer, self.cache_time)
+        self._progress = None
+        try:
+            self.cache.create_instance(self.unique_id[0], self.unique_id[1],
+                self._get_rows(), self._get_footer, self.cache_time,
+                sort_orders=self._cache_sort_orders())
+        except Exception:
+            # Only mark the run as failed if this run got started
+            if self._progress is not None:
+                self._set_progress('failed')
+            raise
         self.report_finalize()
+        self._set_progress('finished')
 
     @cache_connection
     def kill_cache(self, full=False):
@@ -425,7 +524,12 @@ class Report(object):
         If you pass in ``full=True``, this will instead perform a full
         report-wide cache invalidation. This means any version of this report
         in cache, regardless of user inputs, will be wiped.
+
+        Sources that cache data of their own, such as merge sub-reports, are
+        invalidated along with the report.
         """
+        for source in self._sources:
+            source.kill_cache(full)
         if full:
             self.cache.kill_report_cache(self.unique_id[0])
             return
@@ -447,6 +551,34 @@ class Report(object):
         """
         return self.cache.is_instance_finished(*self.unique_id)
 
+    @cache_connection
+    def report_progress(self):
+        """
+        Returns the progress of the current or last run of this report, or
+        ``None`` if the cache has no progress recorded for it. The progress is
+        a dict with these keys:
+
+        * ``stage``: One of ``'started'``, ``'rows'`` (while the rows are
+          being processed), ``'footer'``, ``'finished'`` or ``'failed'``.
+        * ``rows``: The number of rows processed so far.
+        * ``key``: For the ``'rows'`` stage, the key of the last row
+          processed, as a list of strings; otherwise, ``None``.
+
+        Progress is only recorded by cache engines that can share it between
+        processes, such as :doc:`/caches/redis_cache`.
+        """
+        return self.cache.instance_progress(*self.unique_id)
+
+    @cache_connection
+    def wait_report_progress(self, last=None, timeout=10):
+        """
+        Waits up to ``timeout`` seconds for the report's progress to change
+        from ``last``, and returns the current progress, as for
+        :meth:`report_progress`.
+        """
+        return self.cache.wait_instance_progress(self.unique_id[0],
+            self.unique_id[1], last, timeout)
+
     @cache_connection
     def report_row_count(self):
         """
@@ -514,8 +646,10 @@ class Report(object):
         * ``sort``: This is a two-tuple to specify the sorting on the table,
           in the same format as the ``default_sort`` attribute on reports.
           That is, the first element should be the label of the column and the
-          second should be either ``'asc'`` or ``'desc'``. Defaults to the
-          sorting specified in the report's ``default_sort`` attribute.
+          second should be either ``'asc'`` or ``'desc'``. To sort on several
+          columns in turn, provide a list of these two-tuples instead.
+          Defaults to the sorting specified in the report's ``default_sort``
+          attribute.
         * ``limit``: The number of rows to return. Defaults to ``None``, which
           does not limit the results.
         * ``offset``: The number of rows offset at which to start returning
@@ -530,28 +664,103 @@ class Report(object):
         """
         # Query for the raw row data
         sort = sort or self.default_sort
-        alpha = getattr(dict(self.columns)[sort[0]], 'sort_alpha', False)
         raw_rows = self.cache.instance_rows(self.unique_id[0],
             self.unique_id[1], selected=selected_rows, sort=sort, limit=limit,
-            offset=offset, alpha=alpha)
-
-        # Format the row data
-        formatted_rows = []
-        for raw_row in raw_rows:
-            formatted_row = []
+            offset=offset, alpha=self._sort_alpha(sort))
+        return self._format_rows(raw_rows, format)
+
+    def _sort_alpha(self, sort):
+        # Whether the sort column should sort as text, or for a list of sort
+        # columns, a list saying so for each
+        if isinstance(sort[0], basestring):
+            return getattr(self.columns_dict[sort[0]], 'sort_alpha', False)
+        return [
+            getattr(self.columns_dict[column], 'sort_alpha', False)
+            for column, direction in sort
+        ]
+
+    def _cache_sort_orders(self):
+        # The sorts on several columns the report will be read in, for the
+        # cache to work out ahead of time: the default sort, and any added
+        # by merge reports reading this one
+        sorts = list(self._sort_orders)
+        if self.default_sort and not isinstance(self.default_sort[0], basestring) \
+                and list(self.default_sort) not in sorts:
+            sorts.append(self.default_sort)
+        return [
+            sort_columns(sort, self._sort_alpha(sort))
+            for sort in sorts if len(sort) > 1
+        ]
+
+    def _format_rows(self, raw_rows, format):
+        # Format the row data a column at a time (first column is always the
+        # row id)
+        raw_rows = list(raw_rows)
+        formatted_columns = [[raw_row['_bling_id'] for raw_row in raw_rows]]
+        for name, column in self.columns:
+            formatted_columns.append(column.format.format_many(
+                [raw_row[name] for raw_row in raw_rows], format))
 
-            # First column is always the row id
-            formatted_row.append(raw_row['_bling_id'])
+        return map(list, zip(*formatted_columns))
 
-            # Format and append the report columns
-            for name, column in self.columns:
-                format_fn = getattr(column.format, 'format_%s' % format,
-                    column.format.format)
-                formatted_cell = format_fn(raw_row[name])
-                formatted_row.append(formatted_cell)
-            formatted_rows.append(formatted_row)
+    @cache_connection
+    def report_page(self, sort=None, limit=None, offset=0, format='html'):
+        """
+        Returns everything needed to display one page of the report from
+        cache, fetched from the cache in a single call. Accepts the ``sort``,
+        ``limit``, ``offset`` and ``format`` arguments, as for
+        :meth:`report_rows`.
+
+        Returns a dict with these keys:
+
+        * ``rows``: The formatted rows, as returned by :meth:`report_rows`.
+        * ``row_count``: The total number of rows in the report.
+        * ``footer``: The formatted footer row, as returned by
+          :meth:`report_footer`.
+        * ``timestamp``: When the report was run, as returned by
+          :meth:`report_timestamp`.
+        """
+        page = self.cache.instance_page(self.unique_id[0], self.unique_id[1],
+            **self._page_query(sort, limit, offset))
+        return self._format_page(page, format)
 
-        return formatted_rows
+    def _page_query(self, sort, limit, offset):
+        # The cache arguments for reading a page of the report
+        sort = sort or self.default_sort
+        return dict(sort=sort, limit=limit, offset=offset,
+            alpha=self._sort_alpha(sort))
+
+    def _format_page(self, page, format):
+        return {
+            'rows': self._format_rows(page['rows'], format),
+            'row_count': page['row_count'],
+            'footer': self._format_footer(page['footer'], format),
+            'timestamp': page['timestamp'],
+        }
+
+    def iter_report_pages(self, sort=None, format='html', page_size=1000):
+        """
+        Iterates over all the formatted rows for the report from cache, a page
+        at a time, so that large reports never have to be held in memory all
+        at once. Accepts these optional arguments:
+
+        * ``sort``: As for :meth:`report_rows`. Defaults to the sorting
+          specified in the report's ``default_sort`` attribute.
+        * ``format``: As for :meth:`report_rows`. Defaults to ``'html'``.
+        * ``page_size``: The number of rows to read from cache at a time.
+          Defaults to ``1000``.
+
+        Each page is a list of rows, as returned by :meth:`report_rows`. The
+        rows are sorted once and read from that one result, rather than
+        sorted again for every page. The cache connection is held open until
+        the iteration is finished.
+        """
+        sort = sort or self.default_sort
+        with self.cache:
+            for raw_rows in self.cache.instance_row_pages(self.unique_id[0],
+                    self.unique_id[1], sort=sort, page_size=page_size,
+                    alpha=self._sort_alpha(sort)):
+                yield self._format_rows(raw_rows, format)
 
     def report_finalize(self):
         """
@@ -576,13 +785,14 @@ class Report(object):
         """
         # Query for the footer data
         footer_row = self.cache.instance_footer(*self.unique_id)
+        return self._format_footer(footer_row, format)
 
+    def _format_footer(self, footer_row, format):
         # Format the footer data (first is always the row id)
         formatted_footer = [None]
         for key, column in self.columns:
             if column.footer:
-                format_fn = getattr(column.format, 'format_%s' % format,
-                    column.format.format)
+                format_fn = column.format.get_formatter(format)
                 formatted_cell = format_fn(footer_row[key])
                 formatted_footer.append(formatted_cell)
             else:
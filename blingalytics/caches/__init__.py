@@ -9,8 +9,18 @@ it has no dependencies outside of Python and simply caches to the local
 filesystem. However, it cannot handle concurrent connections and is generally
 a poor choice outside of the development environment. At the moment, the
 preferred choice for deployment is :doc:`/caches/redis_cache`.
+
+Every cache engine can also export a finished report instance as a portable
+snapshot with ``export_instance``, and load a snapshot from any other engine
+with ``import_instance``. This lets you compute expensive reports on a batch
+machine and ship the results to your web servers without recomputing them.
 """
+from datetime import datetime
 from functools import wraps
+import itertools
+import time
+
+from blingalytics.utils import snapshot
 
 
 class InstanceLockError(Exception):
@@ -29,7 +39,14 @@ class Cache(object):
     def __exit__(self, exc_type, exc_value, traceback):
         pass
 
-    def create_instance(self, report_id, instance_id, rows, footer, expire):
+    def create_instance(self, report_id, instance_id, rows, footer, expire, timestamp=None, sort_orders=None):
+        """
+        Stores a finished instance's rows and footer. The ``sort_orders`` are
+        sorts on several columns, each as returned by :func:`sort_columns`,
+        that the instance will be read in. Cache engines that can work them
+        out ahead of time do so, so that reading a page sorted that way, or
+        the exact reverse way, doesn't have to sort the whole instance.
+        """
         raise NotImplementedError
 
     def kill_instance_cache(self, report_id, instance_id):
@@ -51,11 +68,166 @@ class Cache(object):
         raise NotImplementedError
 
     def instance_rows(self, report_id, instance_id, selected=None, sort=None, limit=None, offset=None, alpha=False):
+        """
+        Returns the instance's rows, optionally limited to the ``selected``
+        row ids and sorted. The ``sort`` is a ``(column, direction)`` tuple,
+        or a list of them to sort on several columns in turn; ``alpha`` says
+        whether to sort as text, for every sort column or as a list with a
+        flag for each. See :func:`sort_columns`.
+        """
         raise NotImplementedError
 
     def instance_footer(self, report_id, instance_id):
         raise NotImplementedError
 
+    def instance_expiration(self, report_id, instance_id):
+        raise NotImplementedError
+
+    def instance_page(self, report_id, instance_id, sort=None, limit=None, offset=None, alpha=False):
+        """
+        Returns everything needed to display one page of a finished instance,
+        as a dict with the page's ``rows``, the instance's total
+        ``row_count``, its ``footer`` and its ``timestamp``. Cache engines
+        can override this to fetch it all in one go.
+        """
+        return {
+            'rows': list(self.instance_rows(report_id, instance_id,
+                sort=sort, limit=limit, offset=offset, alpha=alpha)),
+            'row_count': self.instance_row_count(report_id, instance_id),
+            'footer': self.instance_footer(report_id, instance_id),
+            'timestamp': self.instance_timestamp(report_id, instance_id),
+        }
+
+    def instance_row_pages(self, report_id, instance_id, sort=None, page_size=1000, alpha=False):
+        """
+        Iterates over all of a finished instance's rows, sorted as for
+        :meth:`instance_rows`, in lists of up to ``page_size`` rows. The
+        instance is only sorted once, rather than once for every page. By
+        default, this reads a single :meth:`instance_rows` result a page at a
+        time; cache engines override it where that would load every row at
+        once.
+        """
+        rows = iter(self.instance_rows(report_id, instance_id, sort=sort,
+            alpha=alpha))
+        while True:
+            page = list(itertools.islice(rows, page_size))
+            if not page:
+                return
+            yield page
+
+    def instance_pages(self, pages):
+        """
+        Returns several pages at once, possibly of different instances, so
+        that cache engines can fetch them together. Takes a list of
+        ``(report_id, instance_id, sort, limit, offset, alpha)`` tuples, and
+        returns a list of pages as for :meth:`instance_page`, in the same
+        order, with ``None`` for any instance that isn't finished.
+        """
+        responses = []
+        for report_id, instance_id, sort, limit, offset, alpha in pages:
+            try:
+                responses.append(self.instance_page(report_id, instance_id,
+                    sort=sort, limit=limit, offset=offset, alpha=alpha))
+            except InstanceIncompleteError:
+                responses.append(None)
+        return responses
+
+    def set_instance_progress(self, report_id, instance_id, progress, expire):
+        """
+        Records the progress of an instance that is being created, as a dict,
+        for :meth:`instance_progress` to return. Cache engines that can share
+        it between processes override this; by default, progress is not kept.
+        """
+        pass
+
+    def instance_progress(self, report_id, instance_id):
+        """
+        Returns the last progress recorded for the instance, or ``None``.
+        """
+        return None
+
+    def wait_instance_progress(self, report_id, instance_id, last, timeout, interval=0.25):
+        """
+        Waits up to ``timeout`` seconds for the instance's progress to change
+        from ``last``, and returns the current progress. By default, this
+        checks every ``interval`` seconds; cache engines that can be notified
+        of changes override it.
+        """
+        deadline = time.time() + timeout
+        while True:
+            progress = self.instance_progress(report_id, instance_id)
+            remaining = deadline - time.time()
+            if progress != last or remaining <= 0:
+                return progress
+            time.sleep(min(interval, remaining))
+
+    def export_instance(self, report_id, instance_id):
+        """
+        Returns a snapshot of a finished instance as a compact binary string,
+        holding its rows, footer, timestamp and expiration. The snapshot can
+        be loaded into any cache engine with :meth:`import_instance`.
+        """
+        timestamp = self.instance_timestamp(report_id, instance_id)
+        expiration = self.instance_expiration(report_id, instance_id)
+        footer = self.instance_footer(report_id, instance_id)
+        rows = self.instance_rows(report_id, instance_id)
+        return snapshot.dumps(
+            (dict((k, v) for k, v in row.iteritems() if k != '_bling_id')
+                for row in rows),
+            footer, timestamp, expiration)
+
+    def import_instance(self, report_id, instance_id, data):
+        """
+        Loads a snapshot produced by :meth:`export_instance` on any cache
+        engine into this cache, under the given ids. The instance keeps its
+        original timestamp and expiration.
+        """
+        instance = snapshot.loads(data)
+        expire = None
+        if instance.expiration is not None:
+            expire = int((instance.expiration - datetime.utcnow()).total_seconds())
+            if expire <= 0:
+                raise snapshot.SnapshotError('Snapshot has already expired.')
+        self.create_instance(report_id, instance_id, instance.rows,
+            lambda: instance.footer, expire, timestamp=instance.timestamp)
+
+def sort_columns(sort, alpha=False):
+    """
+    Normalizes the ``sort`` and ``alpha`` arguments given to
+    :meth:`Cache.instance_rows` into a list of ``(column, direction, alpha)``
+    tuples, one for each column to sort on, in order. Returns an empty list
+    if there is no sort.
+    """
+    if not sort:
+        return []
+    if isinstance(sort[0], basestring):
+        sort = [sort]
+    if not isinstance(alpha, (list, tuple)):
+        alpha = [alpha] * len(sort)
+    return [
+        (column, direction, column_alpha)
+        for (column, direction), column_alpha in zip(sort, alpha)
+    ]
+
+def sort_order_key(order):
+    """
+    Returns a string naming the sort ``order``, as returned by
+    :func:`sort_columns`, along with whether the order reads the named one in
+    reverse. An order and its exact reverse share a name, so cache engines
+    only need to work out one of them ahead of time.
+    """
+    reverse = order[0][1] == 'desc'
+    if reverse:
+        order = [
+            (column, 'asc' if direction == 'desc' else 'desc', alpha)
+            for column, direction, alpha in order
+        ]
+    key = ','.join([
+        '%s:%s:%d' % (column, direction, bool(alpha))
+        for column, direction, alpha in order
+    ])
+    return key, reverse
+
 def cache_connection(func):
     """
     Function decorator to run the function within the context of the cache.
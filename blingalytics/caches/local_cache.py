@@ -23,6 +23,7 @@ import itertools
 import sqlite3
 
 from blingalytics import caches
+from blingalytics.utils.codec import RowCodec, SAMPLE_ROWS, sort_key
 from blingalytics.utils.serialize import encode, decode
 
 
@@ -48,18 +49,26 @@ def connection(func):
 
 class LocalCache(caches.Cache):
     """
-    Caches the files locally on the filesystem. Takes just one optional
-    argument:
+    Caches the files locally on the filesystem. Takes two optional
+    arguments:
     
     * ``database``: This is the file where the cache database will be created.
       Defaults to ``/tmp/blingalytics_cache``. Note that this cache will not
       work with SQLite's in-memory database option.
+    * ``binary_rows``: Whether to store each row as a single binary record
+      using a :class:`RowCodec <blingalytics.utils.codec.RowCodec>`, so that
+      reading rows back doesn't decode each value separately. The columns
+      then hold :func:`sort keys <blingalytics.utils.codec.sort_key>`, which
+      sort by their raw bytes. Defaults to ``False``.
     """
     METADATA_TABLE = 'metadata'
+    SCHEMA_TABLE = 'row_schemas'
+    ROW_COLUMN = '_bling_row'
 
-    def __init__(self, database='/tmp/blingalytics_cache'):
+    def __init__(self, database='/tmp/blingalytics_cache', binary_rows=False):
         """Specify the database file, or will use default."""
         self.database = database
+        self.binary_rows = binary_rows
         self._create_metadata_table()
 
     def __repr__(self):
@@ -77,11 +86,20 @@ class LocalCache(caches.Cache):
                 unique (report_id, instance_id)
             )
         ''' % self.METADATA_TABLE)
+        if self.binary_rows:
+            self.conn.execute('''
+                create table if not exists %s (
+                    report_id text,
+                    instance_id text,
+                    schema text,
+                    unique (report_id, instance_id)
+                )
+            ''' % self.SCHEMA_TABLE)
 
     @connection
-    def create_instance(self, report_id, instance_id, rows, footer, expire):
+    def create_instance(self, report_id, instance_id, rows, footer, expire, timestamp=None, sort_orders=None):
         now = datetime.utcnow()
-        expire = now + timedelta(seconds=expire)
+        expire = now + timedelta(seconds=expire) if expire else datetime.max
 
         # Check if the instance already exists
         metas = self.conn.execute('''
@@ -95,33 +113,59 @@ class LocalCache(caches.Cache):
         # Build the table for this instance (will not exist for zero rows)
         table_name = '%s_%s' % (report_id, instance_id)
         self.conn.execute('drop table if exists %s' % table_name)
-        try:
-            first_row = rows.next()
-        except StopIteration:
-            pass
-        else:
-            columns = ', '.join(sorted(first_row.keys()))
-            self.conn.execute('create table %s (%s)' % (table_name, columns))
+        sample = list(itertools.islice(rows, SAMPLE_ROWS))
+        if sample:
+            first_row = sample[0]
+            columns = sorted(first_row.keys())
+            if self.binary_rows:
+                # Derive the row schema from the first rows
+                codec = RowCodec.from_rows(sample)
+                self.conn.execute('''
+                    insert or replace into %s (report_id, instance_id, schema)
+                    values (?, ?, ?)
+                ''' % self.SCHEMA_TABLE, (report_id, instance_id, codec.dumps()))
+                columns.append(self.ROW_COLUMN)
+            self.conn.execute('create table %s (%s)' % (table_name, ', '.join(columns)))
             for column in first_row.keys():
                 self.conn.execute('''
                     create index ix_%s_%s on %s (%s)
                 ''' % (table_name, column, table_name, column))
+            if self.binary_rows:
+                # Sort keys sort on the columns themselves, so an index on
+                # each compound sort order serves it straight from the index
+                for position, order in enumerate(sort_orders or []):
+                    if all([column in first_row
+                            for column, direction, alpha in order]):
+                        self.conn.execute('''
+                            create index ix_%s_order%d on %s (%s)
+                        ''' % (table_name, position, table_name, ', '.join([
+                            '%s %s' % (column, direction)
+                            for column, direction, alpha in order
+                        ])))
 
             # Insert the rows into the table
-            for row in itertools.chain([first_row], rows):
+            for row in itertools.chain(sample, rows):
                 columns, values = zip(*row.items())
+                if self.binary_rows:
+                    # The columns only hold byte-sortable keys, since the
+                    # values themselves come from the binary row
+                    columns += (self.ROW_COLUMN,)
+                    values = [sqlite3.Binary(sort_key(value)) for value in values]
+                    values.append(sqlite3.Binary(codec.encode(row)))
+                else:
+                    values = map(encode, values)
                 columns = ','.join(columns)
                 inserts = ','.join(['?' for value in values])
                 self.conn.execute('''
                     insert into %s (%s) values (%s)
-                ''' % (table_name, columns, inserts), map(encode, values))
+                ''' % (table_name, columns, inserts), values)
 
         # Create the metadata row for the instance
         self.conn.execute('''
             insert or replace into %s
             (report_id, instance_id, created_ts, expires_ts, footer)
             values (?, ?, ?, ?, ?)
-        ''' % self.METADATA_TABLE, (report_id, instance_id, now, expire, encode(footer() or {})))
+        ''' % self.METADATA_TABLE, (report_id, instance_id, timestamp or now, expire, encode(footer() or {})))
 
     @connection
     def kill_instance_cache(self, report_id, instance_id):
@@ -195,27 +239,105 @@ class LocalCache(caches.Cache):
     def instance_rows(self, report_id, instance_id, selected=None, sort=None, limit=None, offset=None, alpha=False):
         if not self.is_instance_finished(report_id, instance_id):
             raise caches.InstanceIncompleteError
+        return self._rows(report_id, instance_id, selected, sort, limit, offset, alpha)
+
+    def _table_exists(self, table_name):
+        # Returns true if the table exists on the current connection
+        tables = self.conn.execute('''
+            select 1 from sqlite_master
+            where type = 'table' and name = ?
+        ''', (table_name,))
+        return tables.fetchone() is not None
+
+    def _rows(self, report_id, instance_id, selected=None, sort=None, limit=None, offset=None, alpha=False):
+        # Queries the rows on the current connection
         self.conn.row_factory = sqlite3.Row
 
         # Construct the query for the rows
         table_name = '%s_%s' % (report_id, instance_id)
-        query = 'select rowid as _bling_id, * from %s ' % table_name
+        if self.binary_rows:
+            query = 'select rowid as _bling_id, %s from %s ' % (
+                self.ROW_COLUMN, table_name)
+        else:
+            query = 'select rowid as _bling_id, * from %s ' % table_name
         if selected:
-            selected_ids = ','.join([str(id) for id in selected])
-            query += 'where rowid in (%s) '
-        cast = 'text' if alpha else 'real'
-        query += 'order by cast(%s as %s) %s ' % (sort[0], cast, sort[1])
+            selected_ids = ','.join([str(int(id)) for id in selected])
+            query += 'where rowid in (%s) ' % selected_ids
+        order = caches.sort_columns(sort, alpha)
+        if order and self.binary_rows:
+            query += 'order by %s ' % ', '.join([
+                '%s %s' % (column, direction)
+                for column, direction, column_alpha in order
+            ])
+        elif order:
+            query += 'order by %s ' % ', '.join([
+                'cast(%s as %s) %s' % (column,
+                    'text' if column_alpha else 'real', direction)
+                for column, direction, column_alpha in order
+            ])
+        else:
+            query += 'order by rowid '
         if limit:
             query += 'limit %d ' % limit
+        elif offset:
+            # SQLite only accepts an offset along with a limit
+            query += 'limit -1 '
         if offset:
             query += 'offset %d ' % offset
 
+        if not self._table_exists(table_name):
+            # If we have a metadata record but no table, there were no rows
+            # to cache
+            return iter([])
+        rows = self.conn.execute(query)
+
         # Decode and return the rows
+        if self.binary_rows:
+            schema = self.conn.execute('''
+                select schema from %s
+                where report_id = ? and instance_id = ?
+            ''' % self.SCHEMA_TABLE, (report_id, instance_id))
+            codec = RowCodec.loads(schema.next()[0])
+            def decode_row(row):
+                values = codec.decode(str(row[1]))
+                values['_bling_id'] = row[0]
+                return values
+            return itertools.imap(decode_row, rows)
         return itertools.imap(
             lambda row: dict(zip(row.keys(), [row[0]] + map(decode, list(row)[1:]))),
-            self.conn.execute(query)
+            rows
         )
 
+    @connection
+    def instance_page(self, report_id, instance_id, sort=None, limit=None, offset=None, alpha=False):
+        # Fetch all the metadata in a single query
+        metas = self.conn.execute('''
+            select created_ts, expires_ts, footer from %s
+            where report_id = ? and instance_id = ?
+        ''' % self.METADATA_TABLE, (report_id, instance_id))
+        for timestamp, expiration, footer in metas:
+            if expiration > datetime.utcnow():
+                break
+        else:
+            raise caches.InstanceIncompleteError
+
+        table_name = '%s_%s' % (report_id, instance_id)
+        try:
+            row_count = self.conn.execute(
+                'select count(*) from %s' % table_name).next()[0]
+        except sqlite3.OperationalError:
+            # If we have a metadata record but no table, there were no rows
+            # to cache
+            row_count = 0
+
+        return {
+            'rows': list(self._rows(report_id, instance_id, sort=sort,
+                limit=limit, offset=offset, alpha=alpha)) if row_count else [],
+            'row_count': row_count,
+            'footer': decode(footer),
+            'timestamp': timestamp,
+        }
+
     @connection
     def instance_footer(self, report_id, instance_id):
         if not self.is_instance_finished(report_id, instance_id):
@@ -225,3 +347,14 @@ class LocalCache(caches.Cache):
             where report_id = ? and instance_id = ?
         ''' % self.METADATA_TABLE, (report_id, instance_id))
         return decode(footer.next()[0])
+
+    @connection
+    def instance_expiration(self, report_id, instance_id):
+        if not self.is_instance_finished(report_id, instance_id):
+            raise caches.InstanceIncompleteError
+        expiration = self.conn.execute('''
+            select expires_ts from %s
+            where report_id = ? and instance_id = ?
+        ''' % self.METADATA_TABLE, (report_id, instance_id))
+        expiration = expiration.next()[0]
+        return None if expiration == datetime.max else expiration
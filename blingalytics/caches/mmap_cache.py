@@ -0,0 +1,403 @@
+"""
+The memory-mapped cache engine stores each finished report instance on the
+local disk as a set of columnar files: one array per column, plus a
+pre-computed sort order for each column and for each of the instance's
+compound sort orders. Reads memory-map those files, so
+paging through a sorted report only touches the parts of the files it needs,
+and every worker process on the machine shares the operating system's page
+cache rather than holding its own copy.
+
+This is a good fit when your web workers and your report runners share a
+machine (or a filesystem) and you want fast, concurrent reads without running
+a database. The trade-offs:
+
+* *Local storage*. The files live in a directory on the local filesystem, so
+  every process that reads a report must be able to see that directory.
+* *Write once*. An instance's rows are collected in memory and written out
+  in one go when the report finishes running.
+* *Natural sorting*. Columns sort on their Python values rather than on any
+  alpha or numeric coercion, with empty values sorting first.
+"""
+
+from calendar import timegm
+from datetime import datetime
+import errno
+import json
+import mmap
+import os
+import shutil
+import struct
+import time
+from urllib import quote
+
+from blingalytics import caches
+from blingalytics.utils.collections import LRUCache
+from blingalytics.utils.serialize import encode, decode
+
+
+INT_MIN = -2 ** 63
+INT_MAX = 2 ** 63 - 1
+CHUNK_SIZE = 4096
+
+# Column storage kinds: packed 64-bit ints, packed 64-bit floats, or
+# variable-length values in the standard serialized encoding
+INT, FLOAT, VARIABLE = 'q', 'd', 'v'
+
+
+def _write_packed(path, code, values):
+    # Writes the values as a little-endian packed array, a chunk at a time
+    with open(path, 'wb') as f:
+        for start in xrange(0, len(values), CHUNK_SIZE):
+            chunk = values[start:start + CHUNK_SIZE]
+            f.write(struct.pack('<%d%s' % (len(chunk), code), *chunk))
+
+def _column_kind(values):
+    # Picks the most compact storage that holds every value in the column
+    kinds = set()
+    for value in values:
+        t = type(value)
+        if t in (int, long) and INT_MIN <= value <= INT_MAX:
+            kinds.add(INT)
+        elif t is float:
+            kinds.add(FLOAT)
+        elif value is not None:
+            return VARIABLE
+    if len(kinds) == 1:
+        return kinds.pop()
+    return VARIABLE if kinds else INT
+
+def _ranks(order, value):
+    # Works out the rank of each row from the row ids in sort order, giving
+    # rows with equal values the same rank
+    ranks = [0] * len(order)
+    rank = previous = None
+    for position, row_id in enumerate(order):
+        current = value(row_id)
+        if rank is None or current != previous:
+            rank = position
+        ranks[row_id] = rank
+        previous = current
+    return ranks
+
+class _Instance(object):
+    """Read-only, memory-mapped view of one cached instance."""
+    def __init__(self, path, meta):
+        self.path = path
+        self.meta = meta
+        self.row_count = meta['row_count']
+        self.columns = meta['columns']
+        self._maps = {}
+
+    def _map(self, name):
+        try:
+            return self._maps[name]
+        except KeyError:
+            with open(os.path.join(self.path, name), 'rb') as f:
+                self._maps[name] = mmap.mmap(f.fileno(), 0,
+                    access=mmap.ACCESS_READ)
+            return self._maps[name]
+
+    def order(self, name, offset, limit, desc):
+        # Returns row ids for a slice of the sort order in the named file
+        if offset >= self.row_count:
+            return ()
+        if limit is None:
+            limit = self.row_count
+        if desc:
+            end = self.row_count - offset
+            start = max(end - limit, 0)
+        else:
+            start = offset
+            end = min(start + limit, self.row_count)
+        ids = struct.unpack_from('<%dq' % (end - start),
+            self._map(name), start * 8)
+        return reversed(ids) if desc else ids
+
+    def ranks(self, index):
+        # Returns each row's position in the column's sort order, where equal
+        # values share a position
+        return struct.unpack_from('<%dq' % self.row_count,
+            self._map('%d.rank' % index))
+
+    def value(self, index, row_id):
+        name, kind, has_nulls = self.columns[index]
+        if kind == VARIABLE:
+            start, end = struct.unpack_from('<2q',
+                self._map('%d.off' % index), row_id * 8)
+            return decode(self._map('%d.col' % index)[start:end])
+        if has_nulls and self._map('%d.nul' % index)[row_id] == '\x01':
+            return None
+        return struct.unpack_from('<' + kind, self._map('%d.col' % index),
+            row_id * 8)[0]
+
+    def row(self, row_id):
+        row = {'_bling_id': row_id}
+        for index, (name, kind, has_nulls) in enumerate(self.columns):
+            row[name] = self.value(index, row_id)
+        return row
+
+class MmapCache(caches.Cache):
+    """
+    Caches computed reports as memory-mapped columnar files on the local
+    filesystem. Takes two optional arguments:
+
+    * ``directory``: The directory the report files will be written under.
+      Defaults to ``/tmp/blingalytics_mmap``.
+    * ``max_open``: The number of instances each process keeps mapped at
+      once. Defaults to ``64``.
+    """
+    META_FILE = 'meta'
+
+    def __init__(self, directory='/tmp/blingalytics_mmap', max_open=64):
+        self.directory = directory
+        self._open = LRUCache(max_open)
+
+    def __repr__(self):
+        return '<MmapCache %s>' % self.directory
+
+    def _report_path(self, report_id):
+        return os.path.join(self.directory, quote(str(report_id), safe=''))
+
+    def _instance_path(self, report_id, instance_id):
+        return os.path.join(self._report_path(report_id),
+            quote(str(instance_id), safe=''))
+
+    def _read_meta(self, path):
+        # Returns the instance's metadata if it exists and has not expired
+        try:
+            with open(os.path.join(path, self.META_FILE), 'rb') as f:
+                meta = json.load(f)
+        except IOError:
+            return None
+        if meta['expires'] is not None and meta['expires'] <= time.time():
+            return None
+        return meta
+
+    def _instance(self, report_id, instance_id):
+        # Returns the mapped instance, reusing an open one if it is current
+        path = self._instance_path(report_id, instance_id)
+        meta = self._read_meta(path)
+        if meta is None:
+            raise caches.InstanceIncompleteError
+        instance = self._open.get(path)
+        if instance is None or instance.meta['created'] != meta['created']:
+            instance = _Instance(path, meta)
+            self._open.set(path, instance)
+        return instance
+
+    def create_instance(self, report_id, instance_id, rows, footer, expire, timestamp=None, sort_orders=None):
+        path = self._instance_path(report_id, instance_id)
+        lock_path = path + '.lock'
+        try:
+            os.makedirs(lock_path)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+            raise caches.InstanceLockError('Instance already locked')
+
+        try:
+            if self._read_meta(path) is not None:
+                raise caches.InstanceExistsError('Instance already cached')
+
+            # Collect the rows into columns
+            names = None
+            columns = []
+            for row in rows:
+                if names is None:
+                    names = sorted(row.keys())
+                    columns = [[] for name in names]
+                for name, column in zip(names, columns):
+                    column.append(row[name])
+
+            # Write out each column and its sort order to a temp directory
+            temp_path = os.path.join(lock_path, 'instance')
+            os.mkdir(temp_path)
+            column_meta = []
+            column_ranks = {}
+            for index, (name, values) in enumerate(zip(names or [], columns)):
+                kind = _column_kind(values)
+                has_nulls = None in values
+                column_path = os.path.join(temp_path, '%d.col' % index)
+                if kind == VARIABLE:
+                    offsets = [0]
+                    with open(column_path, 'wb') as f:
+                        for value in values:
+                            data = encode(value)
+                            f.write(data)
+                            offsets.append(offsets[-1] + len(data))
+                    _write_packed(os.path.join(temp_path, '%d.off' % index),
+                        'q', offsets)
+                else:
+                    _write_packed(column_path, kind,
+                        [0 if value is None else value for value in values])
+                    if has_nulls:
+                        with open(os.path.join(temp_path, '%d.nul' % index), 'wb') as f:
+                            f.write(''.join([
+                                '\x01' if value is None else '\x00'
+                                for value in values
+                            ]))
+                order = sorted(xrange(len(values)), key=values.__getitem__)
+                _write_packed(os.path.join(temp_path, '%d.asc' % index), 'q',
+                    order)
+                column_ranks[name] = _ranks(order, values.__getitem__)
+                _write_packed(os.path.join(temp_path, '%d.rank' % index), 'q',
+                    column_ranks[name])
+                column_meta.append((name, kind, has_nulls))
+
+            # Write out the compound sort orders, sorting on the columns'
+            # ranks, which are equal for equal values
+            orders = {}
+            for order in sort_orders or []:
+                key, reverse = caches.sort_order_key(order)
+                if key in orders or not all([
+                        column in column_ranks
+                        for column, direction, alpha in order]):
+                    continue
+                ranks = [
+                    (column_ranks[column], direction == 'desc')
+                    for column, direction, alpha in order
+                ]
+                ids = sorted(xrange(len(columns[0])), key=lambda row_id: tuple([
+                    -rank[row_id] if desc else rank[row_id]
+                    for rank, desc in ranks
+                ]), reverse=reverse)
+                orders[key] = 'o%d.asc' % len(orders)
+                _write_packed(os.path.join(temp_path, orders[key]), 'q', ids)
+
+            now = time.time()
+            if timestamp:
+                timestamp = timegm(timestamp.utctimetuple()) \
+                    + timestamp.microsecond / 1e6
+            meta = {
+                'created': now,
+                'timestamp': timestamp or now,
+                'expires': now + expire if expire else None,
+                'row_count': len(columns[0]) if columns else 0,
+                'columns': column_meta,
+                'orders': orders,
+                'footer': encode(footer() or {}),
+            }
+            with open(os.path.join(temp_path, self.META_FILE), 'wb') as f:
+                json.dump(meta, f)
+
+            # Swap the finished instance into place
+            shutil.rmtree(path, ignore_errors=True)
+            os.rename(temp_path, path)
+        finally:
+            shutil.rmtree(lock_path, ignore_errors=True)
+
+    def kill_instance_cache(self, report_id, instance_id):
+        path = self._instance_path(report_id, instance_id)
+        if os.path.exists(path + '.lock'):
+            raise caches.InstanceLockError('Instance already locked')
+        shutil.rmtree(path, ignore_errors=True)
+
+    def kill_report_cache(self, report_id):
+        shutil.rmtree(self._report_path(report_id), ignore_errors=True)
+
+    def is_instance_started(self, report_id, instance_id):
+        path = self._instance_path(report_id, instance_id)
+        return os.path.exists(path + '.lock') \
+            or self._read_meta(path) is not None
+
+    def is_instance_finished(self, report_id, instance_id):
+        path = self._instance_path(report_id, instance_id)
+        return self._read_meta(path) is not None
+
+    def instance_row_count(self, report_id, instance_id):
+        return self._instance(report_id, instance_id).row_count
+
+    def instance_timestamp(self, report_id, instance_id):
+        instance = self._instance(report_id, instance_id)
+        return datetime.utcfromtimestamp(instance.meta['timestamp'])
+
+    def instance_rows(self, report_id, instance_id, selected=None, sort=None, limit=None, offset=None, alpha=False):
+        instance = self._instance(report_id, instance_id)
+        return self._rows(instance, selected, sort, limit, offset, alpha)
+
+    def instance_row_pages(self, report_id, instance_id, sort=None, page_size=1000, alpha=False):
+        # Find the row ids in order once, then read the rows a page at a time
+        instance = self._instance(report_id, instance_id)
+        ids = list(self._ids(instance, sort=sort, alpha=alpha))
+        for start in xrange(0, len(ids), page_size):
+            yield [instance.row(row_id)
+                for row_id in ids[start:start + page_size]]
+
+    def _rows(self, instance, selected=None, sort=None, limit=None, offset=None, alpha=False):
+        return [
+            instance.row(row_id) for row_id
+            in self._ids(instance, selected, sort, limit, offset, alpha)
+        ]
+
+    def _ids(self, instance, selected=None, sort=None, limit=None, offset=None, alpha=False):
+        # Returns the ids of the instance's rows in the requested order
+        offset = offset or 0
+
+        # Find the row ids in the requested order
+        names = [name for name, kind, has_nulls in instance.columns]
+        sort = [
+            (column, direction, column_alpha)
+            for column, direction, column_alpha
+            in caches.sort_columns(sort, alpha)
+            if column in names
+        ]
+        order = [
+            (names.index(column), direction == 'desc')
+            for column, direction, column_alpha in sort
+        ]
+        if len(order) > 1:
+            key, reverse = caches.sort_order_key(sort)
+        if len(order) > 1 and not selected and key in instance.meta['orders']:
+            # Slice the precomputed compound sort order
+            ids = instance.order(instance.meta['orders'][key], offset, limit,
+                reverse)
+        elif len(order) > 1:
+            # Sort on the columns' ranks, which are equal for equal values
+            ranks = [(instance.ranks(index), desc) for index, desc in order]
+            ids = xrange(instance.row_count)
+            if selected:
+                ids = sorted(set(map(int, selected)))
+            ids = sorted(ids, key=lambda row_id: tuple([
+                -column_ranks[row_id] if desc else column_ranks[row_id]
+                for column_ranks, desc in ranks
+            ]))
+            ids = ids[offset:offset + limit if limit else None]
+        elif order:
+            index, desc = order[0]
+            if selected:
+                selected = set(map(int, selected))
+                ids = [
+                    row_id for row_id
+                    in instance.order('%d.asc' % index, 0, None, desc)
+                    if row_id in selected
+                ]
+                ids = ids[offset:offset + limit if limit else None]
+            else:
+                ids = instance.order('%d.asc' % index, offset, limit, desc)
+        else:
+            if selected:
+                ids = sorted(map(int, selected))
+            else:
+                ids = xrange(instance.row_count)
+            ids = list(ids)[offset:offset + limit if limit else None]
+        return ids
+
+    def instance_page(self, report_id, instance_id, sort=None, limit=None, offset=None, alpha=False):
+        instance = self._instance(report_id, instance_id)
+        return {
+            'rows': self._rows(instance, sort=sort, limit=limit, offset=offset,
+                alpha=alpha),
+            'row_count': instance.row_count,
+            'footer': decode(instance.meta['footer']),
+            'timestamp': datetime.utcfromtimestamp(instance.meta['timestamp']),
+        }
+
+    def instance_footer(self, report_id, instance_id):
+        instance = self._instance(report_id, instance_id)
+        return decode(instance.meta['footer'])
+
+    def instance_expiration(self, report_id, instance_id):
+        instance = self._instance(report_id, instance_id)
+        if instance.meta['expires'] is None:
+            return None
+        return datetime.utcfromtimestamp(instance.meta['expires'])
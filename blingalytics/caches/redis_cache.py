@@ -10,20 +10,21 @@ a simple dev environment.
 
 """
 
-from datetime import datetime
+from datetime import datetime, timedelta
 from decimal import Decimal
 import itertools
 import hashlib
 import sys
-
-import redis
+import threading
 
 from blingalytics import caches
+from blingalytics.utils.codec import RowCodec, SAMPLE_ROWS, sort_key
 from blingalytics.utils.serialize import encode, encode_dict, decode, \
     decode_dict
 
 
 REDIS_MAX_INT = long(-sys.float_info.max)
+ORDER_CHUNK_SIZE = 1000
 
 
 class RedisCache(caches.Cache):
@@ -38,31 +39,43 @@ class RedisCache(caches.Cache):
     * ``port``: The port to use when connecting. Defaults to ``6379``.
     * ``db``: Which Redis database to connect to, as an integer. Defaults to
       ``0``.
+
+    It also takes one option of its own:
+
+    * ``binary_rows``: Whether to store each row as a single binary record
+      using a :class:`RowCodec <blingalytics.utils.codec.RowCodec>`, rather
+      than as a hash of individually encoded values. Defaults to ``False``.
     """
-    def __init__(self, **kwargs):
+    def __init__(self, binary_rows=False, **kwargs):
         """
         Accepts the same arguments as redis-py client.
 
         Defaults to localhost:6379 and database 0.
         """
+        self.binary_rows = binary_rows
         self.conn_kwargs = kwargs
         self.conn = None
         self._context_depth = 0
+        self._context_lock = threading.Lock()
 
     def __enter__(self):
         # Track number of nested contexts so you can nest as far as you want
-        # and still share just the one connection
-        if self._context_depth == 0:
-            self.conn = redis.Redis(**self.conn_kwargs)
-        self._context_depth += 1
+        # and still share just the one connection (which is thread-safe, so
+        # reports can be run on several threads at once)
+        with self._context_lock:
+            if self._context_depth == 0:
+                import redis
+                self.conn = redis.Redis(**self.conn_kwargs)
+            self._context_depth += 1
 
     def __exit__(self, exc_type, exc_value, traceback):
         # Close the connection if this is the last open context
-        self._context_depth -= 1
-        if self._context_depth == 0:
-            self.conn.connection_pool.disconnect()
+        with self._context_lock:
+            self._context_depth -= 1
+            if self._context_depth == 0:
+                self.conn.connection_pool.disconnect()
 
-    def create_instance(self, report_id, instance_id, rows, footer, expire):
+    def create_instance(self, report_id, instance_id, rows, footer, expire, timestamp=None, sort_orders=None):
         keys = set()
         table_name = '%s:%s' % (report_id, instance_id)
 
@@ -79,14 +92,35 @@ class RedisCache(caches.Cache):
             # Release lock and raise an error
             self.conn.delete('%s:_lock:' % table_name)
             raise caches.InstanceExistsError('Instance already cached')
-        self.conn['%s:' % table_name] = encode(datetime.utcnow())
+        self.conn['%s:' % table_name] = encode(timestamp or datetime.utcnow())
         keys.add('%s:' % table_name)
 
         # Pipeline the insert operations for speed
         p = self.conn.pipeline(False)
 
+        # Keep the index values of the columns in the compound sort orders,
+        # to work the orders out once the rows are in
+        sort_orders = sort_orders or []
+        sort_values = dict([
+            (column, [])
+            for order in sort_orders for column, direction, alpha in order
+        ])
+
+        if self.binary_rows:
+            # Derive the row schema from the first rows
+            sample = list(itertools.islice(rows, SAMPLE_ROWS))
+            rows = itertools.chain(sample, rows)
+            if sample:
+                codec = RowCodec.from_rows(sample)
+                p.set('%s:schema:' % table_name, codec.dumps())
+                keys.add('%s:schema:' % table_name)
+
+        row_count = 0
         for row_id, row in enumerate(rows):
-            p.hmset('%s:%s' % (table_name, row_id), encode_dict(row))
+            if self.binary_rows:
+                p.set('%s:%s' % (table_name, row_id), codec.encode(row))
+            else:
+                p.hmset('%s:%s' % (table_name, row_id), encode_dict(row))
             keys.add('%s:%s' % (table_name, row_id))
             p.sadd('%s:ids:' % table_name, row_id)
             keys.add('%s:ids:' % table_name)
@@ -94,20 +128,47 @@ class RedisCache(caches.Cache):
             # Index the row
             key = '%s:index:%s:' % (table_name, row_id)
             data = {}
-            for name, value in row.iteritems():
-                t = type(value)
-                if t is unicode:
-                    data[name] = value.encode('utf-8')
-                elif t is Decimal:
-                    data[name] = float(value)
-                elif t in (int, float, long, str):
-                    data[name] = value
-                elif t is type(None):
-                    data[name] = REDIS_MAX_INT  # For sorting
-                else:
-                    data[name] = str(value)
+            if self.binary_rows:
+                # Hex keeps the byte order and is safe for Redis to collate
+                for name, value in row.iteritems():
+                    data[name] = sort_key(value).encode('hex')
+            else:
+                for name, value in row.iteritems():
+                    t = type(value)
+                    if t is unicode:
+                        data[name] = value.encode('utf-8')
+                    elif t is Decimal:
+                        data[name] = float(value)
+                    elif t in (int, float, long, str):
+                        data[name] = value
+                    elif t is type(None):
+                        data[name] = REDIS_MAX_INT  # For sorting
+                    else:
+                        data[name] = str(value)
             p.hmset(key, data)
             keys.add(key)
+            for name, values in sort_values.iteritems():
+                values.append(data.get(name))
+            row_count += 1
+
+        # Store each compound sort order as a list of row ids
+        for order in sort_orders:
+            order_key, reverse = caches.sort_order_key(order)
+            order_key = '%s:order:%s:' % (table_name, order_key)
+            if order_key in keys or not row_count or not all([
+                    column in data for column, direction, alpha in order]):
+                continue
+            index_rows = [
+                [row_id] + [sort_values[column][row_id]
+                    for column, direction, alpha in order]
+                for row_id in xrange(row_count)
+            ]
+            ids = [row[0] for row in self._sort_index_rows(index_rows, order)]
+            if reverse:
+                ids.reverse()
+            for start in xrange(0, len(ids), ORDER_CHUNK_SIZE):
+                p.rpush(order_key, *ids[start:start + ORDER_CHUNK_SIZE])
+            keys.add(order_key)
 
         # Table footer
         if footer:
@@ -175,7 +236,22 @@ class RedisCache(caches.Cache):
         table_name = '%s:%s' % (report_id, instance_id)
         if not self.conn.exists('%s:_done:' % table_name):
             raise caches.InstanceIncompleteError
+        ids = self._instance_ids(table_name, selected, sort, limit, offset,
+            alpha)
+        return self._get_rows(table_name, ids)
+
+    def instance_row_pages(self, report_id, instance_id, sort=None, page_size=1000, alpha=False):
+        # Sort the row ids once, then fetch the rows a page at a time
+        table_name = '%s:%s' % (report_id, instance_id)
+        if not self.conn.exists('%s:_done:' % table_name):
+            raise caches.InstanceIncompleteError
+        ids = self._instance_ids(table_name, None, sort, None, None, alpha)
+        for start in xrange(0, len(ids), page_size):
+            yield list(self._get_rows(table_name,
+                ids[start:start + page_size]))
 
+    def _instance_ids(self, table_name, selected, sort, limit, offset, alpha):
+        # Returns the ids of the instance's rows, sorted by the criteria
         ids_key = '%s:ids:' % table_name
         temp_key = None
 
@@ -194,31 +270,238 @@ class RedisCache(caches.Cache):
                 p.sadd(temp_key, int(row_id))
             p.execute()
 
-        # Parse the sorting criteria
-        by = '%s:index:*:->%s' % (table_name, sort[0]) if sort else None
-        desc = (sort[1] == 'desc')
-        limit = -1 if limit is None else limit
-
         # Get a list of row ids, sorted by the criteria
-        # TODO: Either store alpha t/f per row in redis, or encode numeric values as sortable strings
-        ids = self.conn.sort(ids_key, by=by, desc=desc, start=offset, num=limit, alpha=alpha)
+        p = self.conn.pipeline(False)
+        p.scard(ids_key)
+        self._queue_ids(p, table_name, ids_key, sort, limit, offset, alpha)
+        row_count, ids = p.execute()
+        ids = self._sorted_ids(ids, table_name, ids_key, row_count, sort,
+            limit, offset, alpha)
         if temp_key:
             self.conn.delete(temp_key)
+        return ids
+
+    def _sort_kwargs(self, table_name, sort, limit, offset, alpha):
+        # Parse the sorting criteria into arguments for the sort command
+        order = caches.sort_columns(sort, alpha)
+        if len(order) > 1:
+            # The sort command can only sort by one column, so just get each
+            # row id with its index values for _sorted_ids to sort on
+            return dict(by='nosort', get=['#'] + [
+                '%s:index:*:->%s' % (table_name, column)
+                for column, direction, column_alpha in order
+            ])
+        by = '%s:index:*:->%s' % (table_name, order[0][0]) if order else None
+        desc = bool(order) and (order[0][1] == 'desc')
+        alpha = bool(order) and order[0][2]
+        limit = -1 if limit is None else limit
+        offset = offset or 0
 
-        # Pipeline getting all the requested rows by id
-        p = self.conn.pipeline(False)
+        # TODO: Either store alpha t/f per row in redis, or encode numeric values as sortable strings
+        if self.binary_rows:
+            # Binary rows are indexed by sort keys, which always sort as text
+            alpha = True
+        return dict(by=by, desc=desc, start=offset, num=limit, alpha=alpha)
+
+    def _order_key(self, table_name, order):
+        # Returns the key of the list holding a compound sort order, and
+        # whether to read it in reverse
+        key, reverse = caches.sort_order_key(order)
+        return '%s:order:%s:' % (table_name, key), reverse
+
+    def _queue_ids(self, p, table_name, ids_key, sort, limit, offset, alpha):
+        # Adds the command fetching the sorted row ids to the pipeline: a
+        # slice of the precomputed order for a compound sort of the whole
+        # instance, or otherwise the sort command
+        order = caches.sort_columns(sort, alpha)
+        if len(order) > 1 and ids_key == '%s:ids:' % table_name:
+            key, reverse = self._order_key(table_name, order)
+            offset = offset or 0
+            if not reverse:
+                end = -1 if limit is None else offset + limit - 1
+                p.lrange(key, offset, end)
+            else:
+                start = 0 if limit is None else -(offset + limit)
+                p.lrange(key, start, -(offset + 1))
+        else:
+            p.sort(ids_key,
+                **self._sort_kwargs(table_name, sort, limit, offset, alpha))
+
+    def _sorted_ids(self, result, table_name, ids_key, row_count, sort, limit, offset, alpha):
+        # Returns the row ids fetched by _queue_ids, sorting them here if
+        # there are several columns to sort on and no precomputed order
+        order = caches.sort_columns(sort, alpha)
+        if len(order) < 2:
+            return result
+        offset = offset or 0
+        if ids_key == '%s:ids:' % table_name:
+            reverse = self._order_key(table_name, order)[1]
+            if result or offset >= int(row_count):
+                return result[::-1] if reverse else result
+            # No precomputed order, so fetch every row id and its index
+            # values to sort on
+            result = self.conn.sort(ids_key,
+                **self._sort_kwargs(table_name, sort, limit, offset, alpha))
+        width = len(order) + 1
+        rows = [result[i:i + width] for i in xrange(0, len(result), width)]
+        rows = self._sort_index_rows(rows, order)
+        end = None if limit is None else offset + limit
+        return [row[0] for row in rows[offset:end]]
+
+    def _sort_index_rows(self, rows, order):
+        # Sorts lists of a row id and its index values for each column in
+        # the compound sort order. Sort on the last column first, as each
+        # sort keeps the order of rows that are equal in the column being
+        # sorted on.
+        for position in reversed(xrange(len(order))):
+            column, direction, column_alpha = order[position]
+            if column_alpha or self.binary_rows:
+                key = lambda row: str(row[position + 1])
+            else:
+                key = lambda row: float(row[position + 1])
+            rows.sort(key=key, reverse=(direction == 'desc'))
+        return rows
+
+    def _queue_rows(self, p, table_name, ids):
+        # Adds the commands fetching the rows with the given ids to the
+        # pipeline, and returns how many results they will take
+        if self.binary_rows:
+            # Fetch the schema and the binary rows in one go
+            if not ids:
+                return 0
+            p.get('%s:schema:' % table_name)
+            p.mget(['%s:%s' % (table_name, id) for id in ids])
+            return 2
         for id in ids:
             p.hgetall('%s:%s' % (table_name, id))
+        return len(ids)
+
+    def _decode_rows(self, ids, results):
+        # Decodes the pipeline results for the rows queued by _queue_rows
+        if not ids:
+            rows = iter([])
+        elif self.binary_rows:
+            rows = itertools.imap(RowCodec.loads(results[0]).decode,
+                results[1])
+        else:
+            rows = itertools.imap(decode_dict, results)
 
         # Add the row ids to the rows and return them
-        rows = itertools.imap(decode_dict, p.execute())
         return itertools.imap(
             (lambda id_row: id_row[1].__setitem__('_bling_id', id_row[0]) or id_row[1]),
             itertools.izip(ids, rows)
         )
 
+    def _get_rows(self, table_name, ids):
+        # Fetches the rows with the given ids, in order
+        p = self.conn.pipeline(False)
+        if not self._queue_rows(p, table_name, ids):
+            return iter([])
+        return self._decode_rows(ids, p.execute())
+
+    def set_instance_progress(self, report_id, instance_id, progress, expire):
+        # Store the progress, and let anyone waiting on it know right away
+        key = '%s:%s:progress:' % (report_id, instance_id)
+        progress = encode(progress)
+        p = self.conn.pipeline(False)
+        p.set(key, progress)
+        if expire:
+            p.expire(key, expire)
+        p.publish(key, progress)
+        p.execute()
+
+    def instance_progress(self, report_id, instance_id):
+        progress = self.conn.get('%s:%s:progress:' % (report_id, instance_id))
+        return None if progress is None else decode(progress)
+
+    def wait_instance_progress(self, report_id, instance_id, last, timeout, interval=0.25):
+        # Subscribe on a separate connection, whose socket timeout bounds the
+        # wait for the next update
+        import redis
+        key = '%s:%s:progress:' % (report_id, instance_id)
+        conn = redis.Redis(**dict(self.conn_kwargs, socket_timeout=timeout))
+        pubsub = conn.pubsub()
+        try:
+            pubsub.subscribe(key)
+            for message in pubsub.listen():
+                if message['type'] == 'subscribe':
+                    # Catch any update from before the subscription started
+                    progress = self.instance_progress(report_id, instance_id)
+                    if progress != last:
+                        return progress
+                elif message['type'] == 'message':
+                    return decode(message['data'])
+        except redis.RedisError:
+            # Timed out without an update
+            pass
+        finally:
+            conn.connection_pool.disconnect()
+        return self.instance_progress(report_id, instance_id)
+
+    def instance_page(self, report_id, instance_id, sort=None, limit=None, offset=None, alpha=False):
+        page = self.instance_pages(
+            [(report_id, instance_id, sort, limit, offset, alpha)])[0]
+        if page is None:
+            raise caches.InstanceIncompleteError
+        return page
+
+    def instance_pages(self, pages):
+        # Everything but the rows themselves comes back in one round trip
+        p = self.conn.pipeline(False)
+        for report_id, instance_id, sort, limit, offset, alpha in pages:
+            table_name = '%s:%s' % (report_id, instance_id)
+            p.exists('%s:_done:' % table_name)
+            p.scard('%s:ids:' % table_name)
+            p.get('%s:' % table_name)
+            p.hgetall('%s:footer:' % table_name)
+            self._queue_ids(p, table_name, '%s:ids:' % table_name, sort, limit,
+                offset, alpha)
+        results = p.execute()
+
+        # Then the rows for all the pages in a second round trip
+        p = self.conn.pipeline(False)
+        queued = []
+        for i, page in enumerate(pages):
+            done, row_count, timestamp, footer, ids = results[i * 5:i * 5 + 5]
+            if done:
+                table_name = '%s:%s' % page[:2]
+                ids = self._sorted_ids(ids, table_name,
+                    '%s:ids:' % table_name, row_count, *page[2:])
+                queued.append((ids, self._queue_rows(p, table_name, ids)))
+            else:
+                queued.append(None)
+        rows = p.execute() if sum([entry[1] for entry in queued if entry]) \
+            else []
+
+        responses = []
+        position = 0
+        for i, entry in enumerate(queued):
+            if entry is None:
+                responses.append(None)
+                continue
+            ids, count = entry
+            done, row_count, timestamp, footer = results[i * 5:i * 5 + 4]
+            responses.append({
+                'rows': list(self._decode_rows(ids,
+                    rows[position:position + count])),
+                'row_count': int(row_count),
+                'footer': decode_dict(footer),
+                'timestamp': decode(timestamp),
+            })
+            position += count
+        return responses
+
     def instance_footer(self, report_id, instance_id):
         table_name = '%s:%s' % (report_id, instance_id)
         if not self.conn.exists('%s:_done:' % table_name):
             raise caches.InstanceIncompleteError
         return decode_dict(self.conn.hgetall('%s:footer:' % table_name))
+
+    def instance_expiration(self, report_id, instance_id):
+        table_name = '%s:%s' % (report_id, instance_id)
+        if not self.conn.exists('%s:_done:' % table_name):
+            raise caches.InstanceIncompleteError
+        ttl = self.conn.ttl('%s:_done:' % table_name)
+        if ttl is None or ttl < 0:
+            return None
+        return datetime.utcnow() + timedelta(seconds=ttl)
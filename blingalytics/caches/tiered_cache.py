@@ -0,0 +1,278 @@
+"""
+The tiered cache engine puts a small in-process cache in front of another
+cache engine, such as :doc:`/caches/redis_cache`. Since a cached report
+instance never changes once it has finished being computed, recently read
+instance metadata, pages of rows and footers can be served straight from the
+worker's memory without another round trip to the backing cache.
+
+The in-process tier is dropped for an instance whenever it is killed through
+this cache. If you run several worker processes, each one has its own
+in-process tier, so you will generally also want to provide a pub/sub
+``channel`` so that invalidations reach every worker.
+
+.. note::
+
+    Broadcasting invalidations over a channel requires the wrapped cache to be
+    a :class:`RedisCache <blingalytics.caches.redis_cache.RedisCache>`.
+
+"""
+
+import os
+import threading
+import time
+
+from blingalytics import caches
+from blingalytics.utils.collections import LRUCache
+from blingalytics.utils.serialize import encode, decode
+
+
+class TieredCache(caches.Cache):
+    """
+    Caches recently read report data in process memory, in front of another
+    cache. Takes one required argument:
+
+    * ``cache``: The cache instance to wrap, for example a
+      :class:`RedisCache <blingalytics.caches.redis_cache.RedisCache>`. All
+      writes go straight through to this cache.
+
+    And a few optional arguments:
+
+    * ``max_instances``: The number of report instances to hold in memory.
+      Defaults to ``100``.
+    * ``max_pages``: The number of distinct pages of rows to hold in memory
+      for each instance. Defaults to ``20``.
+    * ``timeout``: The number of seconds an instance stays in memory before
+      it is re-read from the wrapped cache. This bounds how stale a worker can
+      be if it misses an invalidation, or if the instance expires in the
+      wrapped cache. Defaults to ``60``.
+    * ``channel``: The name of a Redis pub/sub channel used to broadcast
+      invalidations to all workers. Defaults to ``None``, which only
+      invalidates the current process.
+    """
+    def __init__(self, cache, max_instances=100, max_pages=20, timeout=60,
+            channel=None):
+        self.cache = cache
+        self.max_pages = max_pages
+        self.channel = channel
+        self._instances = LRUCache(max_instances, timeout)
+        self._listener = None
+        self._listener_pid = None
+
+    def __repr__(self):
+        return '<TieredCache %r>' % self.cache
+
+    def __enter__(self):
+        if self.channel:
+            self._ensure_listener()
+        return self.cache.__enter__()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return self.cache.__exit__(exc_type, exc_value, traceback)
+
+    def _instance(self, report_id, instance_id):
+        # Returns the in-memory entry for a finished instance, if any
+        return self._instances.get((report_id, instance_id))
+
+    def _cached_instance(self, report_id, instance_id):
+        # Returns the in-memory entry for the instance, creating it if the
+        # instance has finished in the wrapped cache
+        instance = self._instance(report_id, instance_id)
+        if instance is None:
+            if not self.cache.is_instance_finished(report_id, instance_id):
+                raise caches.InstanceIncompleteError
+            instance = {'pages': LRUCache(self.max_pages)}
+            self._instances.set((report_id, instance_id), instance)
+        return instance
+
+    def _forget_instance(self, report_id, instance_id):
+        self._instances.pop((report_id, instance_id))
+
+    def _forget_report(self, report_id):
+        for key in self._instances.keys():
+            if key[0] == report_id:
+                self._instances.pop(key)
+
+    def _publish(self, *ids):
+        # Broadcast the invalidation to the other workers
+        if self.channel:
+            self.cache.conn.publish(self.channel, encode(ids))
+
+    def _ensure_listener(self):
+        # Start the subscriber thread, restarting it in forked workers since
+        # threads do not survive a fork
+        if self._listener is not None and self._listener_pid == os.getpid():
+            return
+        self._listener_pid = os.getpid()
+        self._listener = threading.Thread(target=self._listen)
+        self._listener.daemon = True
+        self._listener.start()
+
+    def _listen(self):
+        import redis
+        while True:
+            try:
+                pubsub = redis.Redis(**self.cache.conn_kwargs).pubsub()
+                pubsub.subscribe(self.channel)
+                for message in pubsub.listen():
+                    if message['type'] == 'message':
+                        self._receive(message['data'])
+            except redis.RedisError:
+                # Anything could have been invalidated while disconnected
+                self._instances.clear()
+                time.sleep(1)
+
+    def _receive(self, message):
+        ids = decode(message)
+        if len(ids) == 1:
+            self._forget_report(ids[0])
+        else:
+            self._forget_instance(ids[0], ids[1])
+
+    def create_instance(self, report_id, instance_id, rows, footer, expire, timestamp=None, sort_orders=None):
+        self._forget_instance(report_id, instance_id)
+        self.cache.create_instance(report_id, instance_id, rows, footer,
+            expire, timestamp=timestamp, sort_orders=sort_orders)
+
+    def kill_instance_cache(self, report_id, instance_id):
+        self._forget_instance(report_id, instance_id)
+        self.cache.kill_instance_cache(report_id, instance_id)
+        self._publish(report_id, instance_id)
+
+    def kill_report_cache(self, report_id):
+        self._forget_report(report_id)
+        self.cache.kill_report_cache(report_id)
+        self._publish(report_id)
+
+    def is_instance_started(self, report_id, instance_id):
+        if self._instance(report_id, instance_id) is not None:
+            return True
+        return self.cache.is_instance_started(report_id, instance_id)
+
+    def is_instance_finished(self, report_id, instance_id):
+        if self._instance(report_id, instance_id) is not None:
+            return True
+        return self.cache.is_instance_finished(report_id, instance_id)
+
+    def instance_row_count(self, report_id, instance_id):
+        instance = self._cached_instance(report_id, instance_id)
+        if 'row_count' not in instance:
+            instance['row_count'] = self.cache.instance_row_count(
+                report_id, instance_id)
+        return instance['row_count']
+
+    def instance_timestamp(self, report_id, instance_id):
+        instance = self._cached_instance(report_id, instance_id)
+        if 'timestamp' not in instance:
+            instance['timestamp'] = self.cache.instance_timestamp(
+                report_id, instance_id)
+        return instance['timestamp']
+
+    def _page_key(self, selected, sort, limit, offset, alpha):
+        return (
+            tuple(sorted(selected)) if selected else None,
+            tuple(caches.sort_columns(sort, alpha)),
+            limit,
+            offset,
+        )
+
+    def instance_rows(self, report_id, instance_id, selected=None, sort=None, limit=None, offset=None, alpha=False):
+        instance = self._cached_instance(report_id, instance_id)
+        page_key = self._page_key(selected, sort, limit, offset, alpha)
+        rows = instance['pages'].get(page_key)
+        if rows is None:
+            rows = list(self.cache.instance_rows(report_id, instance_id,
+                selected=selected, sort=sort, limit=limit, offset=offset,
+                alpha=alpha))
+            instance['pages'].set(page_key, rows)
+
+        # Hand out copies so callers can't modify the cached rows
+        return [dict(row) for row in rows]
+
+    def instance_row_pages(self, report_id, instance_id, sort=None, page_size=1000, alpha=False):
+        # Whole instances are read straight from the wrapped cache, rather
+        # than being held in memory
+        return self.cache.instance_row_pages(report_id, instance_id,
+            sort=sort, page_size=page_size, alpha=alpha)
+
+    def instance_page(self, report_id, instance_id, sort=None, limit=None, offset=None, alpha=False):
+        page = self.instance_pages(
+            [(report_id, instance_id, sort, limit, offset, alpha)])[0]
+        if page is None:
+            raise caches.InstanceIncompleteError
+        return page
+
+    def _memory_page(self, instance, page_key):
+        # Returns the page if everything for it is held in memory
+        rows = instance and instance['pages'].get(page_key)
+        if rows is None or 'row_count' not in instance or \
+                'timestamp' not in instance or 'footer' not in instance:
+            return None
+
+        # Hand out copies so callers can't modify the cached rows
+        return {
+            'rows': [dict(row) for row in rows],
+            'row_count': instance['row_count'],
+            'footer': dict(instance['footer']),
+            'timestamp': instance['timestamp'],
+        }
+
+    def instance_pages(self, pages):
+        responses = []
+        missing = []
+        for page in pages:
+            page_key = self._page_key(None, *page[2:])
+            instance = self._instance(*page[:2])
+            response = self._memory_page(instance, page_key)
+            if response is None:
+                missing.append((len(responses), page_key, page))
+            responses.append(response)
+        if not missing:
+            return responses
+
+        # Fill in everything that's missing with one call to the wrapped
+        # cache
+        fetched = self.cache.instance_pages(
+            [page for i, page_key, page in missing])
+        for (i, page_key, page), response in zip(missing, fetched):
+            if response is None:
+                continue
+            instance = self._instance(*page[:2])
+            if instance is None:
+                instance = {'pages': LRUCache(self.max_pages)}
+                self._instances.set(page[:2], instance)
+            instance['pages'].set(page_key, list(response['rows']))
+            instance['row_count'] = response['row_count']
+            instance['timestamp'] = response['timestamp']
+            instance['footer'] = response['footer']
+            responses[i] = dict(response,
+                rows=[dict(row) for row in response['rows']],
+                footer=dict(response['footer']))
+        return responses
+
+    def instance_footer(self, report_id, instance_id):
+        instance = self._cached_instance(report_id, instance_id)
+        if 'footer' not in instance:
+            instance['footer'] = self.cache.instance_footer(
+                report_id, instance_id)
+        return dict(instance['footer'])
+
+    def instance_expiration(self, report_id, instance_id):
+        return self.cache.instance_expiration(report_id, instance_id)
+
+    def set_instance_progress(self, report_id, instance_id, progress, expire):
+        self.cache.set_instance_progress(report_id, instance_id, progress,
+            expire)
+
+    def instance_progress(self, report_id, instance_id):
+        return self.cache.instance_progress(report_id, instance_id)
+
+    def wait_instance_progress(self, report_id, instance_id, last, timeout, interval=0.25):
+        return self.cache.wait_instance_progress(report_id, instance_id,
+            last, timeout, interval)
+
+    def export_instance(self, report_id, instance_id):
+        return self.cache.export_instance(report_id, instance_id)
+
+    def import_instance(self, report_id, instance_id, data):
+        self._forget_instance(report_id, instance_id)
+        self.cache.import_instance(report_id, instance_id, data)
@@ -0,0 +1,10 @@
+"""
+Exporters write a finished report out to a file in some other format, such as
+a spreadsheet. They read the report from its cache a page at a time, so even
+very large reports can be exported without holding them in memory.
+
+To export a report, create the report instance, clean its user inputs and
+make sure it has been run, just as you would before calling
+:meth:`report_rows <blingalytics.base.Report.report_rows>`. Then pass it to
+the exporter's ``write_report`` function.
+"""
@@ -0,0 +1,247 @@
+"""
+Writes reports out as Excel ``.xlsx`` workbooks, with no dependencies outside
+of Python.
+
+Each cell is formatted with its column format's ``format_xls`` method, if it
+has one, and with its usual format method otherwise. Numeric values are
+written as native numeric cells, so money, integer and percent columns can be
+summed and charted in the spreadsheet, and everything else is written as
+text. Column widths are worked out from each column's label, its data type,
+and how wide its values in the first page of rows and the footer display.
+
+The rows are written straight to a temporary file as they are read from the
+cache, and then compressed into the workbook, so exporting uses the same small
+amount of memory however large the report is.
+"""
+
+from decimal import Decimal
+import itertools
+import math
+import os
+import re
+import tempfile
+from xml.sax.saxutils import escape, quoteattr
+import zipfile
+
+from blingalytics.caches import cache_connection
+
+
+# Cell styles, as indexes into the cellXfs list in the styles part
+STYLE_DEFAULT, STYLE_HEADER, STYLE_INTEGER, STYLE_BLING, STYLE_PERCENT = \
+    range(5)
+COLUMN_STYLES = {
+    'integer': STYLE_INTEGER,
+    'bling': STYLE_BLING,
+    'percent': STYLE_PERCENT,
+}
+# Narrowest widths for data types whose values may all be short, so that a
+# longer value outside the sampled rows doesn't show as ####
+TYPE_WIDTHS = {
+    'bling': 14,
+    'decimal': 12,
+    'integer': 12,
+    'percent': 10,
+    'date': 12,
+    'epoch': 12,
+    'month': 10,
+    'time': 10,
+    'timedelta': 16,
+}
+NUMBER_FORMATS = {
+    STYLE_INTEGER: '{0:,.0f}',
+    STYLE_BLING: '{0:,.2f}',
+    STYLE_PERCENT: '{0:.2%}',
+}
+MIN_WIDTH = 10
+MAX_WIDTH = 60
+NUMBER_TYPES = (int, long, float, Decimal)
+SHEET_NAME_INVALID = re.compile(r'[\[\]:*?/\\]')
+XML_INVALID = re.compile(u'[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+CONTENT_TYPES = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="xml" ContentType="application/xml"/>
+<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>
+<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>
+<Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>
+</Types>'''
+ROOT_RELS = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>
+</Relationships>'''
+WORKBOOK = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">
+<sheets><sheet name=%s sheetId="1" r:id="rId1"/></sheets>
+</workbook>'''
+WORKBOOK_RELS = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>
+<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>
+</Relationships>'''
+STYLES = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">
+<fonts count="2"><font><sz val="11"/><name val="Calibri"/></font><font><b/><sz val="11"/><name val="Calibri"/></font></fonts>
+<fills count="2"><fill><patternFill patternType="none"/></fill><fill><patternFill patternType="gray125"/></fill></fills>
+<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>
+<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>
+<cellXfs count="5">
+<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>
+<xf numFmtId="0" fontId="1" fillId="0" borderId="0" xfId="0" applyFont="1"/>
+<xf numFmtId="3" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>
+<xf numFmtId="4" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>
+<xf numFmtId="10" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>
+</cellXfs>
+</styleSheet>'''
+SHEET_START = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">
+<sheetViews><sheetView workbookViewId="0"><pane ySplit="1" topLeftCell="A2" activePane="bottomLeft" state="frozen"/></sheetView></sheetViews>
+'''
+SHEET_END = '</sheetData></worksheet>'
+
+
+def column_name(index):
+    """Returns the spreadsheet column name, such as 'AB', for an index."""
+    name = ''
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        name = chr(ord('A') + remainder) + name
+    return name
+
+def _clean(value):
+    # Returns the value as unicode, without any characters XML can't hold
+    if isinstance(value, str):
+        value = value.decode('utf-8')
+    elif not isinstance(value, unicode):
+        value = unicode(value)
+    return XML_INVALID.sub(u'', value)
+
+def _text(value):
+    return escape(_clean(value)).encode('utf-8')
+
+def _cell(ref, value, style):
+    # Returns the XML for a single cell, or '' for an empty cell
+    if value is None or value == '':
+        return ''
+    style = ' s="%d"' % style if style else ''
+    if type(value) is bool:
+        return '<c r="%s" t="b"%s><v>%d</v></c>' % (ref, style, value)
+    if isinstance(value, NUMBER_TYPES) and not (isinstance(value, float)
+            and (math.isinf(value) or math.isnan(value))):
+        return '<c r="%s"%s><v>%s</v></c>' % (ref, style, repr(value)
+            if isinstance(value, float) else str(value))
+    return '<c r="%s" t="inlineStr"%s><is><t xml:space="preserve">%s</t></is></c>' \
+        % (ref, style, _text(value))
+
+def _display_length(value, style):
+    # Returns roughly how many characters wide the cell displays, in the
+    # number format of its style
+    if value is None or value == '':
+        return 0
+    if type(value) is bool:
+        return 5
+    if isinstance(value, NUMBER_TYPES):
+        if style in NUMBER_FORMATS:
+            return len(NUMBER_FORMATS[style].format(value))
+        return len(repr(value) if isinstance(value, float) else str(value))
+    return len(_clean(value))
+
+def _column_widths(labels, data_types, styles, rows):
+    # Returns the width of each column, wide enough for its label and the
+    # sampled rows' values, and at least the usual width for its data type
+    widths = [
+        max(len(label or '') + 4, TYPE_WIDTHS.get(data_type, MIN_WIDTH))
+        for label, data_type in zip(labels, data_types)
+    ]
+    for row in rows:
+        for i, value in enumerate(row):
+            widths[i] = max(widths[i], _display_length(value, styles[i]) + 2)
+    return [min(max(width, MIN_WIDTH), MAX_WIDTH) for width in widths]
+
+def _row(number, values, styles):
+    return '<row r="%d">%s</row>' % (number, ''.join([
+        _cell('%s%d' % (name, number), value, style)
+        for name, value, style in zip(styles[0], values, styles[1])
+    ]))
+
+def _sheet_name(report):
+    name = SHEET_NAME_INVALID.sub(u'', _clean(report.display_name)).strip()
+    return (name or u'Report')[:31]
+
+@cache_connection
+def write_report(report, output, sort=None, page_size=1000):
+    """
+    Writes the report out as an ``.xlsx`` workbook with a single sheet. The
+    sheet has a header row of column labels, then all the report's rows, then
+    the report's footer row. Hidden columns are left out. Takes the report
+    and an output, which can be a file path or a file object opened for
+    writing in binary mode; file objects must support seeking. Also accepts
+    these optional arguments:
+
+    * ``sort``: The sorting for the rows, in the same format as the
+      ``default_sort`` attribute on reports. Defaults to the report's
+      ``default_sort``.
+    * ``page_size``: The number of rows to read from the cache at a time.
+      Defaults to ``1000``.
+    """
+    header = report.report_header()
+    visible = [
+        index for index, info in enumerate(header)
+        if not info.get('hidden')
+    ]
+    labels = [header[index]['label'] for index in visible]
+    data_types = [header[index].get('data_type') for index in visible]
+    names = [column_name(i) for i in range(len(visible))]
+    body_styles = (names, [
+        COLUMN_STYLES.get(data_type, STYLE_DEFAULT) for data_type in data_types
+    ])
+    header_styles = (names, [STYLE_HEADER] * len(visible))
+
+    # Size the columns from the first page of rows and the footer
+    pages = report.iter_report_pages(sort=sort, format='xls',
+        page_size=page_size)
+    first_page = next(pages, [])
+    footer = report.report_footer(format='xls')
+    footer = [footer[index] for index in visible]
+    widths = _column_widths(labels, data_types, body_styles[1], [
+        [row[index] for index in visible] for row in first_page
+    ] + [footer])
+
+    # Write the sheet to a temporary file as the rows are read
+    sheet = tempfile.NamedTemporaryFile(suffix='.xml', delete=False)
+    try:
+        sheet.write(SHEET_START)
+        sheet.write('<cols>%s</cols><sheetData>' % ''.join([
+            '<col min="%d" max="%d" width="%d" customWidth="1"/>' % (
+                i + 1, i + 1, width)
+            for i, width in enumerate(widths)
+        ]))
+        sheet.write(_row(1, labels, header_styles))
+        number = 1
+        for rows in itertools.chain([first_page], pages):
+            chunk = []
+            for row in rows:
+                number += 1
+                chunk.append(_row(number,
+                    [row[index] for index in visible], body_styles))
+            sheet.write(''.join(chunk))
+        sheet.write(_row(number + 1, footer, body_styles))
+        sheet.write(SHEET_END)
+        sheet.close()
+
+        # Package the workbook
+        workbook = zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED)
+        try:
+            workbook.writestr('[Content_Types].xml', CONTENT_TYPES)
+            workbook.writestr('_rels/.rels', ROOT_RELS)
+            workbook.writestr('xl/workbook.xml',
+                WORKBOOK % quoteattr(_sheet_name(report)).encode('utf-8'))
+            workbook.writestr('xl/_rels/workbook.xml.rels', WORKBOOK_RELS)
+            workbook.writestr('xl/styles.xml', STYLES)
+            workbook.write(sheet.name, 'xl/worksheets/sheet1.xml')
+        finally:
+            workbook.close()
+    finally:
+        sheet.close()
+        os.remove(sheet.name)
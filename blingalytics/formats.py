@@ -46,15 +46,33 @@ use and add a ``format_NAME`` method. For example, you could add a
 to your report's :meth:`report_rows <blingalytics.base.Report.report_rows>`
 and :meth:`report_footer <blingalytics.base.Report.report_footer>` methods.
 See the docstring and code of the base ``Format`` class for more.
+
+Reports format their rows a column at a time, by calling each format's
+``format_many`` method with the column's values. The built-in number formats
+use this to look up the locale's conventions once per column rather than once
+per value. If you add a ``format_NAME`` method, ``format_many`` will use it
+without any extra work.
 """
 
+import decimal
 import json
 import locale
 
 from blingalytics.utils import epoch
+from blingalytics.utils import locale_format
 from blingalytics.utils import timezones
 
 
+def _resolves_to(format, output, method):
+    # Whether the format formats values for the output with the given
+    # built-in method, so that column-at-a-time shortcuts never bypass a
+    # method overridden by a subclass
+    func = getattr(format._format_method(output), 'im_func', None)
+    if func in (Format.format_html.im_func, Format.format_csv.im_func):
+        func = getattr(format.format, 'im_func', None)
+    return func is method.im_func
+
+
 class Format(object):
     """
     Base class for formats.
@@ -87,9 +105,20 @@ class Format(object):
     The report returns these property dicts as part of the table header
     information, and by default they contain column metadata for the column's
     label, alignment, hidden state and sortability.
+
+    Subclasses may also override the format_many method to format a whole
+    list of values at once, if that can be done faster than formatting each
+    value separately.
+
+    Subclasses whose columns tend to hold only a few distinct values, and
+    whose output depends only on the value, the output type and the locale,
+    should set the cacheable attribute to True. Their formatted values are
+    then remembered, up to memo_size values per output type and locale.
     """
     default_align = 'left'
     sort_alpha = True
+    cacheable = False
+    memo_size = 1000
 
     def __init__(self, label=None, align=None):
         self.label = label
@@ -106,6 +135,51 @@ class Format(object):
             info['className'] = 'num'
         return info
 
+    def get_formatter(self, format):
+        """
+        Returns the function used to format values for the given output type,
+        which is the format_OUTPUT method if there is one, or else the basic
+        format method.
+        """
+        formatter = self._format_method(format)
+        if self.cacheable:
+            formatter = self._memoize(formatter, format)
+        return formatter
+
+    def _format_method(self, format):
+        return getattr(self, 'format_%s' % format, self.format)
+
+    def _memoize(self, formatter, format):
+        # Wraps the formatter to remember its output for each distinct value,
+        # separately for each output type and locale
+        memos = self.__dict__.setdefault('_memos', {})
+        memo = memos.setdefault((format, locale.setlocale(locale.LC_ALL)), {})
+        memo_size = self.memo_size
+
+        def memoized(value):
+            # The type is part of the key so that, for example, 1 and True
+            # are kept apart
+            key = (value.__class__, value)
+            try:
+                return memo[key]
+            except KeyError:
+                pass
+            except TypeError:
+                # Unhashable values can't be remembered
+                return formatter(value)
+            if len(memo) >= memo_size:
+                memo.clear()
+            formatted = memo[key] = formatter(value)
+            return formatted
+        return memoized
+
+    def format_many(self, values, format='html'):
+        """
+        Formats a list of values for the given output type, returning a list
+        of the formatted values.
+        """
+        return map(self.get_formatter(format), values)
+
     def format(self, value):
         """Default format method simply stringifies the value."""
         if isinstance(value, basestring):
@@ -181,6 +255,19 @@ class Bling(Format):
             value = 0
         return value
 
+    def format_many(self, values, format='html'):
+        if _resolves_to(self, format, Bling.format_html):
+            grouping = True
+        elif _resolves_to(self, format, Bling.format_csv):
+            grouping = False
+        else:
+            return super(Bling, self).format_many(values, format)
+        currency = locale_format.current().currency
+        return [
+            currency(0 if value is None else value, grouping)
+            for value in values
+        ]
+
 class Epoch(Format):
     """
     Formats the column as a date. Expects the underlying data to be stored as
@@ -191,6 +278,7 @@ class Epoch(Format):
     '01/23/2011'. By default, the column is left-aligned.
     """
     sort_alpha = False
+    cacheable = True
 
     def format(self, value):
         if value is None:
@@ -210,6 +298,7 @@ class Date(Format):
       localizes it into your desired timezone.
     """
     sort_alpha = True
+    cacheable = True
 
     def __init__(self, localize=None, **kwargs):
         self.localize = localize
@@ -301,6 +390,7 @@ class Month(Format):
     ``datetime`` or ``date`` objects. For example, ``'Jan 2011'``.
     """
     sort_alpha = True
+    cacheable = True
 
     def format(self, value):
         if value is None:
@@ -353,6 +443,23 @@ class Integer(Format):
             return value
         return str(value)
 
+    def format_many(self, values, format='html'):
+        if _resolves_to(self, format, Integer.format_html):
+            grouping = self.grouping
+        elif _resolves_to(self, format, Integer.format_csv):
+            grouping = False
+        else:
+            return super(Integer, self).format_many(values, format)
+        integer = locale_format.current().integer
+        try:
+            return [
+                integer(0 if value is None else value, grouping)
+                for value in values
+            ]
+        except TypeError:
+            # Let the usual method report the bad value
+            return super(Integer, self).format_many(values, format)
+
 class Decimal(Format):
     """
     Formats the data as a decimal number. This formatter accepts two
@@ -388,6 +495,21 @@ class Decimal(Format):
         except TypeError:
             raise TypeError('Value was not an integer: %r' % value)
 
+    def format_many(self, values, format='html'):
+        if not _resolves_to(self, format, Decimal.format):
+            return super(Decimal, self).format_many(values, format)
+        number = locale_format.current().number
+        precision = self.precision
+        grouping = self.grouping
+        try:
+            return [
+                number(0 if value is None else value, precision, grouping)
+                for value in values
+            ]
+        except TypeError:
+            # Let the usual method report the bad value
+            return super(Decimal, self).format_many(values, format)
+
 class Percent(Format):
     """
     Formats the data as a percent. This formatter accepts one additional
@@ -412,9 +534,22 @@ class Percent(Format):
             value = 0
         return locale.format('%%.%df' % self.precision, value) + '%'
 
+    def format_many(self, values, format='html'):
+        if not _resolves_to(self, format, Percent.format):
+            return super(Percent, self).format_many(values, format)
+        number = locale_format.current().number
+        precision = self.precision
+        return [
+            number(0 if value is None else value, precision) + '%'
+            for value in values
+        ]
+
     def format_xls(self, value):
         if value is None:
             value = 0
+        if isinstance(value, (int, long)):
+            # Avoid integer division
+            value = decimal.Decimal(value)
         return value / 100
 
 class String(Format):
@@ -445,6 +580,11 @@ class String(Format):
         self.truncate = truncate
         super(String, self).__init__(**kwargs)
 
+    @property
+    def cacheable(self):
+        # Title-casing is slow enough to be worth remembering
+        return self.title
+
     def format(self, value):
         if value is None:
             return ''
@@ -475,6 +615,7 @@ class Boolean(Format):
     This column is left-aligned by default.
     """
     sort_alpha = True
+    cacheable = True
 
     def __init__(self, terms=('Yes', 'No', ''), **kwargs):
         self.true_term, self.false_term, self.none_term = terms
@@ -1,17 +1,271 @@
 import csv
 from cStringIO import StringIO
+from functools import wraps
 import json
+from json.encoder import encode_basestring_ascii
+import time
 
 from blingalytics import get_report_by_code_name
-from blingalytics.caches import cache_connection, local_cache
+from blingalytics.caches import cache_connection, InstanceExistsError, \
+    InstanceLockError
+from blingalytics.utils.concurrency import map_threaded
 
 
-# Default cache if none specified (only load sqlite3 if using it)
-DEFAULT_CACHE = local_cache.LocalCache()
+# Default cache if none specified, created on first use (so sqlite3 is only
+# loaded, and the cache file only created, if it's needed)
+_default_cache = None
 
 
+def get_default_cache():
+    """
+    Returns the cache used by the frontend helpers when none is specified,
+    which is a :class:`~blingalytics.caches.local_cache.LocalCache` stored at
+    ``/tmp/blingalytics_cache``. It is created the first time it is needed,
+    rather than when this module is imported.
+
+    The same cache is also available as ``helpers.DEFAULT_CACHE``, which
+    stands in for it and only creates it when it is first used.
+    """
+    global _default_cache
+    if _default_cache is None:
+        from blingalytics.caches import local_cache
+        _default_cache = local_cache.LocalCache()
+    return _default_cache
+
+class _DefaultCache(object):
+    # Stands in for the default cache under its DEFAULT_CACHE name, passing
+    # everything through to the cache, which is only created when first used
+    def __getattr__(self, name):
+        return getattr(get_default_cache(), name)
+
+    def __enter__(self):
+        return get_default_cache().__enter__()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return get_default_cache().__exit__(exc_type, exc_value, traceback)
+
+    def __repr__(self):
+        return repr(get_default_cache())
+
+# The default cache, under the name it has always been importable as
+DEFAULT_CACHE = _DefaultCache()
+
+def _with_default_cache(func):
+    # Fills in the default cache if none was given, before cache_connection
+    # looks for it
+    @wraps(func)
+    def wrapped(*args, **kwargs):
+        if kwargs.get('cache') is None:
+            kwargs['cache'] = get_default_cache()
+        return func(*args, **kwargs)
+    return wrapped
+
+
+def iter_report_csv(report, page_size=1000):
+    """
+    Iterates over a finished report's full CSV download as chunks of encoded
+    CSV text, one chunk per page of rows read from the cache. This is
+    suitable for a streaming response, since the whole report is never held
+    in memory at once. Accepts one optional argument:
+
+    * ``page_size``: The number of rows to read from the cache and write out
+      per chunk. Defaults to ``1000``.
+    """
+    output = StringIO()
+    writer = csv.writer(output)
+
+    def flush():
+        chunk = output.getvalue()
+        output.seek(0)
+        output.truncate()
+        return chunk
+
+    with report.cache:
+        writer.writerow([report.display_name])
+        writer.writerow(['Timestamp: %s' % report.report_timestamp()
+            .strftime('%m-%d-%Y %I:%M %p UTC')])
+        writer.writerow([])
+        header = report.report_header()
+        visible = [
+            index for index, info in enumerate(header)
+            if not info.get('hidden')
+        ]
+        writer.writerow([header[index]['label'] for index in visible])
+        yield flush()
+
+        for rows in report.iter_report_pages(format='csv',
+                page_size=page_size):
+            writer.writerows([
+                [row[index] for index in visible]
+                for row in rows
+            ])
+            yield flush()
+
+def _json_value(value, json_dumps):
+    # Encodes the common cell values directly, leaving anything unusual to
+    # the full encoder
+    if isinstance(value, basestring):
+        return encode_basestring_ascii(value)
+    if value is None:
+        return 'null'
+    if type(value) in (int, long):
+        return str(value)
+    return json_dumps(value)
+
+def encode_rows(rows, json_dumps=json.dumps):
+    """
+    Encodes a list of formatted rows, as returned by
+    :meth:`Report.report_rows <blingalytics.base.Report.report_rows>`, as a
+    JSON array of arrays. Strings, integers and ``None`` are written out
+    directly, which is much faster than encoding the rows as a whole; any
+    other values are encoded with ``json_dumps``.
+    """
+    return '[%s]' % ', '.join([
+        '[%s]' % ', '.join([_json_value(value, json_dumps) for value in row])
+        for row in rows
+    ])
+
+def _page_body(page, json_dumps):
+    # The data response, without its closing sEcho, so that it can be cached
+    # and reused for any request for the same page
+    return '{"errors": [], "poll": false, "iTotalRecords": %d, ' \
+        '"iTotalDisplayRecords": %d, "aaData": %s, "footer": %s' % (
+            page['row_count'], page['row_count'],
+            encode_rows(page['rows'], json_dumps),
+            encode_rows([page['footer']], json_dumps)[1:-1])
+
+def _normalize_params(params):
+    # Accepts a plain dict, or a multi-valued dict such as Django's QueryDict
+    if hasattr(params, 'iterlists'):
+        params = dict([
+            (key, (values if len(values) > 1 else values[0]))
+            for key, values in params.iterlists()
+        ])
+    return dict((k, v) for k, v in params.items())
+
+def _load_report(report_code_name, cache):
+    # Returns the report instance and a list of errors, if any
+    if not report_code_name:
+        return None, ['Report code name not specified.']
+    report_cls = get_report_by_code_name(report_code_name)
+    if not report_cls:
+        return None, ['Specified report not found.']
+    return report_cls(cache), []
+
+def iter_report_progress(report, timeout=60, interval=5):
+    """
+    Iterates over the progress of a report that is being run elsewhere, such
+    as by the ``runner`` given to :func:`report_response`, as dicts in the
+    format returned by :meth:`Report.report_progress
+    <blingalytics.base.Report.report_progress>`. The current progress comes
+    first, and then each change to it as it happens. The iteration stops once
+    the report has finished or failed, or after ``timeout`` seconds.
+
+    If the report has finished, the last progress has the ``'finished'``
+    stage. How long each check waits for a change is bounded by ``interval``
+    seconds; caches that don't record progress are just checked for whether
+    the report has finished that often.
+    """
+    deadline = time.time() + timeout
+    last = None
+    with report.cache:
+        progress = report.report_progress()
+        while True:
+            if report.is_report_finished():
+                if progress is None or progress['stage'] != 'finished':
+                    progress = dict(progress or {'rows': None, 'key': None},
+                        stage='finished')
+                yield progress
+                return
+            if progress != last:
+                yield progress
+                last = progress
+                if progress is not None and progress['stage'] == 'failed':
+                    return
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return
+            progress = report.wait_report_progress(last,
+                min(interval, remaining))
+
+@_with_default_cache
 @cache_connection
-def report_response(params, runner=None, cache=DEFAULT_CACHE):
+def report_progress_response(params, cache=None, stream=True,
+        timeout=30, json_dumps=json.dumps):
+    """
+    This frontend helper function answers requests for the progress of a
+    report that is being run asynchronously, so that your frontend can wait
+    for the report to finish rather than polling :func:`report_response`. It
+    takes the same GET parameters as :func:`report_response`, and returns a
+    tuple of the response body, mimetype and headers in the same way. It does
+    not start the report running itself. It also accepts these options:
+
+    ``stream`` *(optional)*
+        If ``True``, the response body is an iterator of server-sent events,
+        one per change in the report's progress, to be returned as a
+        streaming ``text/event-stream`` response. Each event's data is the
+        progress as JSON, as described in :func:`iter_report_progress`. If
+        ``False``, the request is long-polled instead: the response is
+        returned as soon as the progress changes, or the report finishes,
+        as JSON with ``poll`` and ``progress`` keys. Defaults to ``True``.
+
+    ``timeout`` *(optional)*
+        The longest time, in seconds, to keep the request open before the
+        client should reconnect. Defaults to ``30``.
+
+    ``cache`` and ``json_dumps`` *(optional)*
+        As for :func:`report_response`.
+    """
+    params = _normalize_params(params)
+    report, errors = _load_report(params.pop('report', None), cache)
+    if not errors:
+        errors = report.clean_user_inputs(**params)
+    if errors:
+        return (json_dumps({
+            'errors': [str(error) for error in errors],
+        }), 'application/javascript', {})
+
+    events = iter_report_progress(report, timeout=timeout)
+    if stream:
+        return (('data: %s\n\n' % json_dumps(progress) for progress in events),
+            'text/event-stream', {'Cache-Control': 'no-cache'})
+
+    # Long polling returns the first change from the current progress
+    progress = None
+    for i, progress in enumerate(events):
+        if i or (progress is not None
+                and progress['stage'] in ('finished', 'failed')):
+            break
+    events.close()
+    return (json_dumps({
+        'errors': [],
+        'poll': progress is None or
+            progress['stage'] not in ('finished', 'failed'),
+        'progress': progress,
+    }), 'application/javascript', {})
+
+def _page_params(report, params):
+    # Parses the sorting, limit, offset and echo of a DataTables request
+    offset = int(params.get('iDisplayStart'))
+    limit = int(params.get('iDisplayLength'))
+    sort_col = params.get('iSortCol_0')
+    if sort_col:
+        sort_col = report.columns[int(sort_col) - 1][0]
+    else:
+        sort_col = report.default_sort[0]
+    sort_dir = str(params.get('sSortDir_0', report.default_sort[1]))
+    sort = (sort_col, sort_dir)
+    echo = int(params.get('sEcho'))
+    return sort, limit, offset, echo
+
+def _echo_body(body, echo, json_dumps):
+    # Closes a data response from _page_body with the request's sEcho
+    return '%s, "sEcho": %s}' % (body, json_dumps(str(echo)))
+
+@_with_default_cache
+@cache_connection
+def report_response(params, runner=None, cache=None, stream=False,
+        json_dumps=json.dumps, page_cache=None):
     """
     This frontend helper function is meant to be used in your
     request-processing code to handle all AJAX responses to the Blingalytics
@@ -26,7 +280,7 @@ def report_response(params, runner=None, cache=DEFAULT_CACHE):
     * A dict of header values to be sent in the response
 
     Your request-processing code should return the described response. The
-    function also accepts two options:
+    function also accepts these options:
 
     ``runner`` *(optional)*
         If you want your report to run asynchronously so as not to tie up
@@ -38,30 +292,42 @@ def report_response(params, runner=None, cache=DEFAULT_CACHE):
         is used.
 
     ``cache`` *(optional)*
-        By default, this will use a local cache stored at
+        By default, this will use the cache returned by
+        :func:`get_default_cache`, a local cache stored at
         ``/tmp/blingalytics_cache``. If you would like to use a different
         cache, simply provide the cache instance.
+
+    ``stream`` *(optional)*
+        If ``True``, the response body for a CSV download is an iterator of
+        CSV chunks rather than a string, so that you can return a streaming
+        response (such as a WSGI iterable) for large reports. See
+        :func:`iter_report_csv`. Defaults to ``False``.
+
+    ``json_dumps`` *(optional)*
+        The function used to encode JSON responses, such as ``ujson.dumps``
+        or ``simplejson.dumps``. The rows of report data are written out
+        directly by :func:`encode_rows`, and this is used for everything else.
+        Defaults to the standard library's ``json.dumps``.
+
+    ``page_cache`` *(optional)*
+        An :class:`LRUCache <blingalytics.utils.collections.LRUCache>` in
+        which to keep the encoded report data responses. Finished report
+        instances never change, so repeated requests for the same page, with
+        the same sorting, are then answered without reading or formatting the
+        rows again. Entries are keyed on the report instance and when it was
+        run, and are dropped when the report's cache is killed. By default,
+        no page cache is used.
     """
     # Find and instantitate the report class
-    if hasattr(params, 'iterlists'):
-        params = dict([
-            (key, (values if len(values) > 1 else values[0]))
-            for key, values in params.iterlists()
-        ])
-    params = dict((k, v) for k, v in params.items())
+    params = _normalize_params(params)
     report_code_name = params.pop('report', None)
-    if not report_code_name:
-        return (json.dumps({'errors': ['Report code name not specified.']}),
-            'application/javascript', {})
-    report_cls = get_report_by_code_name(report_code_name)
-    if not report_cls:
-        return (json.dumps({'errors': ['Specified report not found.']}),
-            'application/javascript', {})
-    report = report_cls(cache)
+    report, errors = _load_report(report_code_name, cache)
+    if errors:
+        return (json_dumps({'errors': errors}), 'application/javascript', {})
 
     # Return immediately for metadata request
     if params.pop('metadata', False):
-        return (json.dumps({
+        return (json_dumps({
             'errors': [],
             'widgets': report.render_widgets(),
             'header': report.report_header(),
@@ -71,14 +337,18 @@ def report_response(params, runner=None, cache=DEFAULT_CACHE):
     # Process user inputs
     errors = report.clean_user_inputs(**params)
     if errors:
-        return (json.dumps({
+        return (json_dumps({
             'errors': [str(error) for error in errors],
         }), 'application/javascript', {})
 
     # Clear cache if requested
     if params.get('killcache', False):
         report.kill_cache()
-        return (json.dumps({
+        if page_cache is not None:
+            for key in page_cache.keys():
+                if key[0] == report.unique_id:
+                    page_cache.pop(key)
+        return (json_dumps({
             'errors': [],
         }), 'application/javascript', {})
 
@@ -87,7 +357,7 @@ def report_response(params, runner=None, cache=DEFAULT_CACHE):
         if runner:
             if not report.is_report_started():
                 runner(report_code_name, params)
-            return (json.dumps({
+            return (json_dumps({
                 'errors': [],
                 'poll': True,
             }), 'application/javascript', {})
@@ -97,52 +367,138 @@ def report_response(params, runner=None, cache=DEFAULT_CACHE):
     # Return full report as downloadable csv if format requested
     if params.get('format') == 'csv':
         if params.get('download', False):
-            output = StringIO()
-            writer = csv.writer(output)
-            writer.writerow([report.display_name])
-            writer.writerow(['Timestamp: %s' % report.report_timestamp()
-                .strftime('%m-%d-%Y %I:%M %p UTC')])
-            writer.writerow([])
-            header = report.report_header()
-            writer.writerow(filter(
-                lambda a: a is not None,
-                map(
-                    lambda a: a['label'] if not a.get('hidden') else None,
-                    header
-                )
-            ))
-            for row in report.report_rows(format='csv'):
-                writer.writerow(map(
-                    lambda a: a[1],
-                    filter(lambda a: not a[0].get('hidden'), zip(header, row))
-                ))
-            return (output.getvalue(), 'text/csv', {
+            body = iter_report_csv(report)
+            if not stream:
+                body = ''.join(body)
+            return (body, 'text/csv', {
                 'Content-Disposition': 'attachment; filename="%s.csv"' \
                     % report.display_name
             })
         else:
-            return (json.dumps({
+            return (json_dumps({
                 'errors': [],
                 'poll': False,
             }), 'application/javascript', {})
 
     # Return report data
-    offset = int(params.get('iDisplayStart'))
-    limit = int(params.get('iDisplayLength'))
-    sort_col = params.get('iSortCol_0')
-    if sort_col:
-        sort_col = report.columns[int(sort_col) - 1][0]
-    else:
-        sort_col = report.default_sort[0]
-    sort_dir = str(params.get('sSortDir_0', report.default_sort[1]))
-    sort = (sort_col, sort_dir)
-    echo = int(params.get('sEcho'))
-    return (json.dumps({
-        'errors': [],
-        'poll': False,
-        'iTotalRecords': report.report_row_count(),
-        'iTotalDisplayRecords': report.report_row_count(),
-        'sEcho': str(echo),
-        'aaData': report.report_rows(sort=sort, limit=limit, offset=offset),
-        'footer': report.report_footer(),
-    }), 'application/javascript', {})
+    sort, limit, offset, echo = _page_params(report, params)
+    body = None
+    if page_cache is not None:
+        page_key = (report.unique_id, report.report_timestamp(), sort, offset,
+            limit, 'html')
+        body = page_cache.get(page_key)
+    if body is None:
+        page = report.report_page(sort=sort, limit=limit, offset=offset)
+        body = _page_body(page, json_dumps)
+        if page_cache is not None:
+            page_cache.set(page_key, body)
+    return (_echo_body(body, echo, json_dumps), 'application/javascript', {})
+
+@_with_default_cache
+@cache_connection
+def report_batch_response(requests, runner=None, cache=None,
+        workers=1, json_dumps=json.dumps):
+    """
+    Answers several report requests at once, such as for a dashboard showing
+    many reports, in a single response. Takes a list of requests, each a
+    ``dict`` of the GET parameters that would have been passed to
+    :func:`report_response`. The response body is a JSON array of the
+    responses :func:`report_response` would have given for each request, in
+    the same order. CSV downloads can't be batched.
+
+    All the requests share one cache connection, and the data for all the
+    finished reports is read from the cache together, which takes just two
+    round trips with :doc:`/caches/redis_cache`. Reports that still need to be
+    run are given to the ``runner``, if there is one, as for
+    :func:`report_response`. Otherwise, they are run before the response is
+    returned, on up to ``workers`` threads at once; only use more than one
+    worker with a cache that supports concurrent connections, such as
+    Redis. Defaults to running them one at a time.
+
+    The ``cache`` and ``json_dumps`` options are as for
+    :func:`report_response`.
+    """
+    bodies = [None] * len(requests)
+    pending = []
+    for i, params in enumerate(requests):
+        # Find and instantiate each report, answering those that don't need
+        # any data right away
+        params = _normalize_params(params)
+        report_code_name = params.pop('report', None)
+        report, errors = _load_report(report_code_name, cache)
+        if errors:
+            bodies[i] = json_dumps({'errors': errors})
+            continue
+        if params.pop('metadata', False):
+            bodies[i] = json_dumps({
+                'errors': [],
+                'widgets': report.render_widgets(),
+                'header': report.report_header(),
+                'default_sort': report.default_sort,
+            })
+            continue
+        errors = report.clean_user_inputs(**params)
+        if errors:
+            bodies[i] = json_dumps({
+                'errors': [str(error) for error in errors],
+            })
+            continue
+        if params.get('killcache', False):
+            report.kill_cache()
+            bodies[i] = json_dumps({'errors': []})
+            continue
+        if params.get('format') == 'csv':
+            bodies[i] = json_dumps({
+                'errors': ['CSV downloads cannot be batched.'],
+            })
+            continue
+        sort, limit, offset, echo = _page_params(report, params)
+        pending.append({
+            'index': i,
+            'code_name': report_code_name,
+            'params': params,
+            'report': report,
+            'query': report._page_query(sort, limit, offset),
+            'echo': echo,
+        })
+
+    def read_pages(pending):
+        # Reads the pages for all the pending requests together, and answers
+        # those that are finished; returns the rest
+        if not pending:
+            return []
+        pages = cache.instance_pages([
+            request['report'].unique_id + tuple([request['query'][key]
+                for key in ('sort', 'limit', 'offset', 'alpha')])
+            for request in pending
+        ])
+        unfinished = []
+        for request, page in zip(pending, pages):
+            if page is None:
+                unfinished.append(request)
+                continue
+            page = request['report']._format_page(page, 'html')
+            bodies[request['index']] = _echo_body(_page_body(page, json_dumps),
+                request['echo'], json_dumps)
+        return unfinished
+
+    unfinished = read_pages(pending)
+    if unfinished and runner:
+        # Let the runner build the missing reports
+        for request in unfinished:
+            if not request['report'].is_report_started():
+                runner(request['code_name'], request['params'])
+            bodies[request['index']] = json_dumps({'errors': [], 'poll': True})
+    elif unfinished:
+        # Build the missing reports here, and then read them too
+        def run(request):
+            try:
+                request['report'].run_report()
+            except (InstanceExistsError, InstanceLockError):
+                # Someone else is already building this report
+                pass
+        map_threaded(run, unfinished, workers)
+        for request in read_pages(unfinished):
+            bodies[request['index']] = json_dumps({'errors': [], 'poll': True})
+
+    return ('[%s]' % ', '.join(bodies), 'application/javascript', {})
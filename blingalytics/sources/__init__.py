@@ -62,8 +62,9 @@ class Source(object):
     Defines the base interface for a report to access a data source.
 
     Subclasses should define any or all of the methods: pre_process, get_rows,
-    and post_process. The report base class will call these methods at the
-    appropriate times to retrieve and process the data from this source.
+    post_process and kill_cache. The report base class will call these
+    methods at the appropriate times to retrieve and process the data from
+    this source.
 
     The pre_process method is called at the start of the get_rows call to the
     report instance. You can use this method to do any setup or processing to
@@ -78,6 +79,9 @@ class Source(object):
     opportunity for the source to do calculations or adjustments based on the
     values returned by another source.
 
+    The kill_cache method is called whenever the report's cache is killed, so
+    that a source that caches data of its own can invalidate it too.
+
     By default, the Source class stores the report's filters, key ranges, and
     columns, for reference within the source implementation:
 
@@ -165,6 +169,14 @@ class Source(object):
         """
         return []
 
+    def kill_cache(self, full):
+        """
+        Hook for invalidating anything the source has cached, called when its
+        report's cache is killed. The ``full`` argument is as for the
+        report's :meth:`kill_cache <blingalytics.base.Report.kill_cache>`.
+        """
+        pass
+
     def post_process(self, row, clean_inputs):
         """
         Hook for doing any post-processing work.
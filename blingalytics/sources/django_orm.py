@@ -41,36 +41,71 @@ an extra report attribute to specify which model to pull the data from:
 
 from collections import defaultdict
 import heapq
+from importlib import import_module
 import itertools
 
-from django.db import connection, models
-from django.db.models.aggregates import Aggregate
-
 from blingalytics import sources
 from blingalytics.utils.collections import OrderedDict
 
 
 QUERY_LIMIT = 1000
+
+def _ops():
+    # Django is imported when a query is first built, rather than when this
+    # module is, so that report definitions can be loaded without it
+    from django.db import connection
+    return connection.ops
+
+def _db_models():
+    # Likewise for django.db.models, which holds the aggregates
+    from django.db import models
+    return models
+
 COLUMN_TRANSFORMS = {
-    'trunc_year': lambda column: 'CAST(%s AS DATE)' % connection.ops.date_trunc_sql('year', column),
-    'trunc_month': lambda column: 'CAST(%s AS DATE)' % connection.ops.date_trunc_sql('month', column),
-    'trunc_day': lambda column: 'CAST(%s as DATE)' % connection.ops.date_trunc_sql('day', column),
-    'extract_year': lambda column: connection.ops.date_extract_sql('year', column),
-    'extract_month': lambda column: connection.ops.date_extract_sql('month', column),
-    'extract_day': lambda column: connection.ops.date_extract_sql('day', column),
-    'extract_week_day': lambda column: connection.ops.date_extract_sql('week_day', column),
+    'trunc_year': lambda column: 'CAST(%s AS DATE)' % _ops().date_trunc_sql('year', column),
+    'trunc_month': lambda column: 'CAST(%s AS DATE)' % _ops().date_trunc_sql('month', column),
+    'trunc_day': lambda column: 'CAST(%s as DATE)' % _ops().date_trunc_sql('day', column),
+    'extract_year': lambda column: _ops().date_extract_sql('year', column),
+    'extract_month': lambda column: _ops().date_extract_sql('month', column),
+    'extract_day': lambda column: _ops().date_extract_sql('day', column),
+    'extract_week_day': lambda column: _ops().date_extract_sql('week_day', column),
 }
 
+# Django models already imported, by dotted path
+_models = {}
+
+def _resolve_model(path):
+    # Imports the Django model at the dotted path, just once per path
+    model = _models.get(path)
+    if model is None:
+        module, name = path.rsplit('.', 1)
+        model = _models[path] = getattr(import_module(module), name)
+    return model
+
 class DjangoORMSource(sources.Source):
+    # Query plans, by report class and model, since they only depend on the
+    # report definition and so can be shared by all its instances
+    _plans = {}
+
     def __init__(self, report):
         super(DjangoORMSource, self).__init__(report)
+        self._report_cls = type(report)
         self.set_django_model(report.django_model)
 
     def set_django_model(self, model):
         # Receive the django model class from the report definition.
-        module, name = model.rsplit('.', 1)
-        module = __import__(module, globals(), locals(), [name])
-        self._model = getattr(module, name)
+        self._model = _resolve_model(model)
+
+    def _plan(self):
+        # Returns the query plan for the report, working it out on first use
+        plan_key = (self._report_cls, self._model)
+        plan = self._plans.get(plan_key)
+        if plan is None:
+            plan = self._plans[plan_key] = {
+                'queries': self._query_plans(),
+                'lookups': self._lookup_plans(),
+            }
+        return plan
 
     def _query_filters(self):
         # Organize the QueryFilters by the columns they apply to.
@@ -117,8 +152,18 @@ class DjangoORMSource(sources.Source):
                 categorized[category] = columns
         return categorized
 
-    def _perform_lookups(self, staged_rows):
+    def _lookup_plans(self):
+        # Collates each category of Lookup columns into the lookup model and
+        # primary key column, and lists of column names and lookup fields
+        plans = []
         for (django_model, pk_column), lookups in self._lookup_columns().items():
+            names, columns = zip(*lookups)
+            fields = [column.lookup_field for column in columns]
+            plans.append((django_model, pk_column, names, fields))
+        return plans
+
+    def _perform_lookups(self, staged_rows):
+        for django_model, pk_column, names, fields in self._plan()['lookups']:
             # Collect the pk ids from the staged rows
             pk_column_ids = [
                 row[pk_column] for key, row in staged_rows
@@ -127,12 +172,8 @@ class DjangoORMSource(sources.Source):
             if not pk_column_ids:
                 continue
 
-            # Collate the lookup columns in to name list and lookup_attr list
-            names, columns = zip(*lookups)
-            columns = map(lambda column: column.lookup_field, columns)
-
             # Construct the bulked query
-            column_names = ['pk'] + columns
+            column_names = ['pk'] + fields
             q = django_model.objects.values_list(*column_names)
             q = q.filter(pk__in=pk_column_ids)
             lookup_values = dict(map(
@@ -148,15 +189,14 @@ class DjangoORMSource(sources.Source):
 
         return staged_rows
 
-    def _queries(self, clean_inputs):
-        # Provides a list of iterators over the required queries, filtered
-        # appropriately, and ensures each row is emitted with the proper
-        # formatting: ((key), {row})
+    def _query_plans(self):
+        # Works out the columns, group-bys and modifiers of the query for
+        # each set of report filters, and how to map its results back to
+        # report column names
         key_column_names = map(lambda a: a[0], self._keys)
         model = self._model
-        queries = []
+        plans = []
 
-        # Create a query object for each set of report filters
         query_filters_by_columns = self._query_filters()
         table_wide_filters = query_filters_by_columns.pop(None, [])
 
@@ -190,6 +230,22 @@ class DjangoORMSource(sources.Source):
                     query_names[query_name] = name
                 query_modifiers += column.get_query_modifiers(model)
 
+            plans.append((query_filters, query_columns, query_modifiers,
+                query_group_bys, query_extra_group_bys, query_names))
+
+        return table_wide_filters, plans
+
+    def _queries(self, clean_inputs):
+        # Provides a list of iterators over the required queries, filtered
+        # appropriately, and ensures each row is emitted with the proper
+        # formatting: ((key), {row})
+        model = self._model
+        queries = []
+
+        # Create a query object for each set of report filters
+        table_wide_filters, plans = self._plan()['queries']
+        for (query_filters, query_columns, query_modifiers, query_group_bys,
+                query_extra_group_bys, query_names) in plans:
             # Construct the query
             q = model.objects.extra(select=query_extra_group_bys)
             q = q.values(*query_group_bys)
@@ -203,13 +259,13 @@ class DjangoORMSource(sources.Source):
             q = q.annotate(*query_columns)
 
             # Set up iteration over the query, with formatted rows
-            # (using generator here to make a closure for filter_column_names)
-            def rows(q, filter_column_names):
+            # (using generator here to make a closure for query_names)
+            def rows(q, query_names):
                 for row in _query_iterator(q):
                     yield dict([(query_names[k], v) for k, v in row.items()])
             queries.append(itertools.imap(
                 lambda row: (tuple(row[name] for name, _ in self._keys), row),
-                rows(q, filter_column_names)
+                rows(q, query_names)
             ))
 
         return queries
@@ -350,12 +406,16 @@ class Lookup(sources.Column):
 
     def __init__(self, django_model, lookup_field, pk_column, **kwargs):
         super(Lookup, self).__init__(**kwargs)
-        module, name = django_model.rsplit('.', 1)
-        module = __import__(module, globals(), locals(), [name])
-        self.django_model = getattr(module, name)
+        self._django_model = django_model
         self.lookup_field = lookup_field
         self.pk_column = pk_column
 
+    @property
+    def django_model(self):
+        # The model is imported on first use, rather than when the report is
+        # defined
+        return _resolve_model(self._django_model)
+
 class GroupBy(DjangoORMColumn):
     """
     Performs a group-by operation on the given database column. It takes one
@@ -413,7 +473,7 @@ class Sum(DjangoORMColumn):
     specifying the model field to sum.
     """
     def get_query_columns(self, model):
-        return [models.Sum(self.field_name)], '%s__sum' % self.field_name
+        return [_db_models().Sum(self.field_name)], '%s__sum' % self.field_name
 
 class Count(DjangoORMColumn):
     """
@@ -429,7 +489,7 @@ class Count(DjangoORMColumn):
         super(Count, self).__init__(field_name, **kwargs)
 
     def get_query_columns(self, model):
-        return ([models.Count(self.field_name, distinct=self._distinct)],
+        return ([_db_models().Count(self.field_name, distinct=self._distinct)],
             '%s__count' % self.field_name)
 
 class First(DjangoORMColumn):
@@ -447,7 +507,7 @@ class First(DjangoORMColumn):
     string specifying the database column to operate on.
     """
     def get_query_columns(self, model):
-        return [FirstAggregate(self.field_name)], '%s__first' % self.field_name
+        return [_first_aggregate()(self.field_name)], '%s__first' % self.field_name
 
 class Max(DjangoORMColumn):
     """
@@ -455,7 +515,7 @@ class Max(DjangoORMColumn):
     specifying the database column to find the max of.
     """
     def get_query_columns(self, model):
-        return [models.Max(self.field_name)], '%s__max' % self.field_name
+        return [_db_models().Max(self.field_name)], '%s__max' % self.field_name
 
 class Min(DjangoORMColumn):
     """
@@ -463,7 +523,7 @@ class Min(DjangoORMColumn):
     specifying the database column to find the min of.
     """
     def get_query_columns(self, model):
-        return [models.Min(self.field_name)], '%s__min' % self.field_name
+        return [_db_models().Min(self.field_name)], '%s__min' % self.field_name
 
 class Avg(DjangoORMColumn):
     """
@@ -471,7 +531,7 @@ class Avg(DjangoORMColumn):
     string specifying the database column to average.
     """
     def get_query_columns(self, model):
-        return [models.Avg(self.field_name)], '%s__avg' % self.field_name
+        return [_db_models().Avg(self.field_name)], '%s__avg' % self.field_name
 
 class TableKeyRange(sources.KeyRange):
     """
@@ -495,9 +555,7 @@ class TableKeyRange(sources.KeyRange):
 
     def get_row_keys(self, clean_inputs):
         # Query for the primary keys
-        module, name = self.django_model.rsplit('.', 1)
-        module = __import__(module, globals(), locals(), [name])
-        model = getattr(module, name)
+        model = _resolve_model(self.django_model)
         q = model.objects.values_list('pk', flat=True)
 
         # Apply the filters to the query
@@ -515,7 +573,14 @@ class TableKeyRange(sources.KeyRange):
 # https://code.djangoproject.com/browser/django/trunk/django/db/models/aggregates.py#L26
 # https://code.djangoproject.com/browser/django/trunk/django/db/models/sql/aggregates.py
 
-
-class FirstAggregate(Aggregate):
-    function = 'FIRST'
-    name = 'first'
+FirstAggregate = None
+
+def _first_aggregate():
+    # Defines FirstAggregate on first use, since it has to subclass Django's
+    # Aggregate
+    global FirstAggregate
+    if FirstAggregate is None:
+        class FirstAggregate(_db_models().Aggregate):
+            function = 'FIRST'
+            name = 'first'
+    return FirstAggregate
@@ -16,6 +16,32 @@ report attribute:
           'awesome': UserAwesomenessReport,
       }
 
+* ``merge_workers`` *(optional)*: The number of sub-reports to build at once,
+  on separate threads. Only use more than one with a cache that supports
+  concurrent connections, such as :doc:`/caches/redis_cache`. Defaults to
+  ``1``, which builds the sub-reports one after another.
+* ``merge_cache_subreports`` *(optional)*: Whether to build each sub-report
+  into the cache and read its rows back from there to merge them. If you set
+  this to ``False``, the sub-reports' rows are merged as they are produced,
+  without being cached, which is quicker when you don't need the sub-reports
+  cached on their own. This only works if every sub-report's first keys are
+  the merge report's keys, in the same order, as that keeps their rows in
+  order; if not, they are cached anyway. Defaults to ``True``.
+* ``merge_share_subreports`` *(optional)*: By default, each merge report
+  caches its own copy of its sub-reports. If you set this to ``True``, the
+  sub-reports are cached just as if they had been run on their own, by their
+  own code names and user inputs, so the same sub-report is only built once
+  for every merge report that includes it, and for anyone running it
+  directly. Killing the merge report's cache also kills its sub-reports'
+  caches; for shared sub-reports, even a full kill only kills their
+  instances for the merge report's current inputs, as other reports may be
+  using the rest. Defaults to ``False``.
+
+A merge report can have several keys, such as a day and a channel, as long
+as every sub-report has columns with the same names. The sub-reports' rows
+are read from the cache sorted on all the keys, so they can be merged in one
+pass. The cache works that sort order out once, as each sub-report is built.
+
 All merge columns take the same positional arguments, which are used to
 specify which columns from sub-reports should be combined into the merge
 column. You can specify the merge columns as follows:
@@ -31,20 +57,29 @@ column. You can specify the merge columns as follows:
 As a merged report is processed, it will actually run the full end-to-end
 ``run-report`` process for each of its sub-reports. It will then aggregate
 the results together based on the columns and filters in the merge report.
+If a sub-report is already being built elsewhere, such as by another merge
+report, it waits for that to finish rather than building it again.
 """
 
 import heapq
+import time
+
+from blingalytics import base, caches, sources
+from blingalytics.utils.concurrency import map_threaded
+
 
-from blingalytics import base, sources
+# How long to wait for a sub-report being built elsewhere, in seconds
+SUBREPORT_WAIT_TIMEOUT = 60 * 10
 
 
 class MergeSource(sources.Source):
     def __init__(self, report):
         super(MergeSource, self).__init__(report)
-        if len(self._keys) != 1:
-            raise ValueError('Merge reports cannot have more than one key or '
-                'we are unable to ensure proper sorting of the subreports.')
+        self._key_names = [name for name, key_range in self._keys]
         self._report = report
+        self._workers = getattr(report, 'merge_workers', 1)
+        self._cache_reports = getattr(report, 'merge_cache_subreports', True)
+        self._share_reports = getattr(report, 'merge_share_subreports', False)
         self.set_merged_reports(report.merged_reports)
 
     def set_merged_reports(self, merged_reports):
@@ -58,33 +93,84 @@ class MergeSource(sources.Source):
                 merged_report = merged_report(self._report.cache, merge=True)
             self._reports[name] = merged_report
 
+            # Sub-reports are read sorted on the merge keys, so have the
+            # cache work that order out ahead of time
+            sort = [(key_name, 'asc') for key_name in self._key_names]
+            if len(sort) > 1 and sort not in merged_report._sort_orders:
+                merged_report._sort_orders.append(sort)
+
     def _report_rows_mapper(self, report):
         # For a report, returns an iterator over its report_rows method that
         # maps the rows to the ((key), 'report_name', {row}) format required
         # for sorting by the heapq.merge function. Note that the key will be
-        # pulled based on the merge report's key, not the subreports' key,
-        # and we ensure the output is sorted by that key so merge works.
-        key = self._keys[0][0]
-        index = None
-        column_names = []
-        for i, header in enumerate(report[1].report_header()):
-            column_names.append(header['key'])
-            if header['key'] == key:
-                index = i
-        for row in report[1].report_rows(sort=(key, 'asc'), format='raw'):
-            row_key = (row[index],)
-            report_name = report[0]
+        # pulled based on the merge report's keys, not the subreports' keys,
+        # and we ensure the output is sorted by those keys so merge works.
+        column_names = [header['key'] for header in report[1].report_header()]
+        indexes = [column_names.index(name) for name in self._key_names]
+        sort = [(name, 'asc') for name in self._key_names]
+        report_name = report[0]
+        for row in report[1].report_rows(sort=sort, format='raw'):
+            row_key = tuple([row[index] for index in indexes])
             row_dict = dict(zip(column_names, row))
             yield (row_key, report_name, row_dict)
 
-    def _passes_post_filters(self, row, clean_inputs):
-        # Returns true if the row passes all the report's PostFilters.
+    def _report_stream_mapper(self, report):
+        # Like _report_rows_mapper, but takes the rows straight from the
+        # sub-report's processing rather than from the cache. They come in
+        # order of the sub-report's keys, so the first must be the merge keys.
+        report_name, report = report
+        report._init_footer()
+        for row in report._get_rows():
+            row_key = tuple([row[name] for name in self._key_names])
+            yield (row_key, report_name, row)
+
+    def _can_stream_reports(self, reports):
+        # Returns true if the rows of all the reports come in merge key order
         return all([
-            fil.include_row(row, clean_inputs)
-            for name, fil in self._filters if isinstance(fil, PostFilter)
+            [name for name, key_range in report.keys[:len(self._key_names)]]
+                == self._key_names
+            for name, report in reports
         ])
 
-    def get_rows(self, key_rows, clean_inputs):
+    def _build_report(self, report):
+        # Runs a sub-report, unless it's already being run elsewhere, in which
+        # case this waits for that run to finish
+        try:
+            report.run_report()
+            return
+        except caches.InstanceExistsError:
+            return
+        except caches.InstanceLockError:
+            pass
+        deadline = time.time() + SUBREPORT_WAIT_TIMEOUT
+        progress = None
+        while not report.is_report_finished():
+            if progress is not None and progress['stage'] == 'failed':
+                raise caches.InstanceIncompleteError('Sub-report %s failed '
+                    'to build.' % report.code_name)
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise caches.InstanceLockError('Timed out waiting for '
+                    'sub-report %s to be built.' % report.code_name)
+            progress = report.wait_report_progress(progress, min(1, remaining))
+
+    def _merge_plans(self, reports):
+        # Works out, once per run, which sub-report column feeds each merge
+        # column and how to merge it, so rows don't have to search for it.
+        # Returns a dict of report name to [(column name, sub-report column
+        # name, merge function)], leaving out columns the report doesn't feed.
+        plans = {}
+        for report_name, report in reports:
+            plan = []
+            for name, column in self._columns:
+                source_name = column._source_column(
+                    report_name, name, report.columns_dict)
+                if source_name is not None:
+                    plan.append((name, source_name, column.merge))
+            plans[report_name] = plan
+        return plans
+
+    def _prepare_reports(self):
         # Apply the delegated report filters
         for name, report in self._reports.items():
             # Override the sub-report's filters and widgets
@@ -93,10 +179,21 @@ class MergeSource(sources.Source):
                 sub_key = key.replace(self._report.code_name, report.code_name)
                 sub_dirty_inputs[sub_key] = value
             report.clean_user_inputs(**sub_dirty_inputs)
-            # Override the report's default unique_id
-            report_id, instance_id = self._report.unique_id
-            report.unique_id = (report_id, '%s::%s' % (instance_id, name))
+            if not self._share_reports:
+                # Override the report's default unique_id
+                report_id, instance_id = self._report.unique_id
+                report.unique_id = (report_id, '%s::%s' % (instance_id, name))
+
+    def kill_cache(self, full):
+        # Kill the sub-reports' caches along with the merge report's. Other
+        # reports may be using other instances of shared sub-reports, so
+        # only their instances for these inputs go, even on a full kill.
+        self._prepare_reports()
+        for report in self._reports.values():
+            report.kill_cache(full=full and not self._share_reports)
 
+    def get_rows(self, key_rows, clean_inputs):
+        self._prepare_reports()
         empty_row = dict(map(lambda a: (a[0], None), self._columns))
         current_key = None
         current_row = None
@@ -111,36 +208,39 @@ class MergeSource(sources.Source):
             if name not in excluded_reports
         ]
 
-        # Run the reports synchronously so we can query them
-        for name, report in reports:
-            if not report.is_report_finished():
-                report.run_report()
-
         # Prep the reports' rows for iteration with heapq
         # Must be in the form ((key), 'report_name', {row})
-        report_rows = map(self._report_rows_mapper, reports)
-
+        if not self._cache_reports and self._can_stream_reports(reports):
+            report_rows = map(self._report_stream_mapper, reports)
+        else:
+            # Build the reports that aren't cached yet, so we can query them
+            map_threaded(self._build_report, [
+                report for name, report in reports
+                if not report.is_report_finished()
+            ], self._workers)
+            report_rows = map(self._report_rows_mapper, reports)
+
+        merge_plans = self._merge_plans(reports)
+        post_filters = [
+            fil for name, fil in self._filters if isinstance(fil, PostFilter)]
         for key, report, row in heapq.merge(*report_rows):
-            if current_key and current_key == key:
-                # Continue building the current row
-                for name, column in self._columns:
-                    current_row[name] = column._merge_report_column(
-                        report, name, current_row, row)
-            else:
+            if not (current_key and current_key == key):
                 if current_key is not None:
-                    # Done with the current row, so emit it
-                    if self._passes_post_filters(current_row, clean_inputs):
+                    # Done with the current row, so emit it if it passes all
+                    # the report's PostFilters
+                    if all(fil.include_row(current_row, clean_inputs)
+                            for fil in post_filters):
                         yield (current_key, current_row)
                 # Start building the next row
                 current_key = key
                 current_row = empty_row.copy()
-                for name, column in self._columns:
-                    current_row[name] = column._merge_report_column(
-                        report, name, current_row, row)
+            for name, source_name, merge in merge_plans[report]:
+                current_row[name] = merge(current_row[name], row.get(source_name))
 
         # Emit the final row, if any
         if current_key:
-            if self._passes_post_filters(current_row, clean_inputs):
+            if all(fil.include_row(current_row, clean_inputs)
+                    for fil in post_filters):
                 yield (current_key, current_row)
 
 class DelegatedFilter(sources.Filter):
@@ -241,24 +341,22 @@ class MergeColumn(sources.Column):
                 self._merge_columns.append((arg.rsplit('.', 1)))
         super(MergeColumn, self).__init__(**kwargs)
 
-    def _merge_report_column(self, report_name, column_name, current, new):
-        # Determines whether this report should be merged, and if so, performs
-        # the merge method over the values.
+    def _source_column(self, report_name, column_name, report_columns):
+        # Determines which of the given sub-report's columns should be merged
+        # into this one, or None if the sub-report should be skipped.
         if not self._merge_columns and not self._merge_all:
             # Use the merge report's column name
-            return self.merge(current.get(column_name), new.get(column_name))
-        elif self._merge_all and self._merge_all in new:
+            return column_name
+        elif self._merge_all and self._merge_all in report_columns:
             # Use the provided column name for the incoming row
-            return self.merge(current.get(column_name), new.get(self._merge_all))
+            return self._merge_all
         elif self._merge_columns:
-            # Use the specified merge columns if they apply, otherwise skip (return current)
+            # Use the specified merge columns if they apply, otherwise skip
             for merge_report_name, merge_column_name in self._merge_columns:
-                if merge_report_name == report_name and merge_column_name in new:
-                    return self.merge(current.get(column_name), new.get(merge_column_name))
-            return current.get(column_name)
-        else:
-            # Column not specified for a merge, so skip (return current)
-            return current.get(column_name)
+                if merge_report_name == report_name and merge_column_name in report_columns:
+                    return merge_column_name
+        # Column not specified for a merge, so skip
+        return None
 
     def merge(self, current, new):
         """
@@ -0,0 +1,351 @@
+"""
+Schema-driven binary encoding for whole rows.
+
+The tagged string encoding in :mod:`blingalytics.utils.serialize` handles one
+value at a time and has to look up each value's type as it goes. But the
+columns of a report hold the same types row after row, so a row codec works
+out a schema once (usually from the first rows of an instance) and then packs
+each row into a single binary record with one fixed ``struct`` layout:
+
+* A status byte and a fixed-width slot for every column, in schema order.
+  Fixed-width types are packed directly into their slots; variable-length
+  types store their byte length in the slot.
+* The bytes of the variable-length values, in schema order.
+* Any values that don't match their column's type, in the tagged encoding,
+  each prefixed with its length.
+
+Decimals are stored as integers scaled by a per-column exponent, dates as
+ordinal days, and datetimes and timedeltas as whole microseconds, so none of
+them are formatted or parsed as text. A decimal with fewer decimal places
+than its column's exponent records how many fewer in its status byte,
+so that it decodes to an identical ``Decimal``.
+
+This module also provides :func:`sort_key`, which encodes a single value as a
+byte string that sorts in the same order as the value itself. Cache backends
+can store these keys and sort on the raw bytes.
+"""
+
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+import json
+import math
+import struct
+
+from blingalytics.utils.serialize import encode, decode
+
+
+# Cell statuses. Decimals stored with fewer places than their column's
+# exponent have a status of SCALED or more: SCALED for one place fewer, and
+# so on.
+VALUE, NULL, FALLBACK, SCALED = 0, 1, 2, 3
+MAX_PLACES = 255 - SCALED + 1
+
+# How many rows the caches look at to derive a schema
+SAMPLE_ROWS = 100
+
+# Column kinds, as (struct code, python types, fixed-width) tuples
+KINDS = {
+    'int': ('q', (int, long), True),
+    'float': ('d', (float,), True),
+    'bool': ('?', (bool,), True),
+    'decimal': ('q', (Decimal,), True),
+    'date': ('i', (date,), True),
+    'datetime': ('q', (datetime,), True),
+    'timedelta': ('q', (timedelta,), True),
+    'str': ('I', (str,), False),
+    'unicode': ('I', (unicode,), False),
+    'tagged': ('I', (), False),
+}
+KIND_BY_TYPE = {
+    int: 'int',
+    long: 'int',
+    float: 'float',
+    bool: 'bool',
+    Decimal: 'decimal',
+    date: 'date',
+    datetime: 'datetime',
+    timedelta: 'timedelta',
+    str: 'str',
+    unicode: 'unicode',
+}
+INT_MIN = -2 ** 63
+INT_MAX = 2 ** 63 - 1
+EPOCH = datetime(1970, 1, 1)
+LENGTH = struct.Struct('<I')
+
+
+def _int_dump(value):
+    if INT_MIN <= value <= INT_MAX:
+        return value
+    return None
+
+def _decimal_dump(exponent):
+    def dump(value):
+        # Returns the number of places fewer than the column's exponent, and
+        # the value scaled by the exponent. Values with more places than the
+        # exponent can't be stored scaled.
+        sign, digits, value_exponent = value.as_tuple()
+        if not isinstance(value_exponent, int) or (sign and not value):
+            return None
+        places = value_exponent - exponent
+        if not 0 <= places <= MAX_PLACES:
+            return None
+        scaled = _int_dump(int(value.scaleb(-exponent)))
+        if scaled is None:
+            return None
+        return places, scaled
+    return dump
+
+def _decimal_load(exponent):
+    def load(value, places):
+        return Decimal(value // 10 ** places).scaleb(exponent + places)
+    return load
+
+def _microseconds(value):
+    return (value.days * 86400 + value.seconds) * 1000000 + value.microseconds
+
+def _datetime_dump(value):
+    if value.tzinfo is not None:
+        return None
+    return _microseconds(value - EPOCH)
+
+def _datetime_load(value):
+    return EPOCH + timedelta(microseconds=value)
+
+def _timedelta_dump(value):
+    return _int_dump(_microseconds(value))
+
+def _timedelta_load(value):
+    return timedelta(microseconds=value)
+
+class RowCodec(object):
+    """
+    Encodes row dicts to binary records and back, for a given schema. The
+    schema is a list of ``(column name, kind, parameter)`` tuples, where the
+    parameter is the exponent for decimal columns and ``None`` otherwise. Use
+    :meth:`from_rows` to derive one from sample rows, and :meth:`dumps` and
+    :meth:`loads` to store it alongside the encoded rows.
+    """
+    def __init__(self, schema):
+        self.schema = [tuple(column) for column in schema]
+        self.names = [column[0] for column in self.schema]
+        self._struct = struct.Struct('<' + ''.join([
+            'B' + KINDS[kind][0] for name, kind, parameter in self.schema
+        ]))
+        self._columns = []
+        for name, kind, parameter in self.schema:
+            code, types, fixed = KINDS[kind]
+            dump, load = {
+                'int': (_int_dump, None),
+                'decimal': (_decimal_dump(parameter), _decimal_load(parameter)),
+                'date': (date.toordinal, date.fromordinal),
+                'datetime': (_datetime_dump, _datetime_load),
+                'timedelta': (_timedelta_dump, _timedelta_load),
+            }.get(kind, (None, None))
+            self._columns.append((name, kind, types, fixed, dump, load))
+
+    def __repr__(self):
+        return '<RowCodec %r>' % self.schema
+
+    @classmethod
+    def from_rows(cls, rows):
+        """
+        Derives a schema from a list of sample rows, with the columns of the
+        first. Each column's kind comes from the type of its first value that
+        isn't ``None``, and a decimal column's exponent is the widest among
+        its sample values, so that they all store scaled.
+        """
+        schema = []
+        for name in sorted(rows[0].keys()) if rows else []:
+            values = [row.get(name) for row in rows]
+            kind = 'tagged'
+            for value in values:
+                if value is not None:
+                    kind = KIND_BY_TYPE.get(type(value), 'tagged')
+                    break
+            parameter = None
+            if kind == 'decimal':
+                exponents = [
+                    value.as_tuple()[2] for value in values
+                    if type(value) is Decimal and value.is_finite()
+                ]
+                if exponents:
+                    parameter = min(exponents)
+                else:
+                    # Infinity or NaN tells us nothing about the scale
+                    kind = 'tagged'
+            schema.append((name, kind, parameter))
+        return cls(schema)
+
+    @classmethod
+    def from_row(cls, row):
+        """Derives a schema from the types of the values in a sample row."""
+        return cls.from_rows([row])
+
+    def dumps(self):
+        """Returns the schema as a string, for storage."""
+        return json.dumps(self.schema)
+
+    @classmethod
+    def loads(cls, data):
+        """Rebuilds a codec from a schema string produced by dumps."""
+        return cls(json.loads(data))
+
+    def encode(self, row):
+        """Packs a row dict into a binary record."""
+        slots = []
+        values = []
+        fallbacks = []
+        for name, kind, types, fixed, dump, load in self._columns:
+            value = row[name]
+            if value is None:
+                slots.append(NULL)
+                slots.append(0)
+                continue
+            if type(value) in types:
+                slot = value if dump is None else dump(value)
+                if slot is not None:
+                    if kind == 'decimal':
+                        places, slot = slot
+                        slots.append(SCALED + places - 1 if places else VALUE)
+                    else:
+                        slots.append(VALUE)
+                    if fixed:
+                        slots.append(slot)
+                    else:
+                        if kind == 'unicode':
+                            slot = slot.encode('utf-8')
+                        slots.append(len(slot))
+                        values.append(slot)
+                    continue
+
+            # Unexpected type or scale, so use the tagged encoding
+            slots.append(FALLBACK)
+            slots.append(0)
+            value = encode(value)
+            fallbacks.append(LENGTH.pack(len(value)) + value)
+        return self._struct.pack(*slots) + ''.join(values) \
+            + ''.join(fallbacks)
+
+    def decode(self, data):
+        """Unpacks a binary record into a row dict."""
+        slots = self._struct.unpack_from(data)
+        position = self._struct.size
+        fallbacks = []
+        row = {}
+        for i, (name, kind, types, fixed, dump, load) in enumerate(self._columns):
+            status = slots[2 * i]
+            if status == VALUE or status >= SCALED:
+                if fixed:
+                    value = slots[2 * i + 1]
+                    if kind == 'decimal':
+                        places = status - SCALED + 1 if status else 0
+                        row[name] = load(value, places)
+                    else:
+                        row[name] = value if load is None else load(value)
+                else:
+                    end = position + slots[2 * i + 1]
+                    value = data[position:end]
+                    if kind == 'unicode':
+                        value = value.decode('utf-8')
+                    row[name] = value
+                    position = end
+            elif status == NULL:
+                row[name] = None
+            else:
+                fallbacks.append(name)
+
+        # Tagged values come after all the variable-length values
+        for name in fallbacks:
+            length, = LENGTH.unpack_from(data, position)
+            position += LENGTH.size
+            row[name] = decode(data[position:position + length])
+            position += length
+        return row
+
+# Sort key prefixes, which also order values of different types
+KEY_NULL, KEY_NUMBER, KEY_STRING, KEY_DATE, KEY_DATETIME, KEY_TIMEDELTA, \
+    KEY_OTHER = [chr(i) for i in range(7)]
+_KEY_INT = struct.Struct('>Q')
+
+# Number key prefixes, ordering infinities, negative and non-negative whole
+# parts, and NaN
+_NUMBER_NEG_INF, _NUMBER_NEGATIVE, _NUMBER_POSITIVE, _NUMBER_INF, \
+    _NUMBER_NAN = [chr(i) for i in range(5)]
+_KEY_LENGTH = struct.Struct('>H')
+_FRACTION_END = '\x00'
+
+def _int_key(value):
+    # Shifting into the unsigned range makes big-endian bytes sort like ints
+    return _KEY_INT.pack(min(max(value, INT_MIN), INT_MAX) - INT_MIN)
+
+def _whole_key(whole):
+    # Length-prefixed big-endian bytes of the magnitude, so longer numbers
+    # sort after shorter ones. For negative numbers, the length and bytes
+    # are inverted so that bigger magnitudes sort first.
+    magnitude = abs(whole)
+    data = ('%x' % magnitude) if magnitude else ''
+    data = ('0' * (len(data) % 2) + data).decode('hex')
+    if whole >= 0:
+        return _NUMBER_POSITIVE + _KEY_LENGTH.pack(len(data)) + data
+    return _NUMBER_NEGATIVE + _KEY_LENGTH.pack(0xffff - len(data)) \
+        + ''.join([chr(255 - ord(byte)) for byte in data])
+
+def _decimal_key(value):
+    # Splits the decimal into its whole part, rounded down, and the digits of
+    # its fraction, without any arithmetic that could round. The fraction's
+    # digits, without trailing zeros and followed by a byte below any digit,
+    # sort in the same order as the fraction.
+    sign, digits, exponent = value.as_tuple()
+    digits = ''.join(map(str, digits))
+    if exponent >= 0:
+        whole, fraction = int(digits + '0' * exponent), ''
+    else:
+        digits = digits.rjust(-exponent, '0')
+        whole = int(digits[:exponent] or '0')
+        fraction = digits[exponent:].rstrip('0')
+        if sign and fraction:
+            # Round down, and take the fraction from the rounded whole part
+            whole += 1
+            fraction = str(10 ** len(fraction) - int(fraction)).rjust(
+                len(fraction), '0').rstrip('0')
+    if sign:
+        whole = -whole
+    return KEY_NUMBER + _whole_key(whole) + fraction + _FRACTION_END
+
+def sort_key(value):
+    """
+    Returns a byte string that sorts, byte by byte, in the same order as the
+    value. Ints, floats and decimals share one exact numeric ordering, for
+    whole parts of up to 65535 bytes; otherwise, empty values sort first,
+    then numbers, strings, dates, datetimes, timedeltas and anything else.
+    """
+    t = type(value)
+    if value is None:
+        return KEY_NULL
+    if t in (int, long, bool):
+        return KEY_NUMBER + _whole_key(value) + _FRACTION_END
+    if t is float:
+        if math.isnan(value):
+            return KEY_NUMBER + _NUMBER_NAN
+        if math.isinf(value):
+            return KEY_NUMBER + (_NUMBER_INF if value > 0 else _NUMBER_NEG_INF)
+        # Every float converts to a decimal exactly
+        return _decimal_key(Decimal(value))
+    if t is Decimal:
+        if value.is_nan():
+            return KEY_NUMBER + _NUMBER_NAN
+        if value.is_infinite():
+            return KEY_NUMBER + (_NUMBER_INF if value > 0 else _NUMBER_NEG_INF)
+        return _decimal_key(value)
+    if t is str:
+        return KEY_STRING + value
+    if t is unicode:
+        return KEY_STRING + value.encode('utf-8')
+    if t is date:
+        return KEY_DATE + _int_key(value.toordinal())
+    if t is datetime and value.tzinfo is None:
+        return KEY_DATETIME + _int_key(_microseconds(value - EPOCH))
+    if t is timedelta:
+        return KEY_TIMEDELTA + _int_key(_microseconds(value))
+    return KEY_OTHER + encode(value)
@@ -1,4 +1,6 @@
 from _abcoll import *
+import threading
+import time
 try:
     from thread import get_ident as _get_ident
 except ImportError:
@@ -210,3 +212,58 @@ class OrderedDict(dict):
     def viewitems(self):
         "od.viewitems() -> a set-like object providing a view on od's items"
         return ItemsView(self)
+
+
+class LRUCache(object):
+    """
+    A bounded, thread-safe mapping that evicts the least recently used entry
+    once it holds max_size entries. If a timeout (in seconds) is given, each
+    entry also expires that long after it was set.
+    """
+    def __init__(self, max_size=100, timeout=None):
+        self.max_size = max_size
+        self.timeout = timeout
+        self._data = OrderedDict()
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return self.get(key, self) is not self
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                expires, value = self._data.pop(key)
+            except KeyError:
+                return default
+            if expires is not None and expires <= time.time():
+                return default
+            # Re-insert to mark as most recently used
+            self._data[key] = (expires, value)
+            return value
+
+    def set(self, key, value, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        expires = time.time() + timeout if timeout else None
+        with self._lock:
+            self._data.pop(key, None)
+            while len(self._data) >= self.max_size:
+                self._data.popitem(last=False)
+            self._data[key] = (expires, value)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            try:
+                return self._data.pop(key)[1]
+            except KeyError:
+                return default
+
+    def keys(self):
+        with self._lock:
+            return self._data.keys()
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
@@ -0,0 +1,27 @@
+"""
+Runs independent pieces of work, such as whole reports, on a pool of threads.
+
+Report runs spend most of their time waiting on databases and caches, so
+running several at once on threads overlaps that waiting even though only one
+thread runs Python code at a time.
+"""
+
+
+def map_threaded(func, items, workers):
+    """
+    Calls ``func`` on each of the items, using up to ``workers`` threads at
+    once, and returns the results in the same order as the items. With one
+    worker, or just one item, everything runs on the calling thread. If any
+    call raises an exception, it is raised once all the calls have finished.
+    """
+    items = list(items)
+    if workers <= 1 or len(items) <= 1:
+        return map(func, items)
+    # Imported here, as multiprocessing is slow to import and rarely needed
+    from multiprocessing.pool import ThreadPool
+    pool = ThreadPool(min(workers, len(items)))
+    try:
+        return pool.map(func, items)
+    finally:
+        pool.close()
+        pool.join()
@@ -0,0 +1,141 @@
+"""
+Locale-aware number formatting, with the locale's conventions looked up once.
+
+The ``locale`` module's ``format`` and ``currency`` functions fetch the whole
+``localeconv()`` dict, sometimes more than once, for every value they format.
+A :class:`NumberFormatter` captures those conventions when it is created and
+gives the same output as the ``locale`` functions, so it is much cheaper for
+formatting a whole column of values.
+"""
+
+import locale
+
+
+DIGITS = '0123456789'
+
+_formatters = {}
+
+
+def current():
+    """
+    Returns a :class:`NumberFormatter` for the current locale settings,
+    reusing one built earlier for the same settings.
+    """
+    key = (locale.setlocale(locale.LC_NUMERIC),
+        locale.setlocale(locale.LC_MONETARY))
+    formatter = _formatters.get(key)
+    if formatter is None:
+        formatter = _formatters[key] = NumberFormatter()
+    return formatter
+
+def _grouper(separator, grouping):
+    # Builds a function that groups the digits of a formatted integer, as
+    # locale._group does
+    intervals = []
+    repeat = False
+    for interval in grouping:
+        if interval == locale.CHAR_MAX:
+            break
+        if interval == 0:
+            if not intervals:
+                raise ValueError('invalid grouping')
+            repeat = True
+            break
+        intervals.append(interval)
+    if not intervals:
+        return None
+
+    def group(s):
+        groups = []
+        prefix = ''
+        for i in xrange(len(s)):
+            if i < len(intervals):
+                interval = intervals[i]
+            elif repeat:
+                interval = intervals[-1]
+            else:
+                break
+            if not s or s[-1] not in DIGITS:
+                # Only the sign is left
+                prefix = s
+                s = ''
+                break
+            groups.append(s[-interval:])
+            s = s[:-interval]
+        if s:
+            groups.append(s)
+        groups.reverse()
+        return prefix + separator.join(groups)
+    return group
+
+class NumberFormatter(object):
+    """
+    Formats numbers like ``locale.format`` and ``locale.currency``, for the
+    conventions in the given ``localeconv()`` dict. Defaults to the current
+    locale's conventions.
+    """
+    def __init__(self, conv=None):
+        if conv is None:
+            conv = locale.localeconv()
+        self.decimal_point = conv['decimal_point']
+        self.mon_decimal_point = conv['mon_decimal_point']
+        self.frac_digits = conv['frac_digits']
+        self._group = _grouper(conv['thousands_sep'], conv['grouping'])
+        self._mon_group = _grouper(conv['mon_thousands_sep'],
+            conv['mon_grouping'])
+        if self.frac_digits != locale.CHAR_MAX:
+            self._positive = self._currency_affixes(conv, False)
+            self._negative = self._currency_affixes(conv, True)
+
+    def _currency_affixes(self, conv, negative):
+        # Works out what goes before and after the formatted amount, using
+        # the same steps as locale.currency, with '\0' standing in for the
+        # amount
+        s = '<\0>'
+        symbol = conv['currency_symbol']
+        precedes = conv[negative and 'n_cs_precedes' or 'p_cs_precedes']
+        separated = conv[negative and 'n_sep_by_space' or 'p_sep_by_space']
+        if precedes:
+            s = symbol + (separated and ' ' or '') + s
+        else:
+            s = s + (separated and ' ' or '') + symbol
+        sign_position = conv[negative and 'n_sign_posn' or 'p_sign_posn']
+        sign = conv[negative and 'negative_sign' or 'positive_sign']
+        if sign_position == 0:
+            s = '(' + s + ')'
+        elif sign_position == 1:
+            s = sign + s
+        elif sign_position == 2:
+            s = s + sign
+        elif sign_position == 3:
+            s = s.replace('<', sign)
+        elif sign_position == 4:
+            s = s.replace('>', sign)
+        else:
+            s = sign + s
+        return s.replace('<', '').replace('>', '').split('\0')
+
+    def integer(self, value, grouping=False):
+        """Formats like ``locale.format('%d', value, grouping)``."""
+        formatted = '%d' % value
+        if grouping and self._group:
+            formatted = self._group(formatted)
+        return formatted
+
+    def number(self, value, precision, grouping=False):
+        """Formats like ``locale.format('%.Nf', value, grouping)``."""
+        parts = ('%.*f' % (precision, value)).split('.')
+        if grouping and self._group:
+            parts[0] = self._group(parts[0])
+        return self.decimal_point.join(parts)
+
+    def currency(self, value, grouping=False):
+        """Formats like ``locale.currency(value, grouping=grouping)``."""
+        if self.frac_digits == locale.CHAR_MAX:
+            raise ValueError("Currency formatting is not possible using "
+                "the 'C' locale.")
+        parts = ('%.*f' % (self.frac_digits, abs(value))).split('.')
+        if grouping and self._mon_group:
+            parts[0] = self._mon_group(parts[0])
+        prefix, suffix = self._negative if value < 0 else self._positive
+        return prefix + self.mon_decimal_point.join(parts) + suffix
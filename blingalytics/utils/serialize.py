@@ -1,6 +1,7 @@
 from datetime import date, datetime, time as time_, timedelta
 from decimal import Decimal
 import itertools
+import re
 import time
 
 
@@ -34,6 +35,19 @@ def _time_encode(value):
             'a naive datetime in UTC first.')
     return '%i.%i.%i.%i' % (value.hour, value.minute, value.second,
         value.microsecond)
+
+def _datetime_encode(value):
+    # Whole seconds since the epoch, and the microseconds, so that nothing is
+    # lost to float rounding
+    delta = value.replace(tzinfo=None) - datetime.utcfromtimestamp(0)
+    return '%i.%06i' % (delta.days * 86400 + delta.seconds, delta.microseconds)
+
+def _datetime_decode(value):
+    # Values encoded before microseconds were kept are whole seconds
+    seconds, _, microseconds = value.partition('.')
+    return datetime.utcfromtimestamp(0) + timedelta(
+        seconds=int(seconds), microseconds=int(microseconds or 0))
+
 encodings = {
     type(None): lambda value: 'None',
     int: lambda value: 'i_' + str(value),
@@ -45,7 +59,7 @@ encodings = {
     unicode: lambda value: 'u_' + _escape(value.encode('utf-8').encode('base-64')),
     # NOTE: Read this stackoverflow for more info on why this needs to be done this way
     # https://stackoverflow.com/questions/8777753/converting-datetime-date-to-utc-timestamp-in-python
-    datetime: lambda value: 't_%i' % ((value.replace(tzinfo=None) - datetime.utcfromtimestamp(0)).total_seconds()),
+    datetime: lambda value: 't_%s' % _datetime_encode(value),
     date: lambda value: 'a_%i' % time.mktime(value.timetuple()),
     time_: lambda value: 'm_%s' % _time_encode(value),
     timedelta: lambda value: 'e_%i.%i.%i' % (value.days, value.seconds, value.microseconds),
@@ -64,16 +78,21 @@ decodings = {
     # NOTE: Read this stackoverflow for more info on why this needs to be done this way.
     # This is just needs to use utcfromtimestamp since we are using utcfromtimestamp above
     # https://stackoverflow.com/questions/8777753/converting-datetime-date-to-utc-timestamp-in-python
-    't': lambda value: datetime.utcfromtimestamp(float(value)),
+    't': _datetime_decode,
     'a': lambda value: date.fromtimestamp(float(value)),
     'm': lambda value: time_(*map(int, value.split('.'))),
     'e': lambda value: timedelta(*map(int, value.split('.'))),
-    'l': lambda value: map(decode, map(_unescape, value.split('_'))),
-    'h': lambda value: dict(map(lambda a: map(decode, map(_unescape, a.split(':'))), value.split('_'))),
+    'l': lambda value: map(decode, map(_unescape, value.split('_'))) if value else [],
+    'h': lambda value: dict(map(lambda a: map(decode, map(_unescape, a.split(':'))), value.split('_'))) if value else {},
 }
 
 def _escape(value):
     return value.replace('|', '||').replace('\n', '|n').replace('_', '|u')
 
+_UNESCAPES = {'|': '|', 'n': '\n', 'u': '_'}
+_UNESCAPE_RE = re.compile(r'\|(.)')
+
 def _unescape(value):
-    return value.replace('||', '|').replace('|n', '\n').replace('|u', '_')
+    # Single pass, so values escaped more than once (nested lists and dicts)
+    # unescape just one level at a time
+    return _UNESCAPE_RE.sub(lambda m: _UNESCAPES[m.group(1)], value)
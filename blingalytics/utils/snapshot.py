@@ -0,0 +1,95 @@
+"""
+Portable snapshots of cached report instances.
+
+A snapshot is a compressed binary string holding everything needed to
+recreate a finished instance in any cache: its rows, its footer, the
+timestamp it was computed at and when it expires. The layout is a short
+header (magic string and format version) followed by a zlib stream of
+length-prefixed records. The first record holds the instance metadata and the
+column names; each following record holds one row's values in column order.
+"""
+
+import struct
+import zlib
+
+from blingalytics.utils.serialize import encode, decode
+
+
+MAGIC = 'BLSNAP'
+VERSION = 1
+HEADER = struct.Struct('>%dsB' % len(MAGIC))
+LENGTH = struct.Struct('>I')
+
+
+class SnapshotError(ValueError):
+    """The data is not a snapshot this version can read."""
+
+class Snapshot(object):
+    """
+    A decoded snapshot. The rows are decoded lazily, as an iterator of dicts,
+    so they can be streamed straight into a cache.
+    """
+    def __init__(self, timestamp, expiration, footer, columns, records):
+        self.timestamp = timestamp
+        self.expiration = expiration
+        self.footer = footer
+        self.columns = columns
+        self._records = records
+
+    @property
+    def rows(self):
+        columns = self.columns
+        for record in self._records:
+            yield dict(zip(columns, decode(record)))
+
+def dumps(rows, footer, timestamp, expiration):
+    """
+    Packs an instance into a snapshot string. The rows should be an iterable
+    of row dicts, without the internal ``_bling_id`` column.
+    """
+    compressor = zlib.compressobj()
+    chunks = [HEADER.pack(MAGIC, VERSION)]
+
+    def write(value):
+        data = encode(value)
+        chunks.append(compressor.compress(LENGTH.pack(len(data)) + data))
+
+    columns = None
+    for row in rows:
+        if columns is None:
+            columns = sorted(row.keys())
+            write([timestamp, expiration, footer, columns])
+        write([row[column] for column in columns])
+    if columns is None:
+        write([timestamp, expiration, footer, []])
+
+    chunks.append(compressor.flush())
+    return ''.join(chunks)
+
+def loads(data):
+    """Unpacks a snapshot string into a :class:`Snapshot`."""
+    try:
+        magic, version = HEADER.unpack_from(data)
+    except struct.error:
+        raise SnapshotError('Data is not a report snapshot.')
+    if magic != MAGIC:
+        raise SnapshotError('Data is not a report snapshot.')
+    if version != VERSION:
+        raise SnapshotError('Unsupported snapshot version: %s' % version)
+    try:
+        body = zlib.decompress(data[HEADER.size:])
+    except zlib.error:
+        raise SnapshotError('Snapshot data is corrupt.')
+
+    records = _records(body)
+    timestamp, expiration, footer, columns = decode(next(records))
+    return Snapshot(timestamp, expiration, footer, columns, records)
+
+def _records(body):
+    # Iterates over the length-prefixed records in the snapshot body
+    position = 0
+    while position < len(body):
+        length, = LENGTH.unpack_from(body, position)
+        position += LENGTH.size
+        yield body[position:position + length]
+        position += length
@@ -22,8 +22,11 @@ documentation.
   attributes on the rendered widget. Defaults to no extra attributes.
 """
 
+from contextlib import contextmanager
 from datetime import date, datetime, timedelta
 import re
+import threading
+import time
 
 
 INPUT = '''
@@ -38,9 +41,28 @@ SELECT_OPTION = '''
   <option value="%(form_value)s" %(form_selected)s>%(form_label)s</option>
 '''.strip()
 
+# The evaluated choices for the current thread's request, if any
+_choices_scope = threading.local()
+
 class ValidationError(Exception):
     pass
 
+@contextmanager
+def choices_scope(memo):
+    """
+    Within this context, widgets evaluate callable choices at most once,
+    keeping the results in the given ``dict``. Reports keep one of these
+    for each report instance, so that the choices are only worked out once
+    however many times the report cleans its inputs or works out its unique
+    id. Scopes are kept per thread, and can be nested.
+    """
+    previous = getattr(_choices_scope, 'memo', None)
+    _choices_scope.memo = memo
+    try:
+        yield memo
+    finally:
+        _choices_scope.memo = previous
+
 class Widget(object):
     """
     Base widget implementation.
@@ -54,6 +76,7 @@ class Widget(object):
         self.default = default
         self.required = required
         self._extra_attrs = extra_attrs
+        self._rendered = None
         if isinstance(extra_class, basestring):
             self.extra_class = (extra_class,)
         else:
@@ -100,6 +123,29 @@ class Widget(object):
                 return None
         return user_input
 
+    def _render_state(self):
+        # Returns everything the rendered HTML depends on, or None if it
+        # can't be cached
+        if callable(self.default):
+            return None
+        return (self.label, self.default, self.extra_class, self.extra_attrs)
+
+    def cached_render(self):
+        """
+        Returns the widget rendered to HTML, as for :meth:`render`, reusing
+        the last rendering if nothing it depends on has changed since. Widgets
+        with a callable default are rendered every time.
+        """
+        state = self._render_state()
+        if state is None:
+            return self.render()
+        rendered = getattr(self, '_rendered', None)
+        if rendered is not None and rendered[0] == state:
+            return rendered[1]
+        html = self.render()
+        self._rendered = (state, html)
+        return html
+
     def render(self):
         """
         Renders the widget to HTML. Default implementation is to render a text input.
@@ -158,6 +204,13 @@ class DatePicker(Widget):
         self.date_format = date_format
         super(DatePicker, self).__init__(**kwargs)
 
+    def _render_state(self):
+        # Relative defaults change from day to day
+        if self.default in ('today', 'yesterday', 'first_of_month'):
+            return None
+        state = super(DatePicker, self)._render_state()
+        return state and state + (self.date_format,)
+
     def render(self):
         value = self.default() if callable(self.default) else self.default
         if value == 'today':
@@ -199,6 +252,10 @@ class Select(Widget):
       that will be returned when the user selects this option. The second item
       should be the label to be displayed to the user for this option. This
       can also be a callable. Defaults to ``[]``, an empty list of choices.
+    * ``choices_ttl``: If the choices are a callable, the number of seconds
+      for which its result is kept and shared by every request, for choices
+      that rarely change. Defaults to ``None``, which evaluates the callable
+      afresh for each report instance (see :func:`choices_scope`).
 
     For the ``default`` argument for this type of widget, you provide an index
     into the choices list, similar to how you index into a Python list. For
@@ -206,8 +263,10 @@ class Select(Widget):
     option by passing in ``default=1``. If you want the last selection to
     be default, you can pass in ``default=-1``.
     """
-    def __init__(self, choices=[], **kwargs):
+    def __init__(self, choices=[], choices_ttl=None, **kwargs):
         self.choices = choices
+        self.choices_ttl = choices_ttl
+        self._shared_choices = None
         self._widget_class = 'bl_select'
         super(Select, self).__init__(**kwargs)
 
@@ -224,27 +283,62 @@ class Select(Widget):
         return '%s|%s|%s' % (self.form_name, dirty_inputs.get(self.form_name, ''), vals)
 
     def get_choices(self):
-        return list(self.choices() if callable(self.choices) else self.choices)
+        choices = self.choices
+        if not callable(choices):
+            return list(choices)
+
+        # Memoized results only count if the choices haven't been replaced
+        memo = getattr(_choices_scope, 'memo', None)
+        if memo is not None:
+            cached = memo.get(id(self))
+            if cached is not None and cached[0] is choices:
+                return list(cached[1])
+        shared = self._shared_choices
+        if shared is not None and shared[0] is choices \
+                and shared[1] > time.time():
+            evaluated = shared[2]
+        else:
+            evaluated = list(choices())
+            if self.choices_ttl:
+                self._shared_choices = (choices,
+                    time.time() + self.choices_ttl, evaluated)
+        if memo is not None:
+            memo[id(self)] = (choices, evaluated)
+        return list(evaluated)
+
+    def _render_state(self):
+        # Callable choices can only be cached while they're shared (see the
+        # choices_ttl option)
+        state = super(Select, self)._render_state()
+        if state is None:
+            return None
+        if callable(self.choices):
+            if not self.choices_ttl:
+                return None
+            # Refresh the shared choices if they've expired
+            with choices_scope(None):
+                self.get_choices()
+            return state + (self._shared_choices,)
+        return state + (self.choices,)
 
     def render(self):
         value = self.default() if callable(self.default) else self.default
         choices = self.get_choices()
-        options = ''
-        for i, (choice_value, choice_label) in enumerate(choices):
-            # Handle positive/negative indexing for default value
-            selected = ''
-            if value is not None:
-                if value >= 0 and value == i:
-                    selected = 'selected'
-                elif value < 0 and len(choices) + value == i:
-                    selected = 'selected'
-            options += SELECT_OPTION % {
+
+        # Handle positive/negative indexing for default value
+        selected_index = None
+        if value is not None:
+            selected_index = value if value >= 0 else len(choices) + value
+        options = [
+            SELECT_OPTION % {
                 'form_value': i,
                 'form_label': choice_label,
-                'form_selected': selected,
+                'form_selected': 'selected' if i == selected_index else '',
             }
+            for i, (choice_value, choice_label) in enumerate(choices)
+        ]
         return SELECT % {
-            'form_options': options,
+            'form_options': ''.join(options),
             'form_name': self.form_name,
             'form_label': self.label,
             'form_class': self._form_class(self._widget_class),
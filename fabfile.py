@@ -14,6 +14,12 @@ def test():
         local('python test/test_runner.py')
 
 
+def benchmark_imports(runs=10):
+    """Times importing blingalytics modules in a fresh process."""
+    with lcd(PROJECT_PATH):
+        local('python benchmarks/import_time.py -n {0}'.format(runs))
+
+
 def update_pypi():
     """Updates versions and packages for PyPI."""
     # Verify that we want to do this...
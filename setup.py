@@ -41,6 +41,7 @@ setup(
     packages=[
         'blingalytics',
         'blingalytics.caches',
+        'blingalytics.exports',
         'blingalytics.sources',
         'blingalytics.utils',
     ],
@@ -0,0 +1,75 @@
+from decimal import Decimal
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from blingalytics.caches.local_cache import LocalCache
+
+
+ROWS = [
+    {'id': 1, 'name': u'Jeff', 'price': Decimal('1.50')},
+    {'id': 2, 'name': u'Tracy', 'price': Decimal('3.00')},
+    {'id': 3, 'name': u'Connie', 'price': None},
+]
+
+
+class TestLocalCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = LocalCache(os.path.join(self.directory, 'cache'))
+        self.binary_cache = LocalCache(os.path.join(self.directory, 'binary'),
+            binary_rows=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_instance_rows(self):
+        for cache in (self.cache, self.binary_cache):
+            cache.create_instance('report', 'xyz', iter(ROWS), lambda: {}, 3600)
+            rows = cache.instance_rows('report', 'xyz', sort=('id', 'asc'), offset=1)
+            self.assertEqual([row['id'] for row in rows], [2, 3])
+            rows = cache.instance_rows('report', 'xyz', sort=('id', 'desc'), limit=1, offset=1)
+            self.assertEqual([row['id'] for row in rows], [2])
+
+            # Real errors aren't hidden
+            self.assertRaises(sqlite3.OperationalError, cache.instance_rows,
+                'report', 'xyz', sort=('nope', 'asc'))
+
+        # An instance with no rows has no table
+        self.cache.create_instance('report', 'empty', iter([]), lambda: {}, 3600)
+        self.assertEqual(list(self.cache.instance_rows('report', 'empty', sort=('id', 'asc'))), [])
+        self.assertEqual(self.cache.instance_row_count('report', 'empty'), 0)
+
+    def test_instance_row_pages(self):
+        self.binary_cache.create_instance('report', 'xyz', iter(ROWS),
+            lambda: {}, 3600)
+        pages = self.binary_cache.instance_row_pages('report', 'xyz',
+            sort=('id', 'desc'), page_size=2)
+        self.assertEqual([[row['id'] for row in page] for page in pages],
+            [[3, 2], [1]])
+
+    def test_instance_rows_compound_sort(self):
+        rows = [
+            {'day': 2, 'channel': u'b', 'n': 1},
+            {'day': 1, 'channel': u'b', 'n': 2},
+            {'day': 2, 'channel': u'a', 'n': 3},
+            {'day': 1, 'channel': u'a', 'n': 4},
+        ]
+        self.binary_cache.create_instance('report', 'compound', iter(rows),
+            lambda: {}, 3600,
+            sort_orders=[[('day', 'asc', False), ('channel', 'asc', True)]])
+        page = self.binary_cache.instance_rows('report', 'compound',
+            sort=[('day', 'desc'), ('channel', 'desc')], alpha=[False, True],
+            limit=2, offset=1)
+        self.assertEqual([row['n'] for row in page], [3, 2])
+
+        # Binary rows get an index on each compound sort order
+        conn = sqlite3.connect(os.path.join(self.directory, 'binary'))
+        indexes = conn.execute('''
+            select name from sqlite_master
+            where type = 'index' and tbl_name = 'report_compound'
+        ''')
+        self.assertTrue(('ix_report_compound_order0',) in list(indexes))
+        conn.close()
@@ -0,0 +1,178 @@
+from datetime import datetime
+from decimal import Decimal
+import os
+import shutil
+import tempfile
+import unittest
+
+from blingalytics.caches import InstanceExistsError, InstanceIncompleteError
+from blingalytics.caches.mmap_cache import MmapCache
+
+
+CREATE_INSTANCE_ARGS = [
+    'report_name',
+    '123abc',
+    [
+        {'id': 1, 'name': 'Jeff', 'price': Decimal('1.50'), 'count': 40, 'ratio': 0.5},
+        {'id': 2, 'name': 'Tracy', 'price': Decimal('3.00'), 'count': 10, 'ratio': None},
+        {'id': 3, 'name': 'Connie', 'price': Decimal('0.00'), 'count': 100, 'ratio': 1.5},
+        {'id': 4, 'name': 'Megan', 'price': None, 'count': -20, 'ratio': -2.0},
+    ],
+    lambda: {'id': None, 'name': '', 'price': Decimal('4.50'), 'count': 32.5, 'ratio': None},
+    86400,
+]
+
+
+class TestMmapCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = MmapCache(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def create_instance(self):
+        args = list(CREATE_INSTANCE_ARGS)
+        args[2] = iter(args[2])
+        self.cache.create_instance(*args)
+
+    def test_create_instance(self):
+        self.create_instance()
+        path = os.path.join(self.directory, 'report_name', '123abc')
+        self.assertEqual(set(os.listdir(path)), set([
+            'meta',
+            '0.col', '0.asc', '0.rank', '1.col', '1.asc', '1.rank',
+            '2.col', '2.off', '2.asc', '2.rank', '3.col', '3.off', '3.asc',
+            '3.rank', '4.col', '4.nul', '4.asc', '4.rank',
+        ]))
+        self.assertRaises(InstanceExistsError, self.create_instance)
+
+    def test_kill_cache(self):
+        # Instance cache
+        self.create_instance()
+        self.assertTrue(self.cache.is_instance_finished('report_name', '123abc'))
+        self.cache.kill_instance_cache('report_name', '123abc')
+        self.assertFalse(self.cache.is_instance_finished('report_name', '123abc'))
+
+        # Report-wide cache
+        self.create_instance()
+        self.assertTrue(self.cache.is_instance_finished('report_name', '123abc'))
+        self.cache.kill_report_cache('report_name')
+        self.assertFalse(self.cache.is_instance_finished('report_name', '123abc'))
+
+    def test_instance_stats(self):
+        # Before creating the instance in cache
+        self.assertFalse(self.cache.is_instance_started('report_name', '123abc'))
+        self.assertFalse(self.cache.is_instance_finished('report_name', '123abc'))
+        self.assertRaises(InstanceIncompleteError, self.cache.instance_row_count, 'report_name', '123abc')
+        self.assertRaises(InstanceIncompleteError, self.cache.instance_timestamp, 'report_name', '123abc')
+
+        # After creating the instance in cache
+        self.create_instance()
+        self.assertTrue(self.cache.is_instance_started('report_name', '123abc'))
+        self.assertTrue(self.cache.is_instance_finished('report_name', '123abc'))
+        self.assertEqual(self.cache.instance_row_count('report_name', '123abc'), 4)
+        self.assertTrue(isinstance(self.cache.instance_timestamp('report_name', '123abc'), datetime))
+
+    def test_instance_rows(self):
+        self.create_instance()
+
+        rows = self.cache.instance_rows('report_name', '123abc',
+            sort=('id', 'asc'), limit=2, offset=1)
+        self.assertEqual(list(rows), [
+            {'_bling_id': 1, 'id': 2, 'name': 'Tracy', 'price': Decimal('3.00'), 'count': 10, 'ratio': None},
+            {'_bling_id': 2, 'id': 3, 'name': 'Connie', 'price': Decimal('0.00'), 'count': 100, 'ratio': 1.5},
+        ])
+
+        rows = self.cache.instance_rows('report_name', '123abc',
+            sort=('price', 'desc'), limit=None, offset=0)
+        self.assertEqual([row['id'] for row in rows], [2, 1, 3, 4])
+
+        rows = self.cache.instance_rows('report_name', '123abc',
+            sort=('ratio', 'asc'))
+        self.assertEqual([row['id'] for row in rows], [2, 4, 1, 3])
+
+        rows = self.cache.instance_rows('report_name', '123abc',
+            selected=['0', '3'], sort=('count', 'desc'), limit=1, offset=1)
+        self.assertEqual([row['id'] for row in rows], [4])
+
+    def test_empty_instance(self):
+        self.cache.create_instance('report_name', '123abc', iter([]),
+            lambda: {}, 86400)
+        self.assertEqual(self.cache.instance_row_count('report_name', '123abc'), 0)
+        self.assertEqual(self.cache.instance_rows('report_name', '123abc',
+            sort=('id', 'asc')), [])
+
+    def test_instance_page(self):
+        self.assertRaises(InstanceIncompleteError, self.cache.instance_page, 'report_name', '123abc')
+        self.create_instance()
+        page = self.cache.instance_page('report_name', '123abc',
+            sort=('count', 'desc'), limit=2, offset=1)
+        self.assertEqual([row['id'] for row in page['rows']], [1, 2])
+        self.assertEqual(page['row_count'], 4)
+        self.assertEqual(page['footer'], CREATE_INSTANCE_ARGS[3]())
+        self.assertEqual(page['timestamp'],
+            self.cache.instance_timestamp('report_name', '123abc'))
+
+    def test_instance_row_pages(self):
+        self.create_instance()
+        pages = self.cache.instance_row_pages('report_name', '123abc',
+            sort=('count', 'desc'), page_size=3)
+        self.assertEqual([[row['id'] for row in page] for page in pages],
+            [[3, 1, 2], [4]])
+        pages = self.cache.instance_row_pages('report_name', '123abc',
+            page_size=2)
+        self.assertEqual([[row['id'] for row in page] for page in pages],
+            [[1, 2], [3, 4]])
+
+    def test_instance_rows_compound_sort(self):
+        rows = [
+            {'day': 2, 'channel': 'b', 'n': 1},
+            {'day': 1, 'channel': 'b', 'n': 2},
+            {'day': 2, 'channel': 'a', 'n': 3},
+            {'day': 1, 'channel': 'a', 'n': 4},
+        ]
+        self.cache.create_instance('report_name', 'compound', iter(rows),
+            lambda: {}, 86400)
+        self.cache.create_instance('report_name', 'precomputed', iter(rows),
+            lambda: {}, 86400,
+            sort_orders=[[('day', 'asc', False), ('channel', 'asc', True)]])
+
+        # The precomputed order is stored as its own file
+        path = os.path.join(self.directory, 'report_name', 'precomputed')
+        self.assertTrue(os.path.exists(os.path.join(path, 'o0.asc')))
+
+        for instance_id in ('compound', 'precomputed'):
+            rows = self.cache.instance_rows('report_name', instance_id,
+                sort=[('day', 'asc'), ('channel', 'asc')], alpha=[False, True])
+            self.assertEqual([row['n'] for row in rows], [4, 2, 3, 1])
+
+            # The exact reverse reads the same order backwards
+            rows = self.cache.instance_rows('report_name', instance_id,
+                sort=[('day', 'desc'), ('channel', 'desc')], alpha=[False, True],
+                limit=2, offset=1)
+            self.assertEqual([row['n'] for row in rows], [3, 2])
+            rows = self.cache.instance_rows('report_name', instance_id,
+                sort=[('day', 'desc'), ('channel', 'desc')], alpha=[False, True],
+                offset=3)
+            self.assertEqual([row['n'] for row in rows], [4])
+            rows = self.cache.instance_rows('report_name', instance_id,
+                sort=[('day', 'asc'), ('channel', 'asc')], alpha=[False, True],
+                offset=4)
+            self.assertEqual(list(rows), [])
+
+            # Other orders are sorted when they're read
+            rows = self.cache.instance_rows('report_name', instance_id,
+                sort=[('day', 'desc'), ('channel', 'asc')], alpha=[False, True],
+                limit=2, offset=1)
+            self.assertEqual([row['n'] for row in rows], [1, 4])
+            rows = self.cache.instance_rows('report_name', instance_id,
+                selected=[0, 1, 3],
+                sort=[('day', 'asc'), ('channel', 'asc')], alpha=[False, True])
+            self.assertEqual([row['n'] for row in rows], [4, 2, 1])
+
+    def test_instance_footer(self):
+        self.assertRaises(InstanceIncompleteError, self.cache.instance_footer, 'report_name', '123abc')
+        self.create_instance()
+        self.assertEqual(self.cache.instance_footer('report_name', '123abc'),
+            CREATE_INSTANCE_ARGS[3]())
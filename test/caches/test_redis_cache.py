@@ -85,8 +85,78 @@ class TestRedisCache(unittest.TestCase):
             {'_bling_id': '3', 'id': 4, 'name': 'Megan', 'price': None, 'count': -20},
         ])
 
+    def test_instance_row_pages(self):
+        self.cache.create_instance(*CREATE_INSTANCE_ARGS)
+        pages = self.cache.instance_row_pages('report_name', '123abc',
+            sort=('count', 'desc'), page_size=3)
+        self.assertEqual([[row['id'] for row in page] for page in pages],
+            [[3, 1, 2], [4]])
+
+    def test_instance_rows_compound_sort(self):
+        rows = [
+            {'day': 2, 'channel': 'b', 'n': 1},
+            {'day': 1, 'channel': 'b', 'n': 2},
+            {'day': 2, 'channel': 'a', 'n': 3},
+            {'day': 1, 'channel': 'a', 'n': 4},
+        ]
+        self.cache.create_instance('report_name', 'compound', iter(rows),
+            lambda: {}, 86400)
+        self.cache.create_instance('report_name', 'precomputed', iter(rows),
+            lambda: {}, 86400,
+            sort_orders=[[('day', 'asc', False), ('channel', 'asc', True)]])
+
+        # The precomputed order is stored as a list of row ids
+        self.assertEqual(self.cache.conn.lrange(
+            'report_name:precomputed:order:day:asc:0,channel:asc:1:', 0, -1),
+            ['3', '1', '2', '0'])
+
+        for instance_id in ('compound', 'precomputed'):
+            rows = self.cache.instance_rows('report_name', instance_id,
+                sort=[('day', 'asc'), ('channel', 'asc')], alpha=[False, True])
+            self.assertEqual([row['n'] for row in rows], [4, 2, 3, 1])
+
+            # The exact reverse reads the same order backwards
+            rows = self.cache.instance_rows('report_name', instance_id,
+                sort=[('day', 'desc'), ('channel', 'desc')], alpha=[False, True],
+                limit=2, offset=1)
+            self.assertEqual([row['n'] for row in rows], [3, 2])
+            rows = self.cache.instance_rows('report_name', instance_id,
+                sort=[('day', 'desc'), ('channel', 'desc')], alpha=[False, True],
+                offset=3)
+            self.assertEqual([row['n'] for row in rows], [4])
+            rows = self.cache.instance_rows('report_name', instance_id,
+                sort=[('day', 'asc'), ('channel', 'asc')], alpha=[False, True],
+                offset=4)
+            self.assertEqual(list(rows), [])
+
+            # Other orders are sorted when they're read
+            rows = self.cache.instance_rows('report_name', instance_id,
+                sort=[('day', 'desc'), ('channel', 'asc')], alpha=[False, True],
+                limit=2, offset=1)
+            self.assertEqual([row['n'] for row in rows], [1, 4])
+            rows = self.cache.instance_rows('report_name', instance_id,
+                selected=[0, 1, 3],
+                sort=[('day', 'asc'), ('channel', 'asc')], alpha=[False, True])
+            self.assertEqual([row['n'] for row in rows], [4, 2, 1])
+
     def test_instance_footer(self):
         self.assertRaises(InstanceIncompleteError, self.cache.instance_footer, 'report_name', '123abc')
         self.cache.create_instance(*CREATE_INSTANCE_ARGS)
         self.assertEqual(self.cache.instance_footer('report_name', '123abc'),
             CREATE_INSTANCE_ARGS[3]())
+
+    def test_instance_pages(self):
+        self.cache.create_instance(*CREATE_INSTANCE_ARGS)
+        pages = self.cache.instance_pages([
+            ('report_name', '123abc', ('id', 'asc'), 2, 1, False),
+            ('report_name', 'unfinished', ('id', 'asc'), 2, 1, False),
+            ('report_name', '123abc', None, None, None, False),
+        ])
+        self.assertEqual([row['id'] for row in pages[0]['rows']], [2, 3])
+        self.assertEqual(pages[0]['row_count'], 4)
+        self.assertEqual(pages[0]['footer'], CREATE_INSTANCE_ARGS[3]())
+        self.assertTrue(isinstance(pages[0]['timestamp'], datetime))
+        self.assertEqual(pages[1], None)
+        self.assertEqual(len(pages[2]['rows']), 4)
+        self.assertRaises(InstanceIncompleteError, self.cache.instance_page,
+            'report_name', 'unfinished')
@@ -0,0 +1,75 @@
+from datetime import datetime, timedelta
+from decimal import Decimal
+import os
+import shutil
+import tempfile
+import unittest
+
+from blingalytics.caches import InstanceIncompleteError
+from blingalytics.caches.local_cache import LocalCache
+from blingalytics.caches.mmap_cache import MmapCache
+from blingalytics.utils import snapshot
+
+
+ROWS = [
+    {'id': 1, 'name': u'Jeff', 'price': Decimal('1.50'), 'tags': [1, 2]},
+    {'id': 2, 'name': u'Tracy', 'price': None, 'tags': []},
+]
+FOOTER = {'id': None, 'name': u'', 'price': Decimal('1.50'), 'tags': None}
+
+
+class TestSnapshots(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.mmap_cache = MmapCache(os.path.join(self.directory, 'mmap'))
+        self.local_cache = LocalCache(os.path.join(self.directory, 'local'))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def assertSameInstance(self, source, target):
+        self.assertEqual(target.instance_timestamp('report', 'xyz'),
+            source.instance_timestamp('report', 'xyz'))
+        self.assertEqual(target.instance_footer('report', 'xyz'), FOOTER)
+        rows = target.instance_rows('report', 'xyz', sort=('id', 'asc'))
+        self.assertEqual(
+            [dict((k, v) for k, v in row.items() if k != '_bling_id') for row in rows],
+            ROWS)
+        expiration = target.instance_expiration('report', 'xyz')
+        self.assertTrue(datetime.utcnow() < expiration
+            < datetime.utcnow() + timedelta(seconds=3600))
+
+    def test_round_trip(self):
+        timestamp = datetime(2011, 1, 2, 3, 4, 5, 678901)
+        self.mmap_cache.create_instance('report', 'xyz', iter(ROWS),
+            lambda: FOOTER, 3600, timestamp=timestamp)
+        self.assertEqual(self.mmap_cache.instance_timestamp('report', 'xyz'),
+            timestamp)
+
+        # From one cache engine to another, and back again
+        data = self.mmap_cache.export_instance('report', 'xyz')
+        self.local_cache.import_instance('report', 'xyz', data)
+        self.assertSameInstance(self.mmap_cache, self.local_cache)
+        self.mmap_cache.kill_instance_cache('report', 'xyz')
+        data = self.local_cache.export_instance('report', 'xyz')
+        self.mmap_cache.import_instance('report', 'xyz', data)
+        self.assertSameInstance(self.local_cache, self.mmap_cache)
+
+    def test_empty_instance(self):
+        self.mmap_cache.create_instance('report', 'xyz', iter([]),
+            lambda: {}, 3600)
+        data = self.mmap_cache.export_instance('report', 'xyz')
+        self.local_cache.import_instance('report', 'xyz', data)
+        self.assertEqual(self.local_cache.instance_row_count('report', 'xyz'), 0)
+        self.assertEqual(self.local_cache.instance_footer('report', 'xyz'), {})
+
+    def test_invalid_snapshots(self):
+        self.assertRaises(InstanceIncompleteError,
+            self.mmap_cache.export_instance, 'report', 'xyz')
+        self.assertRaises(snapshot.SnapshotError, snapshot.loads, 'junk')
+        self.assertRaises(snapshot.SnapshotError, snapshot.loads,
+            snapshot.HEADER.pack(snapshot.MAGIC, 99))
+        data = snapshot.dumps(iter(ROWS), FOOTER, datetime.utcnow(),
+            datetime.utcnow() - timedelta(seconds=1))
+        self.assertRaises(snapshot.SnapshotError,
+            self.local_cache.import_instance, 'report', 'xyz', data)
@@ -0,0 +1,144 @@
+from decimal import Decimal
+import os
+import tempfile
+import unittest
+
+from mock import patch
+
+from blingalytics.caches import InstanceIncompleteError
+from blingalytics.caches.local_cache import LocalCache
+from blingalytics.caches.tiered_cache import TieredCache
+from blingalytics.utils.serialize import encode
+
+
+CREATE_INSTANCE_ARGS = [
+    'report_name',
+    '123abc',
+    [
+        {'id': 1, 'name': 'Jeff', 'price': Decimal('1.50'), 'count': 40},
+        {'id': 2, 'name': 'Tracy', 'price': Decimal('3.00'), 'count': 10},
+        {'id': 3, 'name': 'Connie', 'price': Decimal('0.00'), 'count': 100},
+    ],
+    lambda: {'id': None, 'name': '', 'price': Decimal('4.50'), 'count': 150},
+    86400,
+]
+
+
+class TestTieredCache(unittest.TestCase):
+    def setUp(self):
+        fd, self.database = tempfile.mkstemp()
+        os.close(fd)
+        self.backing = LocalCache(self.database)
+        self.cache = TieredCache(self.backing)
+
+    def tearDown(self):
+        os.remove(self.database)
+
+    def create_instance(self):
+        args = list(CREATE_INSTANCE_ARGS)
+        args[2] = iter(args[2])
+        self.cache.create_instance(*args)
+
+    def test_reads_are_served_from_memory(self):
+        self.assertRaises(InstanceIncompleteError, self.cache.instance_footer,
+            'report_name', '123abc')
+        self.create_instance()
+        with patch.object(self.backing, 'instance_rows',
+                wraps=self.backing.instance_rows) as instance_rows:
+            for i in range(3):
+                rows = self.cache.instance_rows('report_name', '123abc',
+                    sort=('id', 'asc'), limit=2, offset=1)
+                self.assertEqual([row['id'] for row in rows], [2, 3])
+            self.assertEqual(instance_rows.call_count, 1)
+
+            # A different page is a different read
+            self.cache.instance_rows('report_name', '123abc',
+                sort=('id', 'asc'), limit=1)
+            self.assertEqual(instance_rows.call_count, 2)
+
+        with patch.object(self.backing, 'instance_footer',
+                wraps=self.backing.instance_footer) as instance_footer:
+            self.assertEqual(
+                self.cache.instance_footer('report_name', '123abc'),
+                CREATE_INSTANCE_ARGS[3]())
+            self.cache.instance_footer('report_name', '123abc')
+            self.assertEqual(instance_footer.call_count, 1)
+
+        self.assertEqual(
+            self.cache.instance_row_count('report_name', '123abc'), 3)
+        self.assertTrue(self.cache.is_instance_finished('report_name', '123abc'))
+
+    def test_instance_page(self):
+        self.assertRaises(InstanceIncompleteError, self.cache.instance_page,
+            'report_name', '123abc')
+        self.create_instance()
+        with patch.object(self.backing, 'instance_page',
+                wraps=self.backing.instance_page) as instance_page:
+            for i in range(3):
+                page = self.cache.instance_page('report_name', '123abc',
+                    sort=('id', 'asc'), limit=2, offset=1)
+                self.assertEqual([row['id'] for row in page['rows']], [2, 3])
+                self.assertEqual(page['row_count'], 3)
+                self.assertEqual(page['footer'], CREATE_INSTANCE_ARGS[3]())
+                self.assertTrue(page['timestamp'])
+            self.assertEqual(instance_page.call_count, 1)
+        self.assertEqual(
+            self.cache.instance_footer('report_name', '123abc'),
+            CREATE_INSTANCE_ARGS[3]())
+
+    def test_instance_pages(self):
+        self.create_instance()
+        self.cache.instance_page('report_name', '123abc',
+            sort=('id', 'asc'), limit=1)
+        with patch.object(self.backing, 'instance_pages',
+                wraps=self.backing.instance_pages) as instance_pages:
+            pages = self.cache.instance_pages([
+                ('report_name', '123abc', ('id', 'asc'), 1, None, False),
+                ('report_name', 'unfinished', ('id', 'asc'), 1, None, False),
+                ('report_name', '123abc', ('id', 'asc'), 1, 1, False),
+            ])
+            # Only the pages not already in memory are fetched
+            self.assertEqual(instance_pages.call_count, 1)
+            self.assertEqual(len(instance_pages.call_args[0][0]), 2)
+        self.assertEqual([row['id'] for row in pages[0]['rows']], [1])
+        self.assertEqual(pages[1], None)
+        self.assertEqual([row['id'] for row in pages[2]['rows']], [2])
+        self.assertEqual(pages[2]['row_count'], 3)
+
+    def test_cached_rows_are_copies(self):
+        self.create_instance()
+        rows = self.cache.instance_rows('report_name', '123abc',
+            sort=('id', 'asc'))
+        rows[0]['name'] = 'Changed'
+        rows = self.cache.instance_rows('report_name', '123abc',
+            sort=('id', 'asc'))
+        self.assertEqual(rows[0]['name'], 'Jeff')
+
+    def test_kill_cache(self):
+        # Instance cache
+        self.create_instance()
+        self.cache.instance_footer('report_name', '123abc')
+        self.cache.kill_instance_cache('report_name', '123abc')
+        self.assertFalse(self.cache.is_instance_finished('report_name', '123abc'))
+        self.assertRaises(InstanceIncompleteError, self.cache.instance_footer,
+            'report_name', '123abc')
+
+        # Report-wide cache
+        self.create_instance()
+        self.cache.instance_footer('report_name', '123abc')
+        self.cache.kill_report_cache('report_name')
+        self.assertFalse(self.cache.is_instance_finished('report_name', '123abc'))
+
+    def test_broadcast_invalidation(self):
+        self.create_instance()
+        self.cache.instance_footer('report_name', '123abc')
+        self.assertTrue(self.cache._instance('report_name', '123abc'))
+
+        # Another worker killed the instance
+        self.cache._receive(encode(('report_name', '123abc')))
+        self.assertEqual(self.cache._instance('report_name', '123abc'), None)
+
+        # Another worker killed the whole report
+        self.cache.instance_footer('report_name', '123abc')
+        self.cache._receive(encode(('report_name',)))
+        self.assertEqual(self.cache._instance('report_name', '123abc'), None)
@@ -0,0 +1,87 @@
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+import os
+import shutil
+import tempfile
+import unittest
+
+from blingalytics import base, formats
+from blingalytics.caches.local_cache import LocalCache
+from blingalytics.sources import key_range, static
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    from blingalytics.exports import arrow
+except ImportError:
+    pa = None
+
+
+class ArrowReport(base.Report):
+    filters = []
+    keys = ('day', key_range.EpochKeyRange(date(2011, 1, 1), date(2011, 1, 5)))
+    columns = [
+        ('day', key_range.Value(format=formats.Epoch)),
+        ('count', static.Value(3, format=formats.Integer)),
+        ('revenue', static.Value(Decimal('1.25'), format=formats.Bling)),
+        ('name', static.Value(u'Caf\xe9', format=formats.String)),
+        ('month', static.Value(datetime(2011, 2, 1), format=formats.Month)),
+        ('updated', static.Value(datetime(2011, 2, 3, 4, 5, 6, 7), format=formats.Date)),
+        ('duration', static.Value(timedelta(days=1, seconds=2, microseconds=3), format=formats.TimeDelta)),
+    ]
+    default_sort = ('day', 'asc')
+
+
+@unittest.skipIf(pa is None, 'pyarrow is not installed')
+class TestArrow(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.report = ArrowReport(LocalCache(os.path.join(self.directory, 'cache')))
+        self.report.clean_user_inputs()
+        self.report.run_report()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_schema(self):
+        schema = arrow.report_schema(self.report)
+        self.assertEqual(schema.names,
+            ['day', 'count', 'revenue', 'name', 'month', 'updated', 'duration'])
+        self.assertEqual([field.type for field in schema], [
+            pa.date32(), pa.int64(), pa.float64(), pa.string(), pa.date32(),
+            pa.timestamp('us', tz='UTC'), pa.duration('us')])
+
+    def test_record_batches(self):
+        batches = list(arrow.iter_record_batches(self.report, batch_size=2))
+        self.assertEqual([batch.num_rows for batch in batches], [2, 2, 1])
+        table = pa.Table.from_batches(batches)
+        self.assertEqual(table.column('day').to_pylist(), [
+            date(2011, 1, 1), date(2011, 1, 2), date(2011, 1, 3),
+            date(2011, 1, 4), date(2011, 1, 5)])
+        self.assertEqual(table.column('revenue').to_pylist(), [1.25] * 5)
+        self.assertEqual(table.column('month').to_pylist(), [date(2011, 2, 1)] * 5)
+        self.assertEqual(table.column('duration').to_pylist(),
+            [timedelta(days=1, seconds=2, microseconds=3)] * 5)
+        # Timestamps are microseconds since the epoch, in UTC
+        updated = datetime(2011, 2, 3, 4, 5, 6, 7) - datetime(1970, 1, 1)
+        self.assertEqual(table.column('updated').cast(pa.int64()).to_pylist(),
+            [updated.days * 86400000000 + updated.seconds * 1000000 + 7] * 5)
+
+    def test_write_ipc(self):
+        path = os.path.join(self.directory, 'report.arrow')
+        arrow.write_ipc(self.report, path, batch_size=2)
+        reader = pa.RecordBatchFileReader(pa.memory_map(path))
+        self.assertEqual(reader.num_record_batches, 3)
+        table = reader.read_all()
+        self.assertEqual(table.num_rows, 5)
+        self.assertEqual(table.column('name').to_pylist(), [u'Caf\xe9'] * 5)
+
+    def test_write_parquet(self):
+        path = os.path.join(self.directory, 'report.parquet')
+        arrow.write_parquet(self.report, path, batch_size=2)
+        table = pq.read_table(path)
+        self.assertEqual(table.schema.names,
+            ['day', 'count', 'revenue', 'name', 'month', 'updated', 'duration'])
+        self.assertEqual(table.column('count').to_pylist(), [3] * 5)
+        self.assertEqual(table.column('duration').type, pa.int64())
+        self.assertEqual(table.column('duration').to_pylist(), [86402000003] * 5)
@@ -0,0 +1,83 @@
+from decimal import Decimal
+import os
+import re
+import tempfile
+import unittest
+import zipfile
+
+from blingalytics import base, formats
+from blingalytics.caches.local_cache import LocalCache
+from blingalytics.exports import xlsx
+from blingalytics.sources import static
+from blingalytics.sources import key_range
+
+
+class SpreadsheetReport(base.Report):
+    display_name = 'Spreadsheet: <Report>'
+    filters = []
+    keys = ('id', key_range.IterableKeyRange(range(5)))
+    columns = [
+        ('id', static.Value(7, format=formats.Integer(grouping=False))),
+        ('hidden', static.Value(1, format=formats.Hidden)),
+        ('revenue', static.Value(Decimal('1.25'), format=formats.Bling)),
+        ('share', static.Value(Decimal('12.5'), format=formats.Percent)),
+        ('name', static.Value(u'Caf\xe9 & <bar>', format=formats.String(
+            label='A Rather Long Column Label'), footer=False)),
+        ('rate', static.Value(12, format=formats.Percent)),
+        ('views', static.Value(123456789, format=formats.Integer(label='N'))),
+    ]
+    default_sort = ('id', 'asc')
+
+
+class TestXlsx(unittest.TestCase):
+    def setUp(self):
+        fd, self.database = tempfile.mkstemp()
+        os.close(fd)
+        self.report = SpreadsheetReport(LocalCache(self.database))
+        self.report.clean_user_inputs()
+        self.report.run_report()
+
+    def tearDown(self):
+        os.remove(self.database)
+
+    def test_column_name(self):
+        self.assertEqual(
+            [xlsx.column_name(i) for i in [0, 25, 26, 51, 52, 701, 702]],
+            ['A', 'Z', 'AA', 'AZ', 'BA', 'ZZ', 'AAA'])
+
+    def test_write_report(self):
+        fd, path = tempfile.mkstemp(suffix='.xlsx')
+        os.close(fd)
+        try:
+            xlsx.write_report(self.report, path, page_size=2)
+            workbook = zipfile.ZipFile(path)
+            self.assertEqual(workbook.testzip(), None)
+            self.assertTrue('name="Spreadsheet &lt;Report&gt;"'
+                in workbook.read('xl/workbook.xml'))
+            sheet = workbook.read('xl/worksheets/sheet1.xml')
+        finally:
+            os.remove(path)
+
+        # Header, five rows and the footer
+        rows = re.findall(r'<row r="(\d+)">(.*?)</row>', sheet)
+        self.assertEqual([int(number) for number, row in rows], range(1, 8))
+        self.assertTrue('<t xml:space="preserve">Revenue</t>' in rows[0][1])
+        self.assertFalse('Hidden' in rows[0][1])
+
+        # Native numbers, except for ungrouped integers
+        row = rows[1][1]
+        self.assertTrue('<c r="A2" t="inlineStr" s="2"><is><t xml:space="preserve">7</t></is></c>' in row)
+        self.assertTrue('<c r="B2" s="3"><v>1.25</v></c>' in row)
+        self.assertTrue('<c r="C2" s="4"><v>0.125</v></c>' in row)
+        self.assertTrue(u'Caf\xe9 &amp; &lt;bar&gt;'.encode('utf-8') in row)
+        self.assertTrue('<c r="E2" s="4"><v>0.12</v></c>' in row)
+        self.assertTrue('<c r="F2" s="2"><v>123456789</v></c>' in row)
+
+        # Footer totals, with no footer for the string column
+        self.assertTrue('<c r="B7" s="3"><v>6.25</v></c>' in rows[6][1])
+        self.assertFalse('D7' in rows[6][1])
+
+        # Widths come from the labels, data types and values
+        self.assertTrue('<col min="2" max="2" width="14" customWidth="1"/>' in sheet)
+        self.assertTrue('<col min="4" max="4" width="30" customWidth="1"/>' in sheet)
+        self.assertTrue('<col min="6" max="6" width="13" customWidth="1"/>' in sheet)
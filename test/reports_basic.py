@@ -1,7 +1,7 @@
 from datetime import date
 
-from blingalytics import base, formats
-from blingalytics.sources import key_range, static
+from blingalytics import base, formats, widgets
+from blingalytics.sources import derived, key_range, merge, static
 
 
 class SuperBasicReport(base.Report):
@@ -11,3 +11,123 @@ class SuperBasicReport(base.Report):
         ('id', static.Value(1, format=formats.Integer)),
     ]
     default_sort = ('id', 'desc')
+
+
+class DayRevenueReport(base.Report):
+    filters = []
+    keys = ('day', key_range.IterableKeyRange([1, 2, 3]))
+    columns = [
+        ('day', key_range.Value(format=formats.Integer)),
+        ('revenue', derived.Value(lambda row: row['day'] * 10, format=formats.Integer)),
+    ]
+    default_sort = ('day', 'asc')
+
+
+class DayVisitsReport(base.Report):
+    filters = []
+    keys = ('day', key_range.IterableKeyRange([2, 3, 4]))
+    columns = [
+        ('day', key_range.Value(format=formats.Integer)),
+        ('visits', derived.Value(lambda row: row['day'] * 100, format=formats.Integer)),
+        ('revenue', static.Value(1, format=formats.Integer)),
+    ]
+    default_sort = ('day', 'asc')
+
+
+class MergedDayReport(base.Report):
+    filters = []
+    merged_reports = {
+        'revenue': DayRevenueReport,
+        'visits': DayVisitsReport,
+    }
+    keys = ('day', key_range.SourceKeyRange)
+    columns = [
+        ('day', merge.First(format=formats.Integer)),
+        ('revenue', merge.Sum(format=formats.Integer)),
+        ('visits', merge.Sum('visits', format=formats.Integer)),
+        ('total', merge.Sum('revenue.revenue', 'visits.visits', format=formats.Integer)),
+    ]
+    default_sort = ('day', 'asc')
+
+
+class FilteredMergedDayReport(base.Report):
+    merged_reports = {
+        'revenue': DayRevenueReport,
+        'visits': DayVisitsReport,
+    }
+    filters = [
+        ('not_day_two', merge.PostFilter(lambda row: row['day'] != 2)),
+        ('min_total', merge.PostFilter(
+            lambda row, user_input: row['total'] >= user_input,
+            widget=widgets.Select(choices=((0, 'Any'), (300, '300 or more'))))),
+        ('include_visits', merge.ReportFilter('visits',
+            widget=widgets.Checkbox())),
+    ]
+    keys = ('day', key_range.SourceKeyRange)
+    columns = [
+        ('day', merge.First(format=formats.Integer)),
+        ('revenue', merge.Sum(format=formats.Integer)),
+        ('visits', merge.Sum('visits', format=formats.Integer)),
+        ('total', merge.Sum('revenue.revenue', 'visits.visits', format=formats.Integer)),
+    ]
+    default_sort = ('day', 'asc')
+
+
+class MergedRevenueReport(base.Report):
+    filters = []
+    merged_reports = {
+        'revenue': DayRevenueReport,
+    }
+    keys = ('day', key_range.SourceKeyRange)
+    columns = [
+        ('day', merge.First(format=formats.Integer)),
+        ('revenue', merge.Sum(format=formats.Integer)),
+    ]
+    default_sort = ('day', 'asc')
+
+
+class DayChannelRevenueReport(base.Report):
+    filters = []
+    keys = [
+        ('day', key_range.IterableKeyRange([1, 2])),
+        ('channel', key_range.IterableKeyRange(['web', 'app'])),
+    ]
+    columns = [
+        ('day', key_range.Value(format=formats.Integer)),
+        ('channel', key_range.Value(format=formats.String)),
+        ('revenue', derived.Value(lambda row: row['day'] * 10, format=formats.Integer)),
+    ]
+    default_sort = ('day', 'asc')
+
+
+class ChannelDayVisitsReport(base.Report):
+    filters = []
+    keys = [
+        ('channel', key_range.IterableKeyRange(['web', 'app'])),
+        ('day', key_range.IterableKeyRange([2, 3])),
+    ]
+    columns = [
+        ('day', key_range.Value(format=formats.Integer)),
+        ('channel', key_range.Value(format=formats.String)),
+        ('visits', derived.Value(lambda row: row['day'] * 100, format=formats.Integer)),
+    ]
+    default_sort = ('day', 'asc')
+
+
+class MergedDayChannelReport(base.Report):
+    filters = []
+    merged_reports = {
+        'revenue': DayChannelRevenueReport,
+        'visits': ChannelDayVisitsReport,
+    }
+    keys = [
+        ('day', key_range.SourceKeyRange),
+        ('channel', key_range.SourceKeyRange),
+    ]
+    columns = [
+        ('day', merge.First(format=formats.Integer)),
+        ('channel', merge.First(format=formats.String)),
+        ('revenue', merge.Sum(format=formats.Integer)),
+        ('visits', merge.Sum(format=formats.Integer)),
+    ]
+    default_sort = [('day', 'asc'), ('channel', 'asc')]
@@ -34,3 +34,43 @@ class TestDerivedSource(unittest.TestCase):
         self.assertEqual(col.finalize_footer(None, {'x': Decimal('20.5'), 'y': Decimal('0.5'), 'othervalue': 'string'}), Decimal('41.0'))
         self.assertEqual(col.finalize_footer(None, {'x': Decimal('20.5'), 'y': Decimal('0.0'), 'othervalue': 'string'}), Decimal('0.00'))
         self.assertEqual(col.finalize_footer(None, {'x': Decimal('20.5'), 'y': None, 'othervalue': 'string'}), None)
+
+    def test_expr_column(self):
+        col = derived.Expr('x / (y - 1.5) * 2')
+        self.assertEqual(col.column_names, ['x', 'y'])
+        self.assertEqual(col.get_derived_value({'x': Decimal('5.0'), 'y': Decimal('6.5')}), Decimal('2.0'))
+        self.assertEqual(col.get_derived_value({'x': None, 'y': Decimal('10.0')}), None)
+        self.assertEqual(col.get_derived_value({'x': Decimal('5.0'), 'y': Decimal('1.5')}), Decimal('0.00'))
+        self.assertEqual(col.evaluate_columns({'x': [Decimal('5.0'), None, 1], 'y': [Decimal('6.5'), 3, Decimal('1.5')]}),
+            [Decimal('2.0'), None, Decimal('0.00')])
+        self.assertEqual(col.finalize_footer(None, {'x': Decimal('20.5'), 'y': Decimal('2.0'), 'othervalue': 'string'}), Decimal('82.0'))
+        self.assertEqual(col.finalize_footer(None, {'x': Decimal('20.5'), 'y': None, 'othervalue': 'string'}), None)
+        self.assertEqual(derived.Expr('-x % 3').get_derived_value({'x': 4}), 2)
+
+        # Errors give the same values as for the equivalent Value column
+        cases = [
+            ('x ** -1', lambda row: row['x'] ** -1, {'x': 0}),
+            ('x ** y', lambda row: row['x'] ** row['y'], {'x': Decimal('0'), 'y': 0}),
+            ('x ** y', lambda row: row['x'] ** row['y'], {'x': Decimal('-1'), 'y': Decimal('0.5')}),
+            ('x / y', lambda row: row['x'] / row['y'], {'x': Decimal('0'), 'y': Decimal('0')}),
+            ('x + y', lambda row: row['x'] + row['y'], {'x': Decimal('1'), 'y': 1.5}),
+            ('x / y + z', lambda row: row['x'] / row['y'] + row['z'], {'x': 1, 'y': 0, 'z': None}),
+            ('x / y + z', lambda row: row['x'] / row['y'] + row['z'], {'x': None, 'y': 0, 'z': 1}),
+            ('z + x / y', lambda row: row['z'] + row['x'] / row['y'], {'x': 1, 'y': 0, 'z': None}),
+            ('-x / y', lambda row: -row['x'] / row['y'], {'x': None, 'y': 0}),
+        ]
+        for expression, func, row in cases:
+            self.assertEqual(derived.Expr(expression).get_derived_value(row),
+                derived.Value(func).get_derived_value(row))
+        self.assertEqual(derived.Expr('x ** -1').get_derived_value({'x': 0}), Decimal('0.00'))
+        self.assertEqual(derived.Expr('x + y').get_derived_value({'x': Decimal('1'), 'y': 1.5}), None)
+        self.assertEqual(derived.Expr('x / y + z').get_derived_value({'x': 1, 'y': 0, 'z': None}), Decimal('0.00'))
+        self.assertEqual(derived.Expr('x / y + z').evaluate_columns({'x': [1, 1], 'y': [0, 2], 'z': [None, None]}),
+            [Decimal('0.00'), None])
+
+        # Expressions without columns
+        col = derived.Expr('2 * 1.5')
+        self.assertEqual(col.evaluate_columns({'x': [1, 2]}), [Decimal('3.0')] * 2)
+        self.assertEqual(col.evaluate_columns({}), [])
+        self.assertRaises(ValueError, derived.Expr, 'x +')
+        self.assertRaises(ValueError, derived.Expr, 'row["x"] * 2')
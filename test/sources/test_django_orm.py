@@ -23,6 +23,19 @@ class TestDjangoSource(unittest.TestCase):
             ((id2,), {'_sum_widget_price': Decimal('50.00'), 'user_id': 2, 'num_widgets': 1, 'user_is_active': False}),
         ])
 
+    def test_django_source_plan(self):
+        # Query plans are worked out once and shared by the report's instances
+        source = django_orm.DjangoORMSource(self.report)
+        other_report = reports_django.BasicDatabaseReport(support_base.mock_cache())
+        other_source = django_orm.DjangoORMSource(other_report)
+        self.assertTrue(source._model is other_source._model)
+        self.assertTrue(source._plan() is other_source._plan())
+        self.assertEqual(len(list(other_source.get_rows([], {'user_is_active': None}))), 2)
+
+        # Lookup models are only imported when first used
+        lookup = django_orm.Lookup('test.support_django.missing.Model', 'name', 'user_id')
+        self.assertRaises(ImportError, getattr, lookup, 'django_model')
+
     # def test_sqlalchemy_key_ranges(self):
     #     # Straight up
     #     key_range = sqlalchemy_orm.TableKeyRange('test.support_sqlalchemy.AllTheData', pk_column='widget_id')
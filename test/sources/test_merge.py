@@ -1,106 +1,342 @@
 from decimal import Decimal
+import heapq
+import shutil
+import tempfile
 import unittest
 
-from blingalytics import widgets
+from blingalytics import caches, widgets
+from blingalytics.caches.mmap_cache import MmapCache
 from blingalytics.sources import merge
-from mock import Mock
+from mock import Mock, patch
 
-from test import reports_django, support_base, support_sqlalchemy
+from test import reports_basic
 
 
 class TestMergeSource(unittest.TestCase):
-    pass
-    # def setUp(self):
-    #     cache = Mock()
-    #     cache.instance_rows.return_value = [
-    #         {'_bling_id': 1, 'user_id': 1, 'user_is_active': True, 'num_widgets': 2, '_sum_widget_price': Decimal('6.00'), 'average_widget_price': Decimal('3.00')},
-    #         {'_bling_id': 2, 'user_id': 2, 'user_is_active': False, 'num_widgets': 10, '_sum_widget_price': Decimal('100.00'), 'average_widget_price': Decimal('10.00')},
-    #     ]
-    #     self.report = reports_sqlalchemy.BasicMergeReport(cache)
-
-    # def test_merge_source(self):
-    #     id1, id2 = support_base.Compare(), support_base.Compare()
-    #     self.report.clean_user_inputs(include='1', user_is_active='0')
-    #     source = merge.MergeSource(self.report)
-    #     self.assertEqual(list(source.get_rows([], self.report.clean_inputs)), [
-    #         ((id1,), {'double_num_widgets': 4, 'user_id': 1, 'user_is_active': True}),
-    #         ((id2,), {'double_num_widgets': 20, 'user_id': 2, 'user_is_active': False}),
-    #     ])
-    #     self.report.clean_user_inputs(include='', user_is_active='0')
-    #     self.assertEqual(list(source.get_rows([], self.report.clean_inputs)), [
-    #         ((id1,), {'double_num_widgets': 2, 'user_id': 1, 'user_is_active': True}),
-    #         ((id2,), {'double_num_widgets': 10, 'user_id': 2, 'user_is_active': False}),
-    #     ])
-
-    # def test_merge_columns(self):
-    #     # Test basic merge column functionality, and Sum functionality
-    #     col = merge.Sum() # Should merge any columns with the column name given (second arg)
-    #     self.assertEqual(col._merge_report_column('report1', 'col1', {'col1': 1, 'col2': 2}, {'col1': 3, 'col2': 4}), 4)
-    #     self.assertEqual(col._merge_report_column('report1', 'col3', {'col1': 1, 'col2': 2}, {'col1': 3, 'col2': 4}), None)
-    #     self.assertEqual(col._merge_report_column('report23883832', 'col2', {'col1': 1, 'col2': 2}, {'col1': 3, 'col2': 4}), 6)
-    #     self.assertEqual(col._merge_report_column('report1', 'col1', {}, {'col1': 3, 'col2': 4}), 3)
-    #     self.assertEqual(col._merge_report_column('report1', 'col1', {'col1': Decimal('1.45'), 'col2': 2}, {'col1': Decimal('2.01'), 'col2': 4}), Decimal('3.46'))
-    #     self.assertRaises(TypeError, col._merge_report_column, 'report1', 'col1', {'col1': 'string', 'col2': 2}, {'col1': Decimal('1.5'), 'col2': 4})
-    #     col = merge.Sum('col1') # Should merge col1 columns regardless of the second arg
-    #     self.assertEqual(col._merge_report_column('report1', 'col1', {'col1': 1, 'col2': 2}, {'col1': 3, 'col2': 4}), 4)
-    #     self.assertEqual(col._merge_report_column('report1', 'col3', {'col1': 1, 'col2': 2}, {'col1': 3, 'col2': 4}), 3)
-    #     self.assertEqual(col._merge_report_column('report23883832', 'col1', {'col1': 1, 'col2': 2}, {'col2': 4}), 1)
-    #     self.assertEqual(col._merge_report_column('report1', 'col2', {'col1': 1, 'col2': 2}, {'col1': 3, 'col2': 4}), 5)
-    #     col = merge.Sum('report1.col1') # Should merge only col1 from report1
-    #     self.assertEqual(col._merge_report_column('report1', 'col1', {'col1': 1, 'col2': 2}, {'col1': 3, 'col2': 4}), 4)
-    #     self.assertEqual(col._merge_report_column('report1', 'col2', {'col1': 1, 'col2': 2}, {'col1': 3, 'col2': 4}), 5)
-    #     self.assertEqual(col._merge_report_column('report2', 'col1', {'col1': 1, 'col2': 2}, {'col1': 3, 'col2': 4}), 1)
-    #     self.assertEqual(col._merge_report_column('report2', 'col2', {'col1': 1, 'col2': 2}, {'col1': 3, 'col2': 4}), 2)
-    #     col = merge.Sum('report1.col1', 'report2.col2') # Should merge col1 from report1, col2 from report2
-    #     self.assertEqual(col._merge_report_column('report1', 'col1', {'col1': 1, 'col2': 2}, {'col1': 3, 'col2': 4}), 4)
-    #     self.assertEqual(col._merge_report_column('report1', 'col2', {'col1': 1, 'col2': 2}, {'col1': 3, 'col2': 4}), 5)
-    #     self.assertEqual(col._merge_report_column('report2', 'col1', {'col1': 1, 'col2': 2}, {'col1': 3, 'col2': 4}), 5)
-    #     self.assertEqual(col._merge_report_column('report2', 'col2', {'col1': 1, 'col2': 2}, {'col1': 3, 'col2': 4}), 6)
-    #     self.assertEqual(col._merge_report_column('report3', 'col3', {'col1': 1, 'col2': 2}, {'col1': 3, 'col2': 4}), None)
-
-    #     # First
-    #     col = merge.First()
-    #     self.assertEqual(col._merge_report_column('report1', 'col1', {'col1': 1, 'col2': 2}, {'col1': 3, 'col2': 4}), 1)
-    #     self.assertEqual(col._merge_report_column('report1', 'col1', {'col1': None, 'col2': 2}, {'col1': 3, 'col2': 4}), 3)
-    #     self.assertEqual(col._merge_report_column('report1', 'col1', {}, {'col1': 3, 'col2': 4}), 3)
-
-    #     # BoolAnd
-    #     col = merge.BoolAnd()
-    #     self.assertEqual(col._merge_report_column('report1', 'col1', {'col1': None, 'col2': 2}, {'col1': True, 'col2': 4}), True)
-    #     self.assertEqual(col._merge_report_column('report1', 'col1', {'col1': True, 'col2': 2}, {'col1': None, 'col2': 4}), True)
-    #     self.assertEqual(col._merge_report_column('report1', 'col1', {'col1': None, 'col2': 2}, {'col1': False, 'col2': 4}), False)
-    #     self.assertEqual(col._merge_report_column('report1', 'col1', {'col1': True, 'col2': 2}, {'col1': False, 'col2': 4}), False)
-    #     self.assertEqual(col._merge_report_column('report1', 'col1', {'col1': False, 'col2': 2}, {'col1': False, 'col2': 4}), False)
-    #     self.assertEqual(col._merge_report_column('report1', 'col1', {'col1': None, 'col2': 2}, {'col1': None, 'col2': 4}), True)
-
-    #     # BoolOr
-    #     col = merge.BoolOr()
-    #     self.assertEqual(col._merge_report_column('report1', 'col1', {'col1': None, 'col2': 2}, {'col1': True, 'col2': 4}), True)
-    #     self.assertEqual(col._merge_report_column('report1', 'col1', {'col1': True, 'col2': 2}, {'col1': None, 'col2': 4}), True)
-    #     self.assertEqual(col._merge_report_column('report1', 'col1', {'col1': None, 'col2': 2}, {'col1': False, 'col2': 4}), False)
-    #     self.assertEqual(col._merge_report_column('report1', 'col1', {'col1': True, 'col2': 2}, {'col1': False, 'col2': 4}), True)
-    #     self.assertEqual(col._merge_report_column('report1', 'col1', {'col1': False, 'col2': 2}, {'col1': False, 'col2': 4}), False)
-    #     self.assertEqual(col._merge_report_column('report1', 'col1', {'col1': None, 'col2': 2}, {'col1': None, 'col2': 4}), False)
-
-    # def test_merge_filters(self):
-    #     # PostFilter
-    #     fil = merge.PostFilter(lambda row: row['include'] in ('yes', 'please'))
-    #     self.assertEqual(fil.include_row({'include': 'yes', 'value': 2}, {}), True)
-    #     self.assertEqual(fil.include_row({'include': 'maybe so', 'value': 2}, {}), False)
-    #     self.assertRaises(KeyError, fil.include_row, {'value': 1, 'othervalue': 2}, {})
-    #     widget = widgets.Select(choices=((True, 'Include'), (False, 'Disclude')))
-    #     widget._name = 'widget'
-    #     fil = merge.PostFilter(lambda row, user_input: user_input, widget=widget)
-    #     self.assertEqual(fil.include_row({'value': 1}, {'widget': widget.clean(1)}), False)
-
-    #     # ReportFilter
-    #     widget = widgets.Checkbox()
-    #     widget._name = 'widget'
-    #     fil = merge.ReportFilter('report1', widget=widget)
-    #     self.assertEqual(fil.excluded_reports({'widget': widget.clean(True)}), [])
-    #     self.assertEqual(fil.excluded_reports({'widget': widget.clean(False)}), ['report1'])
-
-    #     # DelegatedFilter
-    #     del1 = Mock()
-    #     del2 = Mock()
-    #     fil = merge.DelegatedFilter(del1)
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = MmapCache(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def run_merge(self, report_cls, **attrs):
+        # Runs the merge report with the given attributes set on its class,
+        # returning its raw rows and footer
+        patches = [
+            patch.object(report_cls, name, value, create=True)
+            for name, value in attrs.items()
+        ]
+        for attr_patch in patches:
+            attr_patch.start()
+        try:
+            report = report_cls(self.cache)
+        finally:
+            for attr_patch in patches:
+                attr_patch.stop()
+        report.clean_user_inputs()
+        report.run_report()
+        return (report.report_rows(format='raw'),
+            report.report_footer(format='raw'))
+
+    def strip_ids(self, rows):
+        return [row[1:] for row in rows]
+
+    def merge_report_column(self, col, report_name, column_name, current, new):
+        # Merges the sub-report row into the current row's value for the
+        # column, as the merge plans do
+        source_name = col._source_column(report_name, column_name, new)
+        if source_name is None:
+            return current.get(column_name)
+        return col.merge(current.get(column_name), new.get(source_name))
+
+    def test_merge_columns(self):
+        # Test basic merge column functionality, and Sum functionality
+        col = merge.Sum() # Should merge any columns with the column name given (second arg)
+        self.assertEqual(self.merge_report_column(col, 'report1', 'col1', {'col1': 1, 'col2': 2}, {'col1': 3, 'col2': 4}), 4)
+        self.assertEqual(self.merge_report_column(col, 'report1', 'col3', {'col1': 1, 'col2': 2}, {'col1': 3, 'col2': 4}), None)
+        self.assertEqual(self.merge_report_column(col, 'report23883832', 'col2', {'col1': 1, 'col2': 2}, {'col1': 3, 'col2': 4}), 6)
+        self.assertEqual(self.merge_report_column(col, 'report1', 'col1', {}, {'col1': 3, 'col2': 4}), 3)
+        self.assertEqual(self.merge_report_column(col, 'report1', 'col1', {'col1': Decimal('1.45'), 'col2': 2}, {'col1': Decimal('2.01'), 'col2': 4}), Decimal('3.46'))
+        self.assertRaises(TypeError, self.merge_report_column, col, 'report1', 'col1', {'col1': 'string', 'col2': 2}, {'col1': Decimal('1.5'), 'col2': 4})
+        col = merge.Sum('col1') # Should merge col1 columns regardless of the second arg
+        self.assertEqual(self.merge_report_column(col, 'report1', 'col1', {'col1': 1, 'col2': 2}, {'col1': 3, 'col2': 4}), 4)
+        self.assertEqual(self.merge_report_column(col, 'report1', 'col3', {'col1': 1, 'col2': 2}, {'col1': 3, 'col2': 4}), 3)
+        self.assertEqual(self.merge_report_column(col, 'report23883832', 'col1', {'col1': 1, 'col2': 2}, {'col2': 4}), 1)
+        self.assertEqual(self.merge_report_column(col, 'report1', 'col2', {'col1': 1, 'col2': 2}, {'col1': 3, 'col2': 4}), 5)
+        col = merge.Sum('report1.col1') # Should merge only col1 from report1
+        self.assertEqual(self.merge_report_column(col, 'report1', 'col1', {'col1': 1, 'col2': 2}, {'col1': 3, 'col2': 4}), 4)
+        self.assertEqual(self.merge_report_column(col, 'report1', 'col2', {'col1': 1, 'col2': 2}, {'col1': 3, 'col2': 4}), 5)
+        self.assertEqual(self.merge_report_column(col, 'report2', 'col1', {'col1': 1, 'col2': 2}, {'col1': 3, 'col2': 4}), 1)
+        self.assertEqual(self.merge_report_column(col, 'report2', 'col2', {'col1': 1, 'col2': 2}, {'col1': 3, 'col2': 4}), 2)
+        col = merge.Sum('report1.col1', 'report2.col2') # Should merge col1 from report1, col2 from report2
+        self.assertEqual(self.merge_report_column(col, 'report1', 'col1', {'col1': 1, 'col2': 2}, {'col1': 3, 'col2': 4}), 4)
+        self.assertEqual(self.merge_report_column(col, 'report1', 'col2', {'col1': 1, 'col2': 2}, {'col1': 3, 'col2': 4}), 5)
+        self.assertEqual(self.merge_report_column(col, 'report2', 'col1', {'col1': 1, 'col2': 2}, {'col1': 3, 'col2': 4}), 5)
+        self.assertEqual(self.merge_report_column(col, 'report2', 'col2', {'col1': 1, 'col2': 2}, {'col1': 3, 'col2': 4}), 6)
+        self.assertEqual(self.merge_report_column(col, 'report3', 'col3', {'col1': 1, 'col2': 2}, {'col1': 3, 'col2': 4}), None)
+
+        # First
+        col = merge.First()
+        self.assertEqual(self.merge_report_column(col, 'report1', 'col1', {'col1': 1, 'col2': 2}, {'col1': 3, 'col2': 4}), 1)
+        self.assertEqual(self.merge_report_column(col, 'report1', 'col1', {'col1': None, 'col2': 2}, {'col1': 3, 'col2': 4}), 3)
+        self.assertEqual(self.merge_report_column(col, 'report1', 'col1', {}, {'col1': 3, 'col2': 4}), 3)
+
+        # BoolAnd
+        col = merge.BoolAnd()
+        self.assertEqual(self.merge_report_column(col, 'report1', 'col1', {'col1': None, 'col2': 2}, {'col1': True, 'col2': 4}), True)
+        self.assertEqual(self.merge_report_column(col, 'report1', 'col1', {'col1': True, 'col2': 2}, {'col1': None, 'col2': 4}), True)
+        self.assertEqual(self.merge_report_column(col, 'report1', 'col1', {'col1': None, 'col2': 2}, {'col1': False, 'col2': 4}), False)
+        self.assertEqual(self.merge_report_column(col, 'report1', 'col1', {'col1': True, 'col2': 2}, {'col1': False, 'col2': 4}), False)
+        self.assertEqual(self.merge_report_column(col, 'report1', 'col1', {'col1': False, 'col2': 2}, {'col1': False, 'col2': 4}), False)
+        self.assertEqual(self.merge_report_column(col, 'report1', 'col1', {'col1': None, 'col2': 2}, {'col1': None, 'col2': 4}), True)
+
+        # BoolOr
+        col = merge.BoolOr()
+        self.assertEqual(self.merge_report_column(col, 'report1', 'col1', {'col1': None, 'col2': 2}, {'col1': True, 'col2': 4}), True)
+        self.assertEqual(self.merge_report_column(col, 'report1', 'col1', {'col1': True, 'col2': 2}, {'col1': None, 'col2': 4}), True)
+        self.assertEqual(self.merge_report_column(col, 'report1', 'col1', {'col1': None, 'col2': 2}, {'col1': False, 'col2': 4}), False)
+        self.assertEqual(self.merge_report_column(col, 'report1', 'col1', {'col1': True, 'col2': 2}, {'col1': False, 'col2': 4}), True)
+        self.assertEqual(self.merge_report_column(col, 'report1', 'col1', {'col1': False, 'col2': 2}, {'col1': False, 'col2': 4}), False)
+        self.assertEqual(self.merge_report_column(col, 'report1', 'col1', {'col1': None, 'col2': 2}, {'col1': None, 'col2': 4}), False)
+
+    def test_merge_filters(self):
+        # PostFilter
+        fil = merge.PostFilter(lambda row: row['include'] in ('yes', 'please'))
+        self.assertEqual(fil.include_row({'include': 'yes', 'value': 2}, {}), True)
+        self.assertEqual(fil.include_row({'include': 'maybe so', 'value': 2}, {}), False)
+        self.assertRaises(KeyError, fil.include_row, {'value': 1, 'othervalue': 2}, {})
+        widget = widgets.Select(choices=((True, 'Include'), (False, 'Disclude')))
+        widget._name = 'widget'
+        fil = merge.PostFilter(lambda row, user_input: user_input, widget=widget)
+        self.assertEqual(fil.include_row({'value': 1}, {'widget': widget.clean(1)}), False)
+        self.assertEqual(fil.include_row({'value': 1}, {'widget': widget.clean(0)}), True)
+
+        # ReportFilter
+        widget = widgets.Checkbox()
+        widget._name = 'widget'
+        fil = merge.ReportFilter('report1', widget=widget)
+        self.assertEqual(fil.excluded_reports({'widget': widget.clean(True)}), [])
+        self.assertEqual(fil.excluded_reports({'widget': widget.clean(False)}), ['report1'])
+        self.assertRaises(ValueError, merge.ReportFilter, 'report1')
+
+        # DelegatedFilter
+        fil = merge.DelegatedFilter(Mock(), widget=widget)
+        self.assertTrue(fil.widget is widget)
+
+    def test_merge_source(self):
+        rows, footer = self.run_merge(reports_basic.MergedDayReport)
+        self.assertEqual(self.strip_ids(rows), [
+            [1, 10, None, 10],
+            [2, 21, 200, 220],
+            [3, 31, 300, 330],
+            [4, 1, 400, 400],
+        ])
+        self.assertEqual(footer[1:], [10, 63, 900, 960])
+
+    def test_compound_key_merge(self):
+        # Sub-reports are read from the cache sorted on both merge keys, even
+        # when their own keys come in another order
+        rows, footer = self.run_merge(reports_basic.MergedDayChannelReport)
+        self.assertEqual(self.strip_ids(rows), [
+            [1, u'app', 10, None],
+            [1, u'web', 10, None],
+            [2, u'app', 20, 200],
+            [2, u'web', 20, 200],
+            [3, u'app', None, 300],
+            [3, u'web', None, 300],
+        ])
+        self.assertEqual(footer[3:], [60, 1000])
+
+        # And the cache worked that sort out when the sub-reports were built
+        report = reports_basic.MergedDayChannelReport(self.cache)
+        report.clean_user_inputs()
+        source = merge.MergeSource(report)
+        source._prepare_reports()
+        for sub_report in source._reports.values():
+            self.assertEqual(sub_report._cache_sort_orders(),
+                [[('day', 'asc', False), ('channel', 'asc', True)]])
+            instance = self.cache._instance(*sub_report.unique_id)
+            self.assertEqual(instance.meta['orders'].keys(),
+                ['day:asc:0,channel:asc:1'])
+
+    def test_filtered_merge(self):
+        def run(**inputs):
+            report = reports_basic.FilteredMergedDayReport(self.cache)
+            self.assertEqual(report.clean_user_inputs(**inputs), [])
+            report.run_report()
+            source = merge.MergeSource(report)
+            source._prepare_reports()
+            return (self.strip_ids(report.report_rows(format='raw')),
+                dict((name, sub_report.is_report_finished())
+                    for name, sub_report in source._reports.items()))
+
+        # PostFilters drop rows, with or without a widget
+        rows, built = run(filtered_merged_day_report_min_total='0',
+            filtered_merged_day_report_include_visits='1')
+        self.assertEqual(rows, [[1, 10, None, 10], [3, 31, 300, 330], [4, 1, 400, 400]])
+        self.assertEqual(built, {'revenue': True, 'visits': True})
+        rows, built = run(filtered_merged_day_report_min_total='1',
+            filtered_merged_day_report_include_visits='1')
+        self.assertEqual(rows, [[3, 31, 300, 330], [4, 1, 400, 400]])
+
+        # A ReportFilter leaves its sub-report out, without building it
+        rows, built = run(filtered_merged_day_report_min_total='0')
+        self.assertEqual(rows, [[1, 10, None, 10], [3, 30, None, 30]])
+        self.assertEqual(built, {'revenue': True, 'visits': False})
+
+    def test_merge_plans(self):
+        report = reports_basic.MergedDayReport(self.cache)
+        report.clean_user_inputs()
+        source = merge.MergeSource(report)
+        source._prepare_reports()
+        reports = source._reports.items()
+        plans = source._merge_plans(reports)
+        self.assertEqual(dict([
+            (name, [(column, source_column) for column, source_column, merge_func in plan])
+            for name, plan in plans.items()
+        ]), {
+            'revenue': [('day', 'day'), ('revenue', 'revenue'), ('total', 'revenue')],
+            'visits': [('day', 'day'), ('revenue', 'revenue'), ('visits', 'visits'),
+                ('total', 'visits')],
+        })
+
+        # Merging with the plans gives the same rows as working out the
+        # source column for every column of every sub-report row
+        report.run_report()
+        expected = {}
+        for key, report_name, row in heapq.merge(
+                *map(source._report_rows_mapper, reports)):
+            merged = expected.setdefault(key, dict(
+                (name, None) for name, column in report.columns))
+            for name, column in report.columns:
+                source_name = column._source_column(report_name, name, row)
+                if source_name is not None:
+                    merged[name] = column.merge(merged[name], row.get(source_name))
+        expected = [
+            [expected[key][name] for name, column in report.columns]
+            for key in sorted(expected)
+        ]
+        self.assertEqual(self.strip_ids(report.report_rows(format='raw')),
+            expected)
+
+    def test_stream_reports(self):
+        # Merging the sub-reports' rows as they're produced gives the same
+        # report as merging them from the cache, without caching them
+        cached = self.run_merge(reports_basic.MergedDayReport)
+        report = reports_basic.MergedDayReport(self.cache)
+        report.kill_cache(full=True)
+        streamed = self.run_merge(reports_basic.MergedDayReport,
+            merge_cache_subreports=False)
+        self.assertEqual(self.strip_ids(streamed[0]), self.strip_ids(cached[0]))
+        self.assertEqual(streamed[1], cached[1])
+        report = reports_basic.MergedDayReport(self.cache)
+        report.clean_user_inputs()
+        source = merge.MergeSource(report)
+        source._prepare_reports()
+        for sub_report in source._reports.values():
+            self.assertFalse(sub_report.is_report_finished())
+
+        # Sub-reports whose rows aren't in merge key order are cached anyway
+        reports = source._reports.items()
+        self.assertTrue(source._can_stream_reports(reports))
+        source._key_names = ['revenue']
+        self.assertFalse(source._can_stream_reports(reports))
+
+    def test_merge_workers(self):
+        # Building the sub-reports on several threads gives the same report
+        serial = self.run_merge(reports_basic.MergedDayReport)
+        report = reports_basic.MergedDayReport(self.cache)
+        report.kill_cache(full=True)
+        threaded = self.run_merge(reports_basic.MergedDayReport, merge_workers=4)
+        self.assertEqual(self.strip_ids(threaded[0]), self.strip_ids(serial[0]))
+        self.assertEqual(threaded[1], serial[1])
+
+    def test_share_reports(self):
+        # Shared sub-reports are cached under their own ids
+        self.run_merge(reports_basic.MergedDayReport, merge_share_subreports=True)
+        sub_report = reports_basic.DayRevenueReport(self.cache)
+        self.assertTrue(sub_report.is_report_finished())
+
+        # So another merge report including them doesn't build them again
+        with patch.object(merge.MergeSource, '_build_report') as build_report:
+            rows, footer = self.run_merge(reports_basic.MergedRevenueReport,
+                merge_share_subreports=True)
+        self.assertFalse(build_report.called)
+        self.assertEqual(self.strip_ids(rows), [[1, 10], [2, 20], [3, 30]])
+
+        # Without sharing, each merge report caches its own copy
+        report = reports_basic.MergedRevenueReport(self.cache)
+        report.clean_user_inputs()
+        source = merge.MergeSource(report)
+        source._prepare_reports()
+        self.assertEqual(source._reports['revenue'].unique_id,
+            (report.unique_id[0], '%s::revenue' % report.unique_id[1]))
+        self.assertEqual(sub_report.unique_id[0], 'day_revenue_report')
+
+    def test_kill_shared_reports(self):
+        # Another instance of a shared sub-report, as used by some other
+        # report with other inputs
+        self.cache.create_instance('day_revenue_report', 'other',
+            iter([{'day': 1, 'revenue': 5}]), lambda: {}, 3600)
+
+        # A full kill of the merge report kills the shared sub-reports'
+        # instances it uses, but not their other instances
+        self.run_merge(reports_basic.MergedDayReport, merge_share_subreports=True)
+        with patch.object(reports_basic.MergedDayReport,
+                'merge_share_subreports', True, create=True):
+            report = reports_basic.MergedDayReport(self.cache)
+        report.clean_user_inputs()
+        report.kill_cache(full=True)
+        self.assertFalse(report.is_report_finished())
+        for sub_report_cls in (reports_basic.DayRevenueReport,
+                reports_basic.DayVisitsReport):
+            self.assertFalse(sub_report_cls(self.cache).is_report_finished())
+        self.assertTrue(
+            self.cache.is_instance_finished('day_revenue_report', 'other'))
+
+        # Without sharing, the sub-reports' copies go with the merge report
+        self.run_merge(reports_basic.MergedDayReport)
+        report = reports_basic.MergedDayReport(self.cache)
+        report.clean_user_inputs()
+        instance_id = report.unique_id[1]
+        report.kill_cache(full=True)
+        for name in ('revenue', 'visits'):
+            self.assertFalse(self.cache.is_instance_finished(
+                'merged_day_report', '%s::%s' % (instance_id, name)))
+        self.assertTrue(
+            self.cache.is_instance_finished('day_revenue_report', 'other'))
+
+    def test_build_report(self):
+        source = merge.MergeSource(reports_basic.MergedDayReport(self.cache))
+
+        # Waits for a sub-report being built elsewhere to finish
+        sub_report = Mock()
+        sub_report.run_report.side_effect = caches.InstanceLockError
+        sub_report.is_report_finished.side_effect = [False, False, True]
+        sub_report.wait_report_progress.side_effect = [
+            {'stage': 'started'}, {'stage': 'finished'}]
+        source._build_report(sub_report)
+        self.assertEqual(sub_report.wait_report_progress.call_args_list[1][0],
+            ({'stage': 'started'}, 1))
+
+        # Unless it fails
+        sub_report.is_report_finished.side_effect = None
+        sub_report.is_report_finished.return_value = False
+        sub_report.wait_report_progress.side_effect = None
+        sub_report.wait_report_progress.return_value = {'stage': 'failed'}
+        self.assertRaises(caches.InstanceIncompleteError,
+            source._build_report, sub_report)
+
+        # Or takes too long
+        sub_report.wait_report_progress.reset_mock()
+        with patch.object(merge, 'SUBREPORT_WAIT_TIMEOUT', 0):
+            self.assertRaises(caches.InstanceLockError,
+                source._build_report, sub_report)
+        self.assertFalse(sub_report.wait_report_progress.called)
+
+        # A sub-report that's already built is left alone
+        sub_report.run_report.side_effect = caches.InstanceExistsError
+        sub_report.wait_report_progress.reset_mock()
+        source._build_report(sub_report)
+        self.assertFalse(sub_report.wait_report_progress.called)
@@ -2,6 +2,8 @@ from datetime import datetime
 from decimal import Decimal
 import unittest
 
+from mock import patch
+
 import blingalytics
 from blingalytics import base, formats, widgets
 
@@ -13,7 +15,7 @@ class TestReportUtilities(unittest.TestCase):
     def setUp(self):
         # Ensure the report metaclass' catalog of reports is empty to start
         self._old_report_catalog = base.ReportMeta.report_catalog
-        base.ReportMeta.report_catalog = []
+        base.ReportMeta.report_catalog = base.ReportCatalog()
 
     def tearDown(self):
         # Restore the original report catalog
@@ -36,6 +38,29 @@ class TestReportUtilities(unittest.TestCase):
         self.assertEqual(NamedStupidReport,
             blingalytics.get_report_by_code_name('even_more_stupid_name'))
 
+    def test_register_report(self):
+        class StupidTestReport(base.Report):
+            pass
+        class SameNameReport(base.Report):
+            code_name = 'stupid_test_report'
+
+        # First report with a code name wins
+        self.assertEqual(StupidTestReport,
+            blingalytics.get_report_by_code_name('stupid_test_report'))
+
+        # Registered reports are only imported when asked for
+        blingalytics.register_report('lazy_report',
+            'test.reports_basic.SuperBasicReport')
+        blingalytics.register_report('broken_report',
+            'test.nonexistent_reports.BrokenReport')
+        self.assertEqual(None,
+            blingalytics.get_report_by_code_name('nonexistent_report_name'))
+        from test import reports_basic
+        self.assertEqual(reports_basic.SuperBasicReport,
+            blingalytics.get_report_by_code_name('lazy_report'))
+        self.assertRaises(ImportError,
+            blingalytics.get_report_by_code_name, 'broken_report')
+
     def test_get_reports_by_category(self):
         # Couple reports to test with
         class StupidTestReport(base.Report):
@@ -119,7 +144,7 @@ class TestReportBase(unittest.TestCase):
         self.assertEqual(args[:2], ('basic_database_report', 'faafe977b85c59058a2a'))
         self.assertTrue(callable(args[2].next))
         self.assertEqual(args[3:], (self.report._get_footer, 1800))
-        self.assertEqual(kwargs, {})
+        self.assertEqual(kwargs, {'sort_orders': []})
 
         # Verify report status methods
         self.report.is_report_started()
@@ -337,6 +362,54 @@ class TestFormats(unittest.TestCase):
         self.assertEqual(format.format_html([1, 2, 3]), '[1, 2, 3]')
         self.assertEqual(format.format_csv([1, 2, 3]), '[1, 2, 3]')
 
+    def test_format_many(self):
+        values = [Decimal('12345.678'), None, Decimal('-3.25'), 0]
+        for format in [formats.Bling(), formats.Decimal(precision=2),
+                formats.Integer(), formats.Integer(grouping=False),
+                formats.Percent(), formats.String(), formats.Hidden()]:
+            for output in ['html', 'csv', 'xls']:
+                self.assertEqual(format.format_many(values, output),
+                    map(format.get_formatter(output), values))
+
+        # Overridden format methods are always used
+        class Dollars(formats.Integer):
+            def format_html(self, value):
+                return '$%d' % value
+        self.assertEqual(Dollars().format_many([1, 2]), ['$1', '$2'])
+        self.assertRaises(TypeError, formats.Integer().format_many, ['a'])
+
+    def test_format_memoization(self):
+        class Counted(formats.String):
+            calls = 0
+            memo_size = 3
+            def format(self, value):
+                Counted.calls += 1
+                return super(Counted, self).format(value)
+
+        # Formats are only memoized when declared cacheable
+        format = Counted()
+        format.format_many(['a', 'a'])
+        self.assertEqual(Counted.calls, 2)
+
+        format = Counted(title=True)
+        self.assertEqual(format.format_many(['ab', 'ab', 1, True, 1]),
+            ['Ab', 'Ab', '1', 'True', '1'])
+        self.assertEqual(Counted.calls, 5)
+
+        # Each output type is remembered separately
+        self.assertEqual(format.format_many(['ab'], 'csv'), ['Ab'])
+        self.assertEqual(Counted.calls, 6)
+
+        # Unhashable values are formatted every time
+        format.format_many([[1], [1]])
+        self.assertEqual(Counted.calls, 8)
+
+        # The memo is bounded
+        format.format_many(['c', 'd', 'ab'])
+        self.assertEqual(Counted.calls, 11)
+        self.assertTrue(formats.Epoch().cacheable)
+        self.assertFalse(formats.Integer().cacheable)
+
 class TestWidgets(unittest.TestCase):
     def test_widget_base(self):
         # Standard functionality
@@ -416,6 +489,91 @@ class TestWidgets(unittest.TestCase):
             '<option value="0" >0</option><option value="1" >1</option><option value="2" >4</option><option value="3" >9</option><option value="4" >16</option>'
             '<option value="5" selected>25</option><option value="6" >36</option><option value="7" >49</option><option value="8" >64</option><option value="9" >81</option></select>')
 
+    def test_select_choices_memoized(self):
+        calls = []
+        def choices():
+            calls.append(1)
+            return [(1, 'one'), (2, 'two')]
+        widget = widgets.Select(choices=choices)
+        widget._report_code_name = 'report'
+        widget._name = 'widget'
+
+        # Evaluated every time outside of a scope
+        widget.get_choices()
+        widget.get_choices()
+        self.assertEqual(len(calls), 2)
+
+        # Evaluated once within a scope
+        memo = {}
+        with widgets.choices_scope(memo):
+            self.assertEqual(widget.clean('1'), 2)
+            widget.get_unique_id({})
+            widget.render()
+        with widgets.choices_scope(memo):
+            self.assertEqual(widget.get_choices(), [(1, 'one'), (2, 'two')])
+        self.assertEqual(len(calls), 3)
+
+        # Replacing the choices invalidates the memo
+        widget.choices = lambda: [(3, 'three')]
+        with widgets.choices_scope(memo):
+            self.assertEqual(widget.get_choices(), [(3, 'three')])
+
+        # Shared between scopes for the TTL
+        del calls[:]
+        widget = widgets.Select(choices=choices, choices_ttl=60)
+        with widgets.choices_scope({}):
+            widget.get_choices()
+        with widgets.choices_scope({}):
+            widget.get_choices()
+        widget.get_choices()
+        self.assertEqual(len(calls), 1)
+        widget._shared_choices = (choices, 0, [])
+        widget.get_choices()
+        self.assertEqual(len(calls), 2)
+
+    def test_cached_render(self):
+        widget = widgets.Select(choices=[(1, 'one'), (2, 'two')], default=0)
+        widget._report_code_name = 'report'
+        widget._name = 'widget'
+        html = widget.render()
+        self.assertEqual(widget.cached_render(), html)
+        with patch.object(widget, 'render') as render:
+            widget.cached_render()
+            self.assertFalse(render.called)
+
+        # Changes to the widget are picked up
+        widget.choices = [(3, 'three')]
+        self.assertTrue('three' in widget.cached_render())
+        widget.default = -1
+        self.assertTrue('selected' in widget.cached_render())
+
+        # Callable defaults and choices are rendered every time, unless the
+        # choices are shared for a while
+        calls = []
+        def choices():
+            calls.append(1)
+            return [(len(calls), 'option %d' % len(calls))]
+        widget.choices = choices
+        widget.cached_render()
+        self.assertTrue('option 2' in widget.cached_render())
+        widget.choices_ttl = 60
+        self.assertTrue('option 3' in widget.cached_render())
+        self.assertTrue('option 3' in widget.cached_render())
+        widget._shared_choices = (choices, 0, [])
+        self.assertTrue('option 4' in widget.cached_render())
+        widget.default = lambda: 0
+        with patch.object(widget, 'render') as render:
+            widget.cached_render()
+            self.assertTrue(render.called)
+
+        widget = widgets.DatePicker(default='today')
+        widget._report_code_name = 'report'
+        widget._name = 'date'
+        with patch.object(widget, 'render') as render:
+            widget.cached_render()
+            widget.cached_render()
+            self.assertEqual(render.call_count, 2)
+
     def test_multiselect_widget(self):
         CHOICES_CALL = lambda: [(i * i, str(i * i)) for i in xrange(10)]
         widget = widgets.Multiselect(choices=CHOICES_CALL, default=0, extra_class='fail', extra_attrs={'stu': 'pendous'})
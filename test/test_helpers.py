@@ -3,7 +3,8 @@ import unittest
 
 from blingalytics import helpers
 from blingalytics.caches.local_cache import LocalCache
-from mock import Mock
+from blingalytics.utils.collections import LRUCache
+from mock import Mock, patch
 
 from test import reports_basic, reports_django
 from test.support_base import mock_cache
@@ -23,6 +24,12 @@ class TestFrontendHelpers(unittest.TestCase):
         self.mock_cache.instance_rows.return_value = []
         self.mock_cache.instance_footer.return_value = {'id': None}
         self.mock_cache.instance_row_count.return_value = 0
+        self.mock_cache.instance_page.return_value = {
+            'rows': [],
+            'row_count': 0,
+            'footer': {'id': None},
+            'timestamp': None,
+        }
 
     def test_report_response_basic(self):
         # Test report codename errors
@@ -65,6 +72,164 @@ class TestFrontendHelpers(unittest.TestCase):
         self.assertEqual(len(response['aaData'][0]), 2)
         self.assertEqual(len(response['footer']), 2)
 
+    def test_report_response_csv(self):
+        params = {
+            'report': 'super_basic_report',
+            'format': 'csv',
+            'download': '1',
+        }
+        body, mimetype, headers = helpers.report_response(dict(params),
+            cache=CACHE)
+        self.assertEqual(mimetype, 'text/csv')
+        self.assertEqual(headers, {
+            'Content-Disposition': 'attachment; filename="Super Basic Report.csv"',
+        })
+        lines = body.split('\r\n')
+        self.assertEqual(lines[0], 'Super Basic Report')
+        self.assertEqual(lines[3:], ['Id', '1', '1', '1', ''])
+
+        # Streamed in chunks
+        chunks, mimetype, headers = helpers.report_response(dict(params),
+            cache=CACHE, stream=True)
+        self.assertEqual(''.join(chunks), body)
+        report = reports_basic.SuperBasicReport(CACHE)
+        report.clean_user_inputs()
+        chunks = list(helpers.iter_report_csv(report, page_size=2))
+        self.assertEqual(chunks[1:], ['1\r\n1\r\n', '1\r\n'])
+
+    def test_report_response_json(self):
+        params = {
+            'report': 'super_basic_report',
+            'iDisplayStart': '0',
+            'iDisplayLength': '2',
+            'sEcho': '1',
+        }
+        json_dumps = Mock(wraps=json.dumps)
+        page_cache = LRUCache()
+        body, mimetype, headers = helpers.report_response(dict(params),
+            cache=CACHE, json_dumps=json_dumps, page_cache=page_cache)
+        response = json.loads(body)
+        self.assertEqual(response['aaData'], [[1, '1'], [2, '1']])
+        self.assertEqual(response['footer'], [None, '3'])
+        self.assertEqual(response['iTotalRecords'], 3)
+        self.assertEqual(response['sEcho'], '1')
+        self.assertTrue(json_dumps.called)
+        self.assertEqual(len(page_cache), 1)
+
+        # Repeated page is served from the page cache
+        params['sEcho'] = '2'
+        with patch.object(reports_basic.SuperBasicReport,
+                'report_page') as report_page:
+            body, mimetype, headers = helpers.report_response(dict(params),
+                cache=CACHE, page_cache=page_cache)
+            self.assertFalse(report_page.called)
+        second = json.loads(body)
+        self.assertEqual(second['sEcho'], '2')
+        self.assertEqual(second['aaData'], response['aaData'])
+
+        # Killing the cache drops the cached pages
+        helpers.report_response({'report': 'super_basic_report',
+            'killcache': '1'}, cache=CACHE, page_cache=page_cache)
+        self.assertEqual(len(page_cache), 0)
+
+    def test_encode_rows(self):
+        rows = [[1, u'caf\xe9', 'a "quote"', None], [2L, True, 1.5, {'a': [1]}]]
+        self.assertEqual(json.loads(helpers.encode_rows(rows)), rows)
+        self.assertEqual(helpers.encode_rows([]), '[]')
+
+    def test_report_progress(self):
+        # Progress is recorded as the report runs
+        with patch.object(CACHE, 'set_instance_progress') as set_progress:
+            with patch.object(reports_basic.SuperBasicReport,
+                    'progress_interval', 2, create=True):
+                report = reports_basic.SuperBasicReport(CACHE)
+                report.run_report()
+        progress = [args[2] for args, kwargs in set_progress.call_args_list]
+        self.assertEqual([p['stage'] for p in progress],
+            ['started', 'rows', 'footer', 'finished'])
+        self.assertEqual(progress[1]['rows'], 2)
+        self.assertEqual(len(progress[1]['key']), 1)
+        self.assertEqual(progress[-1]['rows'], 3)
+
+        # Row progress can be turned off
+        for interval in (0, None):
+            report.kill_cache()
+            with patch.object(CACHE, 'set_instance_progress') as set_progress:
+                with patch.object(reports_basic.SuperBasicReport,
+                        'progress_interval', interval, create=True):
+                    report = reports_basic.SuperBasicReport(CACHE)
+                    report.run_report()
+            self.assertEqual(
+                [args[2]['stage'] for args, kwargs in set_progress.call_args_list],
+                ['started', 'footer', 'finished'])
+
+        # A finished report sends the one finished event
+        body, mimetype, headers = helpers.report_progress_response({
+            'report': 'super_basic_report',
+        }, cache=CACHE)
+        self.assertEqual(mimetype, 'text/event-stream')
+        events = list(body)
+        self.assertEqual(len(events), 1)
+        self.assertEqual(json.loads(events[0][len('data: '):])['stage'],
+            'finished')
+
+    def test_report_progress_response(self):
+        self.mock_cache.is_instance_finished.return_value = False
+        self.mock_cache.instance_progress.return_value = {
+            'stage': 'rows', 'rows': 1000, 'key': ['1'],
+        }
+        self.mock_cache.wait_instance_progress.return_value = {
+            'stage': 'failed', 'rows': 1200, 'key': None,
+        }
+        body, mimetype, headers = helpers.report_progress_response({
+            'report': 'super_basic_report',
+        }, cache=self.mock_cache)
+        self.assertEqual(headers, {'Cache-Control': 'no-cache'})
+        self.assertEqual(
+            [json.loads(event[len('data: '):])['rows'] for event in body],
+            [1000, 1200])
+
+        # Long polling returns the first change
+        body, mimetype, headers = helpers.report_progress_response({
+            'report': 'super_basic_report',
+        }, cache=self.mock_cache, stream=False)
+        response = json.loads(body)
+        self.assertEqual(response['poll'], False)
+        self.assertEqual(response['progress']['stage'], 'failed')
+
+    def test_report_batch_response(self):
+        body, mimetype, headers = helpers.report_batch_response([
+            {'report': 'super_basic_report', 'iDisplayStart': '0',
+                'iDisplayLength': '2', 'sEcho': '3'},
+            {'report': 'super_basic_report', 'metadata': '1'},
+            {'report': 'nonexistent'},
+            {'report': 'super_basic_report', 'iDisplayStart': '2',
+                'iDisplayLength': '2', 'sEcho': '4'},
+        ], cache=CACHE)
+        self.assertEqual(mimetype, 'application/javascript')
+        responses = json.loads(body)
+        self.assertEqual(len(responses), 4)
+        self.assertEqual(responses[0]['aaData'], [[1, '1'], [2, '1']])
+        self.assertEqual(responses[0]['sEcho'], '3')
+        self.assertEqual(responses[0]['poll'], False)
+        self.assertEqual(responses[1]['default_sort'], ['id', 'desc'])
+        self.assertEqual(responses[2]['errors'], ['Specified report not found.'])
+        self.assertEqual(responses[3]['aaData'], [[3, '1']])
+        self.assertEqual(responses[3]['iTotalRecords'], 3)
+
+    def test_report_batch_response_runner(self):
+        self.mock_cache.instance_pages.return_value = [None, None]
+        self.mock_cache.is_instance_started.return_value = False
+        params = {'report': 'super_basic_report', 'iDisplayStart': '0',
+            'iDisplayLength': '10', 'sEcho': '1'}
+        body, mimetype, headers = helpers.report_batch_response(
+            [dict(params), dict(params)], runner=self.mock_runner,
+            cache=self.mock_cache)
+        self.assertEqual(json.loads(body),
+            [{'errors': [], 'poll': True}, {'errors': [], 'poll': True}])
+        self.assertEqual(self.mock_cache.instance_pages.call_count, 1)
+        self.assertEqual(self.mock_runner.call_count, 2)
+
     def test_report_response_runner(self):
         # Runner gets run
         self.mock_cache.is_instance_started.return_value = False
@@ -116,8 +281,33 @@ class TestFrontendHelpers(unittest.TestCase):
             'sEcho': '1',
         }, cache=self.mock_cache)
         response = json.loads(body)
-        self.assertTrue(self.mock_cache.instance_rows.called)
-        self.assertTrue(self.mock_cache.instance_footer.called)
+        self.assertTrue(self.mock_cache.instance_page.called)
+        self.assertFalse(self.mock_cache.instance_rows.called)
         self.assertEqual(response['errors'], [])
         self.assertEqual(response['poll'], False)
         self.assertEqual(response['aaData'], [])
+
+    def test_report_response_default_cache(self):
+        # The default cache is created on first use, then reused
+        self.mock_cache.is_instance_started.return_value = False
+        self.mock_cache.is_instance_finished.return_value = False
+        with patch.object(helpers, '_default_cache', None):
+            with patch('blingalytics.caches.local_cache.LocalCache') as local:
+                local.return_value = self.mock_cache
+                body, mimetype, headers = helpers.report_response({
+                    'report': 'super_basic_report',
+                    'iDisplayStart': '0',
+                    'iDisplayLength': '10',
+                    'sEcho': '1',
+                })
+                self.assertEqual(json.loads(body)['errors'], [])
+                self.assertTrue(self.mock_cache.instance_page.called)
+                self.assertTrue(helpers.get_default_cache() is self.mock_cache)
+                self.assertEqual(local.call_count, 1)
+
+                # It's also available under its old name
+                report = reports_basic.SuperBasicReport(helpers.DEFAULT_CACHE)
+                self.assertFalse(report.is_report_finished())
+                with helpers.DEFAULT_CACHE:
+                    self.assertTrue(self.mock_cache.__enter__.called)
+                self.assertEqual(local.call_count, 1)
@@ -4,7 +4,8 @@ blingalytics package itself:
 
 * You should have postgresql installed, with a "bling" user whose password is
   set to "bling", and a database named "bling" owned by "bling".
-* You need the following Python packages installed: mock, django and psycopg2.
+* You need the following Python packages installed: mock, django, psycopg2
+  and pyarrow.
 
 To run the tests, simply run this file::
 
@@ -32,12 +33,21 @@ if __name__ == '__main__':
     suite = unittest.TestLoader().loadTestsFromNames([
         'test_base',
         'test_helpers',
+        'caches.test_local_cache',
+        'caches.test_mmap_cache',
         'caches.test_redis_cache',
+        'caches.test_snapshots',
+        'caches.test_tiered_cache',
+        'exports.test_arrow',
+        'exports.test_xlsx',
         'sources.test_base',
         'sources.test_derived',
         'sources.test_django_orm',
-        # 'sources.test_merge',
+        'sources.test_merge',
         'sources.test_static',
+        'utils.test_codec',
+        'utils.test_locale_format',
+        'utils.test_concurrency',
     ])
     result = unittest.TextTestRunner(verbosity=1).run(suite)
     sys.exit(len(result.errors) + len(result.failures))
@@ -0,0 +1,124 @@
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+import os
+import random
+import tempfile
+import unittest
+
+from blingalytics.caches.local_cache import LocalCache
+from blingalytics.utils.codec import FALLBACK, RowCodec, sort_key
+
+
+ROWS = [
+    {'id': 1, 'name': u'J\xe9ff', 'code': 'a', 'price': 1.5, 'active': True,
+        'amount': Decimal('1.50'), 'day': date(2011, 1, 2),
+        'time': datetime(2011, 1, 2, 3, 4, 5, 6), 'length': timedelta(1, 2, 3),
+        'tags': [1, 2]},
+    {'id': 2, 'name': None, 'code': '', 'price': None, 'active': False,
+        'amount': Decimal('-1234567.89'), 'day': date(1901, 12, 31),
+        'time': datetime(1901, 1, 1), 'length': timedelta(-3, 2),
+        'tags': None},
+    {'id': 2 ** 70, 'name': 3, 'code': u'c', 'price': 3, 'active': 1,
+        'amount': Decimal('3.0'), 'day': datetime(2011, 1, 2),
+        'time': date(2011, 1, 2), 'length': None, 'tags': []},
+    {'id': -5, 'name': u'', 'code': 'b', 'price': -0.0, 'active': None,
+        'amount': Decimal('-0.00'), 'day': None, 'time': None,
+        'length': timedelta(0), 'tags': [u'a']},
+]
+
+
+class TestRowCodec(unittest.TestCase):
+    def test_schema(self):
+        codec = RowCodec.from_row(ROWS[0])
+        self.assertEqual(codec.schema, [
+            ('active', 'bool', None),
+            ('amount', 'decimal', -2),
+            ('code', 'str', None),
+            ('day', 'date', None),
+            ('id', 'int', None),
+            ('length', 'timedelta', None),
+            ('name', 'unicode', None),
+            ('price', 'float', None),
+            ('tags', 'tagged', None),
+            ('time', 'datetime', None),
+        ])
+        self.assertEqual(RowCodec.loads(codec.dumps()).schema, codec.schema)
+
+    def test_schema_from_rows(self):
+        rows = [
+            {'amount': Decimal('0'), 'name': None, 'empty': None},
+            {'amount': Decimal('12.34'), 'name': u'Jeff', 'empty': None},
+            {'amount': None, 'name': u'Tracy', 'empty': None},
+        ]
+        codec = RowCodec.from_rows(rows)
+        self.assertEqual(codec.schema, [
+            ('amount', 'decimal', -2),
+            ('empty', 'tagged', None),
+            ('name', 'unicode', None),
+        ])
+
+        # Decimals with fewer places are still stored scaled, and decode to
+        # identical values
+        for row in rows + [{'amount': Decimal('1.5E+3'), 'name': None, 'empty': None}]:
+            data = codec.encode(row)
+            self.assertNotEqual(codec._struct.unpack_from(data)[0], FALLBACK)
+            decoded = codec.decode(data)
+            self.assertEqual(decoded, row)
+            self.assertEqual(str(decoded['amount']), str(row['amount']))
+
+        # Decimals with more places than any in the sample fall back
+        row = {'amount': Decimal('1.234'), 'name': None, 'empty': None}
+        data = codec.encode(row)
+        self.assertEqual(codec._struct.unpack_from(data)[0], FALLBACK)
+        self.assertEqual(str(codec.decode(data)['amount']), '1.234')
+
+    def test_round_trip(self):
+        codec = RowCodec.loads(RowCodec.from_row(ROWS[0]).dumps())
+        for row in ROWS:
+            decoded = codec.decode(codec.encode(row))
+            self.assertEqual(decoded, row)
+            for name, value in row.items():
+                self.assertTrue(type(decoded[name]) is type(value))
+                if type(value) is Decimal:
+                    self.assertEqual(str(decoded[name]), str(value))
+
+    def test_sort_key(self):
+        values = [
+            None, float('-inf'), -1e30, -2 ** 70, -2 ** 64, Decimal('-10.5'),
+            -10, -9.75, -1, Decimal('-0.10000000000000000001'),
+            Decimal('-0.1'), Decimal('-0.01'), 0, 0.25, Decimal('0.5'), 1,
+            Decimal('1.000001'), 1.5, Decimal('1.50000000000000000001'),
+            2 ** 40, 2 ** 64, 2 ** 70, 1e30, Decimal('Infinity'), float('nan'),
+            '', u'a', 'ab', u'\xe9', date(1901, 1, 1), date(2011, 1, 2),
+            datetime(1901, 1, 1), datetime(2011, 1, 2, 3, 4, 5, 6),
+            timedelta(-1), timedelta(0), timedelta(0, 0, 1), timedelta(3),
+        ]
+        shuffled = list(values)
+        random.shuffle(shuffled)
+        self.assertEqual(sorted(shuffled, key=sort_key), values)
+        self.assertEqual(sort_key(1), sort_key(Decimal('1.00')))
+        self.assertEqual(sort_key(1), sort_key(1.0))
+        self.assertEqual(sort_key(Decimal('-0.00')), sort_key(0))
+        self.assertNotEqual(sort_key(Decimal('0.1')),
+            sort_key(Decimal('0.10000000000000000001')))
+        self.assertNotEqual(sort_key(2 ** 64), sort_key(2 ** 70))
+
+    def test_local_cache(self):
+        fd, database = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            cache = LocalCache(database, binary_rows=True)
+            rows = [dict(row, key=i) for i, row in enumerate(ROWS)]
+            cache.create_instance('report', 'xyz', iter(rows), lambda: {}, 3600)
+            cached = list(cache.instance_rows('report', 'xyz', limit=2,
+                offset=1))
+            self.assertEqual([row.pop('_bling_id') for row in cached], [2, 3])
+            self.assertEqual(cached, rows[1:3])
+
+            # Sorting works on the raw stored keys
+            cached = cache.instance_rows('report', 'xyz', sort=('amount', 'desc'))
+            self.assertEqual([row['key'] for row in cached], [2, 0, 3, 1])
+            cached = cache.instance_rows('report', 'xyz', sort=('id', 'asc'))
+            self.assertEqual([row['key'] for row in cached], [3, 0, 1, 2])
+        finally:
+            os.remove(database)
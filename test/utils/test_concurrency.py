@@ -0,0 +1,29 @@
+import threading
+import time
+import unittest
+
+from blingalytics.utils.concurrency import map_threaded
+
+
+class TestConcurrency(unittest.TestCase):
+    def test_map_threaded(self):
+        self.assertEqual(map_threaded(lambda x: x * 2, [1, 2, 3], 1), [2, 4, 6])
+        self.assertEqual(map_threaded(lambda x: x * 2, iter([1, 2, 3]), 4),
+            [2, 4, 6])
+        self.assertEqual(map_threaded(lambda x: x, [], 4), [])
+
+        # Calls overlap with several workers
+        threads = set()
+        def record(x):
+            threads.add(threading.current_thread().ident)
+            time.sleep(0.05)
+            return x
+        self.assertEqual(map_threaded(record, range(4), 4), range(4))
+        self.assertEqual(len(threads), 4)
+
+    def test_map_threaded_errors(self):
+        def fail(x):
+            if x == 2:
+                raise ValueError('Two')
+            return x
+        self.assertRaises(ValueError, map_threaded, fail, [1, 2, 3], 3)
@@ -0,0 +1,60 @@
+from decimal import Decimal
+import locale
+import unittest
+
+from blingalytics.utils.locale_format import NumberFormatter
+
+
+EN_US = {
+    'decimal_point': '.', 'thousands_sep': ',', 'grouping': [3, 3, 0],
+    'mon_decimal_point': '.', 'mon_thousands_sep': ',',
+    'mon_grouping': [3, 3, 0], 'currency_symbol': '$', 'int_curr_symbol': 'USD ',
+    'frac_digits': 2, 'int_frac_digits': 2, 'positive_sign': '',
+    'negative_sign': '-', 'p_cs_precedes': 1, 'n_cs_precedes': 1,
+    'p_sep_by_space': 0, 'n_sep_by_space': 0, 'p_sign_posn': 1,
+    'n_sign_posn': 1,
+}
+DE_DE = dict(EN_US, decimal_point=',', thousands_sep='.', grouping=[3, 0],
+    mon_decimal_point=',', mon_thousands_sep='.', currency_symbol='EUR',
+    p_cs_precedes=0, n_cs_precedes=0, p_sep_by_space=1, n_sep_by_space=1)
+
+
+class TestNumberFormatter(unittest.TestCase):
+    def test_integer(self):
+        numbers = NumberFormatter(EN_US)
+        self.assertEqual(numbers.integer(1234567, grouping=True), '1,234,567')
+        self.assertEqual(numbers.integer(-1234, grouping=True), '-1,234')
+        self.assertEqual(numbers.integer(-123, grouping=True), '-123')
+        self.assertEqual(numbers.integer(1234567), '1234567')
+
+    def test_number(self):
+        numbers = NumberFormatter(EN_US)
+        self.assertEqual(numbers.number(Decimal('1234.56'), 1, grouping=True),
+            '1,234.6')
+        self.assertEqual(numbers.number(-0.25, 2), '-0.25')
+        numbers = NumberFormatter(DE_DE)
+        self.assertEqual(numbers.number(1234567.5, 2, grouping=True),
+            '1.234.567,50')
+
+    def test_currency(self):
+        numbers = NumberFormatter(EN_US)
+        self.assertEqual(numbers.currency(Decimal('12345.67'), grouping=True),
+            '$12,345.67')
+        self.assertEqual(numbers.currency(Decimal('12345.67')), '$12345.67')
+        self.assertEqual(numbers.currency(-5), '-$5.00')
+        numbers = NumberFormatter(DE_DE)
+        self.assertEqual(numbers.currency(-1234.5, grouping=True),
+            '-1.234,50 EUR')
+
+    def test_c_locale(self):
+        numbers = NumberFormatter(dict(EN_US, grouping=[], frac_digits=127))
+        self.assertEqual(numbers.integer(1234, grouping=True), '1234')
+        self.assertRaises(ValueError, numbers.currency, 1)
+
+    def test_matches_locale(self):
+        numbers = NumberFormatter()
+        for value in [0, 7, -1234, 1234567890]:
+            self.assertEqual(numbers.integer(value, grouping=True),
+                locale.format('%d', value, grouping=True))
+            self.assertEqual(numbers.number(value, 2, grouping=True),
+                locale.format('%.2f', value, grouping=True))